@@ -0,0 +1,73 @@
+'''
+douyu_api 各模块的导入耗时，并检查不需要的依赖没有在导入时被加载
+
+python benchmarks/bench_import.py [次数] [--max-ms 毫秒]
+每个模块在新的解释器中导入，取多次的中位数；
+导入后出现了不该加载的依赖，或耗时超过 --max-ms 时以非零状态退出
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# 模块 -> 导入该模块时不应加载的依赖
+MODULES = {
+    "douyu_api": ("requests", "websocket", "execjs", "pystt"),
+    "douyu_api.room": ("websocket", "execjs", "pystt"),
+    "douyu_api.stream": ("websocket", "execjs", "pystt"),
+    "douyu_api.video": ("websocket", "execjs", "pystt"),
+    "douyu_api.supervisor": ("websocket", "execjs", "pystt"),
+    "douyu_api.barrage": ("websocket", "execjs", "pystt", "requests"),
+    "douyu_api.hub": ("websocket", "execjs", "pystt", "requests"),
+    "douyu_api.replay": ("websocket", "execjs", "pystt", "requests"),
+    "douyu_api.archive": ("websocket", "execjs", "pystt", "requests", "zstandard"),
+}
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": sorted(sys.modules)}}))
+'''
+
+
+def measure(module: str) -> dict:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module)],
+        check=True,
+        stdout=subprocess.PIPE,
+        env=env,
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="douyu_api 导入耗时")
+    parser.add_argument("number", nargs="?", type=int, default=5, help="每个模块导入的次数")
+    parser.add_argument("--max-ms", type=float, default=None, help="单个模块导入耗时的上限")
+    args = parser.parse_args()
+
+    failed = False
+    for module, forbidden in MODULES.items():
+        results = [measure(module) for _ in range(args.number)]
+        ms = statistics.median(result["seconds"] for result in results) * 1000
+        loaded = [name for name in forbidden if name in results[0]["modules"]]
+        status = ""
+        if loaded:
+            status = f"  导入了 {', '.join(loaded)}"
+            failed = True
+        if args.max_ms is not None and ms > args.max_ms:
+            status += f"  超过 {args.max_ms:.0f} ms"
+            failed = True
+        print(f"{module:<24}{ms:>8.1f} ms{status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+'''
+弹幕客户端的回放基准测试：消息吞吐、单条消息处理耗时的 p99 和内存分配
+
+python benchmarks/bench_replay.py [录制文件] [--messages 条数]
+没有录制文件时使用生成的混合流量，录制文件可以通过
+python -m douyu_api.barrage 房间ID --record 录制文件 得到
+'''
+import argparse
+import random
+import time
+import tracemalloc
+
+from douyu_api import stt
+from douyu_api.replay import ReplayClient, ReplayDriver, load_frames
+from douyu_api.sink import CallableSink
+
+# 生成流量中各类消息的比例
+MIX = (
+    ("chatmsg", 60),
+    ("uenter", 25),
+    ("dgb", 10),
+    ("noble_num_info", 3),
+    ("frank", 2),
+)
+
+
+def make_message(data_type: str, i: int) -> str:
+    if data_type == "chatmsg":
+        return stt.dumps(
+            {
+                "type": "chatmsg", "rid": "9999", "ct": "14", "uid": str(100000 + i),
+                "nn": f"测试用户/@{i % 500}", "txt": f"主播666，这波操作@所有人/看看 {i}",
+                "cid": "e3a34c0aa8ab4e1c0000000000000000",
+                "ic": "avatar_v3/202110/0123456789abcdef", "level": str(i % 60),
+                "sahf": "0", "nl": "3", "cst": str(1634567890123 + i * 10),
+                "bnn": "粉丝牌", "bl": "12", "brid": "9999", "el": [], "dms": "4",
+            }
+        )
+    if data_type == "uenter":
+        return stt.dumps(
+            {
+                "type": "uenter", "rid": "9999", "uid": str(100000 + i),
+                "nn": f"测试用户{i % 500}", "level": "15", "nl": "0",
+                "el": [{"eid": "1500000005", "etp": "1", "sc": "1"}],
+            }
+        )
+    if data_type == "dgb":
+        return stt.dumps(
+            {
+                "type": "dgb", "rid": "9999", "gfid": "824", "gfcnt": "1", "hits": "3",
+                "uid": str(100000 + i), "nn": f"测试用户{i % 500}", "level": "20",
+                "bnn": "粉丝牌", "bl": "8",
+            }
+        )
+    if data_type == "noble_num_info":
+        return stt.dumps({"type": "noble_num_info", "sum": "88", "rid": "9999"})
+    return stt.dumps({"type": data_type, "rid": "9999", "list": [{"uid": "1", "f": "1"}]})
+
+
+def generate_frames(count: int, seed: int = 1) -> list:
+    '''
+    生成 count 条 WebSocket 消息，每条包含 1~5 个数据帧，
+    偶尔把一个数据帧拆到两条消息中
+    '''
+    rng = random.Random(seed)
+    types = [data_type for data_type, weight in MIX for _ in range(weight)]
+    frames = []
+    pending = b""
+    timestamp = time.time()
+    i = 0
+    while len(frames) < count:
+        data = pending
+        for _ in range(rng.randint(1, 5)):
+            data += stt.encode_frame(make_message(rng.choice(types), i), stt.SERVER_MSG_TYPE)
+            i += 1
+        pending = b""
+        if rng.random() < 0.05:
+            cut = rng.randint(1, len(data) - 1)
+            data, pending = data[:cut], data[cut:]
+        timestamp += rng.expovariate(200)
+        frames.append((timestamp, data))
+    return frames
+
+
+def run(name: str, frames: list, **client_kwargs) -> None:
+    sink = CallableSink(lambda batch: None, batch_size=10000)
+    try:
+        client = ReplayClient("9999", storage=sink, **client_kwargs)
+        result = ReplayDriver(client).run(frames)
+
+        # 内存分配单独测一遍，tracemalloc 会拖慢处理速度
+        client = ReplayClient("9999", storage=sink, **client_kwargs)
+        driver = ReplayDriver(client)
+        tracemalloc.start()
+        for _, message in frames:
+            driver.feed(message)
+        sink.flush()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        sink.close()
+    print(
+        f"{name:<28}"
+        f"{result['frames_per_second']:>10.0f} 条/秒"
+        f"{result['items'] / result['seconds']:>10.0f} 对象/秒"
+        f"{result['p50'] * 1e6:>9.1f} us p50"
+        f"{result['p99'] * 1e6:>9.1f} us p99"
+        f"{peak / 1024:>9.0f} KiB 峰值"
+        f"{current / len(frames):>8.0f} B/条 留存"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="弹幕客户端回放基准测试")
+    parser.add_argument("path", nargs="?", help="FrameRecorder 录制的文件")
+    parser.add_argument("--messages", type=int, default=50000, help="生成的消息条数")
+    args = parser.parse_args()
+
+    if args.path:
+        frames = load_frames(args.path)
+    else:
+        frames = generate_frames(args.messages)
+    print(f"{len(frames)} 条消息，{sum(len(m) for _, m in frames) / 1024 / 1024:.1f} MiB")
+    run("全部消息类型", frames)
+    run("全部消息类型 raw_time", frames, raw_time=True)
+    run("只订阅 chatmsg", frames, message_types={"chatmsg"})
+    run("只订阅 chatmsg raw_time", frames, message_types={"chatmsg"}, raw_time=True)
+
+
+if __name__ == "__main__":
+    main()
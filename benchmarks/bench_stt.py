@@ -0,0 +1,85 @@
+'''
+STT解析的微基准测试，对比内置编解码器与 pystt
+
+python benchmarks/bench_stt.py [次数]
+'''
+import sys
+import timeit
+
+from douyu_api import stt
+from douyu_api.model import Barrage
+
+try:
+    import pystt
+except ImportError:
+    pystt = None
+
+CHATMSG = stt.dumps(
+    {
+        "type": "chatmsg",
+        "rid": "9999",
+        "ct": "14",
+        "uid": "123456789",
+        "nn": "测试用户/@昵称",
+        "txt": "主播666，这波操作@所有人/看看",
+        "cid": "e3a34c0aa8ab4e1c0000000000000000",
+        "ic": "avatar_v3/202110/0123456789abcdef",
+        "level": "32",
+        "sahf": "0",
+        "nl": "3",
+        "cst": "1634567890123",
+        "bnn": "粉丝牌",
+        "bl": "12",
+        "brid": "9999",
+        "hc": "0123456789abcdef0123456789abcdef",
+        "el": [],
+        "lk": "",
+        "dms": "4",
+        "pdg": "27",
+        "pdk": "93",
+        "ext": "",
+    }
+)
+UENTER = stt.dumps(
+    {
+        "type": "uenter",
+        "rid": "9999",
+        "uid": "123456789",
+        "nn": "测试用户",
+        "level": "15",
+        "ic": "avatar_v3/202110/0123456789abcdef",
+        "nl": "0",
+        "rni": "0",
+        "el": [{"eid": "1500000005", "etp": "1", "sc": "1"}],
+        "sahf": "0",
+        "wgei": "0",
+    }
+)
+CHATMSG_BYTES = CHATMSG.encode('utf-8')
+UENTER_BYTES = UENTER.encode('utf-8')
+
+
+def bench(name, func, number):
+    seconds = timeit.timeit(func, number=number)
+    print(f"{name:<36}{seconds / number * 1e6:>10.2f} us/帧")
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    selector = stt.FieldSelector(Barrage.CHATMSG_FIELDS)
+    chatmsg = memoryview(CHATMSG_BYTES)
+    uenter = memoryview(UENTER_BYTES)
+
+    if pystt:
+        bench("pystt.loads chatmsg", lambda: pystt.loads(str(chatmsg, 'utf-8')), number)
+    else:
+        print("未安装 pystt，跳过对比项")
+    bench("stt.loads chatmsg", lambda: stt.loads(chatmsg), number)
+    bench("stt.FieldSelector chatmsg", lambda: selector(chatmsg), number)
+    if pystt:
+        bench("pystt.loads uenter", lambda: pystt.loads(str(uenter, 'utf-8')), number)
+    bench("stt.peek_type uenter (跳过)", lambda: stt.peek_type(uenter), number)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,34 @@
+import importlib
 import logging
 
 logger = logging.getLogger("douyu_api")
+
+# 可以从 douyu_api 直接导入的类 -> 所在模块
+# 模块在第一次访问时才导入，只用到 RoomClient 的进程不会导入 websocket、execjs 等依赖
+_LAZY_ATTRS = {
+    "RoomClient": "douyu_api.room",
+    "StreamClient": "douyu_api.stream",
+    "StreamSupervisor": "douyu_api.supervisor",
+    "VideoClient": "douyu_api.video",
+    "VideoDownloadManager": "douyu_api.video",
+    "BarrageClient": "douyu_api.barrage",
+    "AsyncBarrageClient": "douyu_api.hub",
+    "BarrageHub": "douyu_api.hub",
+    "BarrageArchive": "douyu_api.archive",
+    "Signer": "douyu_api.sign",
+}
+
+__all__ = ["logger", *_LAZY_ATTRS]
+
+
+def __getattr__(name: str):
+    module = _LAZY_ATTRS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
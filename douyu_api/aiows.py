@@ -0,0 +1,246 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import socket
+import ssl
+import struct
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# RFC 6455 中规定的握手校验字符串
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class ConnectionClosed(Exception):
+    """WebSocket连接已关闭"""
+
+    def __init__(self, message: str, code: int = None, reason: str = "") -> None:
+        super().__init__(message)
+        # 服务端 close 帧中的状态码和原因
+        self.code = code
+        self.reason = reason
+
+
+class WebSocket:
+    '''
+    基于 asyncio 的最小 WebSocket 客户端，只实现弹幕服务需要的部分
+    '''
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        max_size: int = 16 * 1024 * 1024,
+    ) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.max_size = max_size
+        self.closed = False
+
+    @classmethod
+    async def connect(
+        cls,
+        url: str,
+        timeout: float = 15,
+        proxy_host: str = None,
+        proxy_port: int = None,
+        **kwargs,
+    ) -> "WebSocket":
+        '''
+        建立连接并完成握手，url 支持 ws:// 和 wss://
+        proxy_host / proxy_port: HTTP 代理，通过 CONNECT 建立隧道
+        '''
+        parsed = urlparse(url)
+        secure = parsed.scheme == "wss"
+        port = parsed.port or (443 if secure else 80)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        ssl_context = ssl.create_default_context() if secure else None
+        if proxy_host:
+            sock = await asyncio.wait_for(
+                cls._proxy_tunnel(proxy_host, int(proxy_port or 80), parsed.hostname, port),
+                timeout,
+            )
+            connection = asyncio.open_connection(
+                sock=sock,
+                ssl=ssl_context,
+                server_hostname=parsed.hostname if secure else None,
+            )
+        else:
+            connection = asyncio.open_connection(parsed.hostname, port, ssl=ssl_context)
+        reader, writer = await asyncio.wait_for(connection, timeout)
+        websocket = cls(reader, writer, **kwargs)
+        try:
+            await asyncio.wait_for(
+                websocket._handshake(parsed.hostname, port, path), timeout
+            )
+        except BaseException:
+            writer.close()
+            raise
+        return websocket
+
+    @staticmethod
+    async def _proxy_tunnel(
+        proxy_host: str, proxy_port: int, host: str, port: int
+    ) -> socket.socket:
+        '''通过 HTTP 代理的 CONNECT 建立到 host:port 的隧道，返回已连接的 socket'''
+        loop = asyncio.get_event_loop()
+        infos = await loop.getaddrinfo(proxy_host, proxy_port, type=socket.SOCK_STREAM)
+        family, type_, proto, _, address = infos[0]
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, address)
+            request = (
+                f"CONNECT {host}:{port} HTTP/1.1\r\n"
+                f"Host: {host}:{port}\r\n"
+                "\r\n"
+            )
+            await loop.sock_sendall(sock, request.encode())
+            # 逐字节读取响应头，隧道建立后的数据不能被多读
+            response = b""
+            while not response.endswith(b"\r\n\r\n"):
+                chunk = await loop.sock_recv(sock, 1)
+                if not chunk:
+                    raise ConnectionError("代理服务器关闭了连接")
+                response += chunk
+            status = response.split(b"\r\n", 1)[0].decode("latin-1")
+            if len(status.split()) < 2 or status.split()[1] != "200":
+                raise ConnectionError(f"代理连接失败:{status}")
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    async def _handshake(self, host: str, port: int, path: str) -> None:
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            "\r\n"
+        )
+        self.writer.write(request.encode())
+        response = await self.reader.readuntil(b"\r\n\r\n")
+        lines = response.decode("latin-1").split("\r\n")
+        if len(lines[0].split()) < 2 or lines[0].split()[1] != "101":
+            raise ConnectionError(f"WebSocket握手失败:{lines[0]}")
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        accept = base64.b64encode(
+            hashlib.sha1((key + WS_GUID).encode()).digest()
+        ).decode()
+        if headers.get("sec-websocket-accept") != accept:
+            raise ConnectionError("WebSocket握手校验失败")
+
+    @staticmethod
+    def _mask(payload: bytes, mask: bytes) -> bytes:
+        length = len(payload)
+        if not length:
+            return payload
+        # 整体按大整数异或，避免逐字节循环
+        repeated = (mask * (length // 4 + 1))[:length]
+        return (
+            int.from_bytes(payload, "big") ^ int.from_bytes(repeated, "big")
+        ).to_bytes(length, "big")
+
+    def send_frame(self, opcode: int, payload: bytes = b"") -> None:
+        '''
+        写入一个数据帧，客户端发送的数据帧必须使用掩码
+        写入是非阻塞的，数据由事件循环在后台发送
+        '''
+        if self.closed:
+            raise ConnectionClosed("连接已关闭")
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, 0x80 | length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 0x80 | 127, length)
+        mask = os.urandom(4)
+        self.writer.write(header + mask + self._mask(payload, mask))
+
+    def send(self, data: bytes) -> None:
+        self.send_frame(OP_BINARY, data)
+
+    async def drain(self) -> None:
+        await self.writer.drain()
+
+    async def _read_frame(self) -> "tuple[bool, int, bytes]":
+        head = await self.reader.readexactly(2)
+        fin = head[0] & 0x80
+        opcode = head[0] & 0x0F
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+        if length > self.max_size:
+            raise ConnectionError(f"WebSocket数据帧过大:{length}")
+        if head[1] & 0x80:
+            # 服务端不应该使用掩码，兼容处理
+            mask = await self.reader.readexactly(4)
+            payload = self._mask(await self.reader.readexactly(length), mask)
+        else:
+            payload = await self.reader.readexactly(length)
+        return bool(fin), opcode, payload
+
+    async def recv(self) -> bytes:
+        '''
+        读取一条完整的消息，自动处理分片、ping 和 close
+        '''
+        fragments = []
+        while True:
+            try:
+                fin, opcode, payload = await self._read_frame()
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                self.closed = True
+                raise ConnectionClosed(str(e)) from e
+            if opcode == OP_PING:
+                self.send_frame(OP_PONG, payload)
+                continue
+            elif opcode == OP_PONG:
+                continue
+            elif opcode == OP_CLOSE:
+                if not self.closed:
+                    self.send_frame(OP_CLOSE, payload[:2])
+                    self.closed = True
+                code = None
+                if len(payload) >= 2:
+                    code = struct.unpack("!H", payload[:2])[0]
+                reason = payload[2:].decode("utf-8", errors="ignore")
+                message = f"服务端关闭连接:{code} {reason}" if reason else f"服务端关闭连接:{code}"
+                raise ConnectionClosed(message, code, reason)
+            fragments.append(payload)
+            if fin:
+                if len(fragments) == 1:
+                    return fragments[0]
+                return b"".join(fragments)
+
+    async def close(self, code: int = 1000) -> None:
+        if not self.closed:
+            try:
+                self.send_frame(OP_CLOSE, struct.pack("!H", code))
+                await self.writer.drain()
+            except (ConnectionError, ConnectionClosed):
+                pass
+            self.closed = True
+        self.writer.close()
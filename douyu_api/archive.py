@@ -0,0 +1,505 @@
+import bisect
+import datetime
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from douyu_api.model import TZ_UTC_8, Barrage, BarrageGap
+from douyu_api.sink import BatchSink
+
+logger = logging.getLogger(__name__)
+
+# 数据文件由若干个块组成，每个块包含一批记录，可以单独压缩和解压
+# 块头：魔数、压缩方式、压缩后长度、原始长度、记录数、最小时间戳、最大时间戳
+BLOCK_MAGIC = b"DYB1"
+BLOCK_HEADER = struct.Struct("<4sBIIIqq")
+# 记录头：记录长度（不含这 4 字节）、毫秒时间戳、记录类型
+RECORD_HEADER = struct.Struct("<IqB")
+# 弹幕记录的字段长度：用户ID、昵称、等级、内容
+BARRAGE_FIELDS = struct.Struct("<HHHH")
+# 有字段超过 65535 字节时使用 4 字节的长度
+BARRAGE_LONG_FIELDS = struct.Struct("<IIII")
+# 稀疏索引，每个块一项：最小时间戳、最大时间戳、块在数据文件中的偏移
+INDEX_ENTRY = struct.Struct("<qqQ")
+
+# 记录类型
+RECORD_BARRAGE = 0
+RECORD_JSON = 1  # 其他对象，保存 to_json 的结果
+RECORD_BARRAGE_LONG = 2  # 字段长度为 4 字节的弹幕
+
+# 块的压缩方式
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODECS = {None: CODEC_NONE, "none": CODEC_NONE, "zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+
+DATA_SUFFIX = ".dyb"
+INDEX_SUFFIX = ".idx"
+
+
+def _zstd():
+    '''zstandard 是可选依赖，用到时才导入'''
+    import zstandard
+
+    return zstandard
+
+
+def zstd_available() -> bool:
+    try:
+        _zstd()
+    except ImportError:
+        return False
+    return True
+
+
+def to_ms(value: "datetime.datetime|int|float") -> int:
+    '''datetime 或毫秒时间戳转为毫秒时间戳'''
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=TZ_UTC_8)
+        return int(value.timestamp() * 1000)
+    return int(value)
+
+
+def day_of(ms: int) -> str:
+    '''毫秒时间戳对应的北京时间日期，如 20240101'''
+    return datetime.datetime.fromtimestamp(ms / 1000, tz=TZ_UTC_8).strftime("%Y%m%d")
+
+
+def archive_path(root: str, room_id: str, day: str) -> str:
+    return os.path.join(root, str(room_id), day + DATA_SUFFIX)
+
+
+def encode_record(item) -> "tuple[int, bytes]":
+    '''编码一条记录，返回 (毫秒时间戳, 记录字节)'''
+    if isinstance(item, Barrage):
+        ms = item.cst
+        if ms is None:
+            ms = int(item.send_time.timestamp() * 1000) if item.send_time else None
+        if ms is None:
+            ms = int(time.time() * 1000)
+        fields = [
+            str(value).encode("utf-8") if value is not None else b""
+            for value in (item.user_id, item.nick_name, item.level, item.content)
+        ]
+        lengths = [len(field) for field in fields]
+        if max(lengths) <= 0xFFFF:
+            body = BARRAGE_FIELDS.pack(*lengths) + b"".join(fields)
+            kind = RECORD_BARRAGE
+        else:
+            body = BARRAGE_LONG_FIELDS.pack(*lengths) + b"".join(fields)
+            kind = RECORD_BARRAGE_LONG
+    else:
+        if isinstance(item, BarrageGap):
+            ms = item.start
+        else:
+            ms = int(time.time() * 1000)
+        if hasattr(item, "to_json"):
+            text = item.to_json()
+        else:
+            text = json.dumps(item, ensure_ascii=False, default=str)
+        body = text.encode("utf-8")
+        kind = RECORD_JSON
+    ms = int(ms)
+    return ms, RECORD_HEADER.pack(RECORD_HEADER.size - 4 + len(body), ms, kind) + body
+
+
+def decode_records(room_id: str, data: bytes, start: int = None, end: int = None):
+    '''解码一个块中的记录，只返回时间戳在 [start, end) 之间的记录'''
+    view = memoryview(data)
+    unpack_header = RECORD_HEADER.unpack_from
+    unpack_fields = BARRAGE_FIELDS.unpack_from
+    pos = 0
+    total = len(data)
+    while pos < total:
+        length, ms, kind = unpack_header(view, pos)
+        body = pos + RECORD_HEADER.size
+        pos += 4 + length
+        if (start is not None and ms < start) or (end is not None and ms >= end):
+            continue
+        if kind == RECORD_BARRAGE or kind == RECORD_BARRAGE_LONG:
+            if kind == RECORD_BARRAGE:
+                lengths = unpack_fields(view, body)
+                offset = body + BARRAGE_FIELDS.size
+            else:
+                lengths = BARRAGE_LONG_FIELDS.unpack_from(view, body)
+                offset = body + BARRAGE_LONG_FIELDS.size
+            values = []
+            for size in lengths:
+                values.append(str(view[offset:offset + size], "utf-8"))
+                offset += size
+            user_id, nick_name, level, content = values
+            yield Barrage(
+                room_id=room_id,
+                user_id=user_id,
+                nick_name=nick_name,
+                level=level,
+                content=content,
+                cst=ms,
+            )
+        else:
+            yield json.loads(str(view[body:pos], "utf-8"))
+
+
+class _Block:
+    '''正在攒的块'''
+
+    __slots__ = ("records", "size", "first_ts", "last_ts", "created")
+
+    def __init__(self) -> None:
+        self.records = []
+        self.size = 0
+        self.first_ts: int = None
+        self.last_ts: int = None
+        self.created = time.monotonic()
+
+    def add(self, ms: int, record: bytes) -> None:
+        self.records.append(record)
+        self.size += len(record)
+        if self.first_ts is None or ms < self.first_ts:
+            self.first_ts = ms
+        if self.last_ts is None or ms > self.last_ts:
+            self.last_ts = ms
+
+
+class _ArchiveFile:
+    '''一个房间一天的数据文件和索引文件，只追加写入'''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        dir_path = os.path.dirname(path)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        self.size = recover(path)
+        self.fp = open(path, "ab")
+        self.index_fp = open(self.index_path, "ab")
+        self.block = _Block()
+
+    def write_block(self, block: _Block, codec: int, compress, fsync: bool) -> None:
+        raw = b"".join(block.records)
+        payload = compress(raw) if compress else raw
+        header = BLOCK_HEADER.pack(
+            BLOCK_MAGIC, codec, len(payload), len(raw), len(block.records),
+            block.first_ts, block.last_ts,
+        )
+        offset = self.size
+        self.fp.write(header + payload)
+        self.fp.flush()
+        if fsync:
+            os.fsync(self.fp.fileno())
+        # 数据写入后才写索引，索引中的块一定是完整的
+        self.index_fp.write(INDEX_ENTRY.pack(block.first_ts, block.last_ts, offset))
+        self.index_fp.flush()
+        self.size = offset + BLOCK_HEADER.size + len(payload)
+
+    def close(self) -> None:
+        self.fp.close()
+        self.index_fp.close()
+
+
+def scan_blocks(path: str) -> "tuple[list, int]":
+    '''
+    从头扫描数据文件的块头，返回 (索引项列表, 完整数据的长度)
+    末尾不完整的块不计入
+    '''
+    entries = []
+    offset = 0
+    size = os.path.getsize(path)
+    with open(path, "rb") as fp:
+        while offset + BLOCK_HEADER.size <= size:
+            fp.seek(offset)
+            magic, _, length, _, _, first_ts, last_ts = BLOCK_HEADER.unpack(
+                fp.read(BLOCK_HEADER.size)
+            )
+            end = offset + BLOCK_HEADER.size + length
+            if magic != BLOCK_MAGIC or end > size:
+                break
+            entries.append((first_ts, last_ts, offset))
+            offset = end
+    return entries, offset
+
+
+def recover(path: str) -> int:
+    '''
+    打开已有文件继续写入前，截掉末尾写了一半的块，并按数据文件重建索引
+    返回数据文件的长度
+    '''
+    index_path = path + INDEX_SUFFIX
+    if not os.path.exists(path):
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        return 0
+    entries, size = scan_blocks(path)
+    if size != os.path.getsize(path):
+        logger.warning(f"归档文件 {path} 末尾的数据不完整，已截断到 {size} 字节")
+        with open(path, "r+b") as fp:
+            fp.truncate(size)
+    expected = len(entries) * INDEX_ENTRY.size
+    if not os.path.exists(index_path) or os.path.getsize(index_path) != expected:
+        with open(index_path, "wb") as fp:
+            fp.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in entries))
+    return size
+
+
+class BarrageArchive(BatchSink):
+    '''
+    把弹幕按房间和日期追加写入紧凑的二进制文件：<root>/<房间ID>/<日期>.dyb
+
+    记录带长度前缀，成批组成块后压缩，每个块在 .idx 文件中有一项
+    (最小时间戳, 最大时间戳, 偏移)，ArchiveReader 通过索引只解压时间范围内的块。
+    弹幕之外的对象（如 BarrageGap）以 JSON 记录保存。
+    '''
+
+    def __init__(
+        self,
+        root: str = "./archive",
+        compression: str = "auto",
+        level: int = None,
+        block_size: int = 256 * 1024,
+        block_age: float = 5,
+        fsync: bool = False,
+        **kwargs,
+    ) -> None:
+        '''
+        compression: zstd / zlib / none，auto 时安装了 zstandard 则使用 zstd，否则使用 zlib
+        level: 压缩级别，为空时使用默认级别
+        block_size: 块中未压缩数据的字节数达到该值即写出
+        block_age: 块中最早的数据超过该秒数后，在下一次写出时写出
+        fsync: 每个块写出后是否调用 fsync
+        '''
+        if compression == "auto":
+            compression = "zstd" if zstd_available() else "zlib"
+        if compression not in CODECS:
+            raise ValueError(f"不支持的压缩方式:{compression}")
+        self.root = root
+        self.compression = compression
+        self.codec = CODECS[compression]
+        self.compress = self._compressor(self.codec, level)
+        self.block_size = block_size
+        self.block_age = block_age
+        self.fsync = fsync
+        # (房间ID, 日期) -> _ArchiveFile
+        self.files = {}
+        self._archive_lock = threading.Lock()
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.blocks = 0
+        super().__init__(**kwargs)
+
+    @staticmethod
+    def _compressor(codec: int, level: int = None):
+        if codec == CODEC_ZLIB:
+            level = 6 if level is None else level
+            return lambda data: zlib.compress(data, level)
+        if codec == CODEC_ZSTD:
+            compressor = _zstd().ZstdCompressor(level=3 if level is None else level)
+            return compressor.compress
+        return None
+
+    def _file(self, room_id: str, day: str) -> _ArchiveFile:
+        key = (room_id, day)
+        archive_file = self.files.get(key)
+        if archive_file is None:
+            # 同一房间前一天的文件不会再有新数据
+            for old_key in [k for k in self.files if k[0] == room_id and k[1] < day]:
+                self._close_file(old_key)
+            archive_file = _ArchiveFile(archive_path(self.root, room_id, day))
+            self.files[key] = archive_file
+        return archive_file
+
+    def _seal(self, archive_file: _ArchiveFile) -> None:
+        '''写出正在攒的块，调用时已持有锁'''
+        block = archive_file.block
+        if not block.records:
+            return
+        archive_file.block = _Block()
+        before = archive_file.size
+        archive_file.write_block(block, self.codec, self.compress, self.fsync)
+        self.raw_bytes += block.size
+        self.stored_bytes += archive_file.size - before
+        self.blocks += 1
+
+    def _close_file(self, key: tuple) -> None:
+        archive_file = self.files.pop(key)
+        try:
+            self._seal(archive_file)
+        finally:
+            archive_file.close()
+
+    def write_batch(self, batch: list) -> None:
+        with self._archive_lock:
+            for item in batch:
+                room_id = getattr(item, "room_id", None)
+                if room_id is None and isinstance(item, dict):
+                    room_id = item.get("room_id")
+                if room_id is None:
+                    continue
+                try:
+                    ms, record = encode_record(item)
+                except Exception as e:
+                    # 单条记录无法编码时跳过，不影响同一批的其他记录
+                    logger.warning(f"无法归档的记录:{str(type(e))} {str(e)}")
+                    continue
+                archive_file = self._file(str(room_id), day_of(ms))
+                archive_file.block.add(ms, record)
+                if archive_file.block.size >= self.block_size:
+                    self._seal(archive_file)
+            deadline = time.monotonic() - self.block_age
+            for archive_file in self.files.values():
+                if archive_file.block.records and archive_file.block.created <= deadline:
+                    self._seal(archive_file)
+
+    def flush(self, timeout: float = None) -> None:
+        '''写出队列中的数据以及所有未满的块'''
+        super().flush(timeout)
+        with self._archive_lock:
+            for archive_file in self.files.values():
+                self._seal(archive_file)
+
+    def on_close(self) -> None:
+        with self._archive_lock:
+            for key in list(self.files):
+                self._close_file(key)
+
+    def stats(self) -> dict:
+        info = super().stats()
+        info.update(
+            {
+                "files": len(self.files),
+                "blocks": self.blocks,
+                "raw_bytes": self.raw_bytes,
+                "stored_bytes": self.stored_bytes,
+            }
+        )
+        return info
+
+
+class ArchiveReader:
+    '''
+    读取一个归档文件，数据文件通过 mmap 映射，只解压时间范围内的块
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # 房间ID 为文件所在目录名
+        self.room_id = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        # 先读索引再映射数据文件，索引中的块在写索引之前已经写完
+        self.entries = self._load_index()
+        self.fp = open(path, "rb")
+        size = os.fstat(self.fp.fileno()).st_size
+        self.mmap = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        # 块按写入顺序排列，时间戳只是大致递增
+        # 前缀最大值和后缀最小值都是单调的，可以二分查找时间范围
+        self._max_last = []
+        current = None
+        for _, last_ts, _ in self.entries:
+            current = last_ts if current is None else max(current, last_ts)
+            self._max_last.append(current)
+        self._min_first = [0] * len(self.entries)
+        current = None
+        for i in range(len(self.entries) - 1, -1, -1):
+            first_ts = self.entries[i][0]
+            current = first_ts if current is None else min(current, first_ts)
+            self._min_first[i] = current
+
+    def _load_index(self) -> list:
+        index_path = self.path + INDEX_SUFFIX
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as fp:
+                data = fp.read()
+            # 写入中的文件，末尾可能有不完整的索引项
+            count = len(data) // INDEX_ENTRY.size
+            return [
+                INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(count)
+            ]
+        logger.warning(f"归档文件 {self.path} 没有索引，扫描数据文件")
+        return scan_blocks(self.path)[0]
+
+    def __len__(self) -> int:
+        '''块的数量'''
+        return len(self.entries)
+
+    def read_block(self, offset: int) -> bytes:
+        '''解压一个块，返回记录数据'''
+        magic, codec, length, raw_length, _, _, _ = BLOCK_HEADER.unpack_from(
+            self.mmap, offset
+        )
+        if magic != BLOCK_MAGIC:
+            raise ValueError(f"归档文件 {self.path} 在 {offset} 处不是有效的块")
+        start = offset + BLOCK_HEADER.size
+        payload = self.mmap[start:start + length]
+        if codec == CODEC_ZLIB:
+            return zlib.decompress(payload)
+        if codec == CODEC_ZSTD:
+            return _zstd().ZstdDecompressor().decompress(payload, max_output_size=raw_length)
+        return payload
+
+    def blocks(self, start: int = None, end: int = None) -> "list[int]":
+        '''与 [start, end) 有交集的块的偏移'''
+        first = 0
+        if start is not None:
+            first = bisect.bisect_left(self._max_last, start)
+        offsets = []
+        for i in range(first, len(self.entries)):
+            if end is not None and self._min_first[i] >= end:
+                break
+            first_ts, last_ts, offset = self.entries[i]
+            if start is not None and last_ts < start:
+                continue
+            if end is not None and first_ts >= end:
+                continue
+            offsets.append(offset)
+        return offsets
+
+    def read(
+        self,
+        start: "datetime.datetime|int" = None,
+        end: "datetime.datetime|int" = None,
+    ):
+        '''
+        按写入顺序返回时间范围 [start, end) 内的记录
+        弹幕返回 Barrage，其他记录返回字典
+        '''
+        start = None if start is None else to_ms(start)
+        end = None if end is None else to_ms(end)
+        for offset in self.blocks(start, end):
+            yield from decode_records(self.room_id, self.read_block(offset), start, end)
+
+    def __iter__(self):
+        return self.read()
+
+    def close(self) -> None:
+        if isinstance(self.mmap, mmap.mmap):
+            self.mmap.close()
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_archive(
+    root: str,
+    room_id: str,
+    start: "datetime.datetime|int",
+    end: "datetime.datetime|int",
+):
+    '''读取一个房间在 [start, end) 之间的记录，可以跨越多天'''
+    start = to_ms(start)
+    end = to_ms(end)
+    day = datetime.datetime.fromtimestamp(start / 1000, tz=TZ_UTC_8).date()
+    last_day = datetime.datetime.fromtimestamp((end - 1) / 1000, tz=TZ_UTC_8).date()
+    while day <= last_day:
+        path = archive_path(root, room_id, day.strftime("%Y%m%d"))
+        if os.path.exists(path):
+            with ArchiveReader(path) as reader:
+                yield from reader.read(start, end)
+        day += datetime.timedelta(days=1)
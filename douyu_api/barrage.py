@@ -3,35 +3,57 @@ import json
 import logging
 import random
 import time
+from collections import deque
 from queue import Queue
-from threading import Thread
+from threading import Event, Thread
 
-import pystt
-from websocket import WebSocketApp
-
-from douyu_api.model import Barrage
+from douyu_api import stt
+from douyu_api.model import Barrage, BarrageGap, Gift, GiftBroadcast, UserEnter
+from douyu_api.sink import BaseSink
+from douyu_api.stt import FieldSelector, FrameDecoder
 
 logger = logging.getLogger(__name__)
 
+DANMU_URL = "wss://danmuproxy.douyu.com:8503/"
+
+# 维持连接必须处理的消息类型，不受 message_types 限制
+CONTROL_TYPES = frozenset({"loginres"})
+
+# 只记录日志的消息类型：消息类型 -> (日志模板, 模板中房间ID之后的字段)
+LOG_MESSAGES = {
+    "synexp": ("房间 %s 收到了等级信息", ()),
+    "configscreen": ("房间 %s 有用户 %s 送了一个礼物", ("userName",)),
+    "ro_date_succ": ("房间 %s 有用户 %s 送了一个礼物", ("unn",)),
+    "noble_num_info": ("房间 %s 有 %s 位贵宾用户正在观看", ("sum",)),
+    "mrkl": ("房间 %s 收到了心跳", ()),
+    "pingreq": ("房间 %s 收到了pingreq信息", ()),
+    "dfrank": ("房间 %s 收到了钻粉用户信息", ()),
+    "ranklist": ("房间 %s 收到了本周点数信息", ()),
+    "frank": ("房间 %s 收到了今日点数信息", ()),
+    "newblackres": ("房间 %s 中的用户 %s 被 %s 禁言", ("dnic", "snic")),
+    "blab": ("房间 %s 中的用户 %s 粉丝牌升至 %s 级 %s", ("nn", "bl", "bnn")),
+    "srres": ("房间 %s 中的用户 %s 分享了直播间", ("nickname",)),
+}
+
+
+class BaseBarrageClient:
+    '''
+    弹幕协议的公共部分：登录、消息解析与分发，不涉及具体的网络连接方式
+    '''
 
-class BarrageClient:
     def __init__(
         self,
         room_id: str,
         username: str = None,
         uid: str = None,
-        proxy_type: str = None,
-        http_proxy_host: str = None,
-        http_proxy_port: int = None,
-        storage: Queue = None,
+        storage: "Queue|BaseSink" = None,
+        message_types: "set|list" = None,
+        raw_time: bool = False,
     ):
-        self.ws = WebSocketApp(
-            "wss://danmuproxy.douyu.com:8503/",
-            on_message=self.on_message,
-            on_error=self.on_error,
-            on_close=self.on_close,
-            on_open=self.on_open,
-        )
+        '''
+        message_types: 需要解析的消息类型，如 {"chatmsg"}，为空时解析全部类型
+        raw_time: 弹幕只保存毫秒时间戳，发送时间在第一次访问时才生成
+        '''
         # 斗鱼房间ID
         self.room_id = str(room_id)
 
@@ -46,123 +68,227 @@ class BarrageClient:
             self.uid = str(uid)
         else:
             self.uid = random_uid
-        self.proxy_type = proxy_type
-        self.http_proxy_host = http_proxy_host
-        if http_proxy_port:
-            self.http_proxy_port = str(http_proxy_port)
-        else:
-            self.http_proxy_port = None
-        self.proxies = {
-            "proxy_type": self.proxy_type,
-            "http_proxy_host": self.http_proxy_host,
-            "http_proxy_port": self.http_proxy_port,
-        }
         self.running = False
-        self.heartbeat_server: Thread = None
-        self.barrage_server: Thread = None
         self.storage = storage
+        self.raw_time = raw_time
+        # 数据帧解码器，在多条消息之间保留未完整的数据帧
+        self.decoder = FrameDecoder()
+        # 只解析订阅的消息类型，其余数据帧在反序列化前即被丢弃
+        self.message_types: frozenset = None
+        self.subscribe(message_types)
+        # 消息类型 -> 处理函数，返回值会被存入 storage
+        self.handlers = {
+            "chatmsg": self._on_chatmsg,
+            "dgb": self._on_dgb,
+            "uenter": self._on_uenter,
+            "spbc": self._on_spbc,
+            "loginres": self._on_loginres,
+        }
+        # 消息类型 -> 需要提取的字段，不在其中的消息会被完整解析
+        self.field_selectors = {
+            "chatmsg": FieldSelector(Barrage.CHATMSG_FIELDS),
+            "dgb": FieldSelector(Gift.DGB_FIELDS),
+            "uenter": FieldSelector(UserEnter.UENTER_FIELDS),
+            "spbc": FieldSelector(GiftBroadcast.SPBC_FIELDS),
+            "loginres": FieldSelector(("type", "userid")),
+        }
+        for data_type, (_, fields) in LOG_MESSAGES.items():
+            self.field_selectors[data_type] = FieldSelector(("type",) + fields)
+        # 是否已登录成功，可以收到弹幕
+        self.connected = False
+        self.connected_at: float = None
+        # 连接断开的时间：毫秒时间戳 和 time.monotonic()
+        self._gap_start: int = None
+        self._gap_started: float = None
+        # 断开后尝试连接的次数
+        self._attempts = 0
+        # 重连统计
+        self.reconnects = 0
+        self.gap_time = 0.0
+        self.reconnect_latencies = deque(maxlen=100)
 
     def parse_msg(self, data: dict):
         '''
         解析消息为内部对象
         '''
         data_type = data.get("type")
-        if data_type == "chatmsg":
-            barrage = Barrage.parse_chatmsg(data)
-            logger.debug(
-                f"房间 {barrage.room_id} 中的用户 {barrage.nick_name} 说：{barrage.content}"
+        handler = self.handlers.get(data_type)
+        if handler:
+            return handler(data)
+        log_message = LOG_MESSAGES.get(data_type)
+        if log_message:
+            if logger.isEnabledFor(logging.DEBUG):
+                template, fields = log_message
+                logger.debug(
+                    template, self.room_id, *(data.get(field, "") for field in fields)
+                )
+        elif logger.isEnabledFor(logging.WARNING):
+            logger.warning(
+                "房间 %s 中未知的消息类型:%s,%s",
+                self.room_id,
+                data_type,
+                json.dumps(data, ensure_ascii=False),
             )
-            return barrage
-        elif data_type == "synexp":
-            logger.debug(f"房间 {self.room_id} 收到了等级信息")
-        elif data_type == "dgb":
-            logger.debug(f'房间 {self.room_id} 有用户 {data.get("nn","")} 送了一个礼物')
-        elif data_type == "configscreen":
-            logger.debug(f'房间 {self.room_id} 有用户 {data.get("userName","")} 送了一个礼物')
-        elif data_type == "ro_date_succ":
-            logger.debug(f'房间 {self.room_id} 有用户 {data.get("unn","")} 送了一个礼物')
-        elif data_type == "noble_num_info":
-            logger.debug(f'房间 {self.room_id} 有 {data.get("sum","")} 位贵宾用户正在观看')
-        elif data_type == "uenter":
-            logger.debug(f'房间 {self.room_id} 有用户 {data.get("nn","")} 加入')
-        elif data_type == "mrkl":
-            logger.debug(f"房间 {self.room_id} 收到了心跳")
-        elif data_type == "pingreq":
-            logger.debug(f"房间 {self.room_id} 收到了pingreq信息")
-        elif data_type == "spbc":
+        return None
+
+    def register_handler(
+        self, data_type: str, handler: "callable", fields: "tuple|list" = None
+    ):
+        '''
+        注册消息处理函数，handler 接收消息字典，返回值会被存入 storage
+        fields: 只提取这些字段，为空时完整解析消息
+        '''
+        self.handlers[data_type] = handler
+        if fields:
+            self.field_selectors[data_type] = FieldSelector(fields)
+        else:
+            self.field_selectors.pop(data_type, None)
+
+    def subscribe(self, message_types: "set|list" = None):
+        '''
+        设置订阅的消息类型，未订阅的消息在解析和记录日志之前即被丢弃
+        message_types 为空时订阅全部类型
+        '''
+        if message_types is None:
+            self.message_types = None
+        else:
+            self.message_types = frozenset(message_types) | CONTROL_TYPES
+
+    def _on_chatmsg(self, data: dict) -> Barrage:
+        barrage = Barrage.parse_chatmsg(data, raw_time=self.raw_time)
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug(
-                f'用户 {data.get("sn","")} 在 其他房间 {data.get("drid","")} 送了一个 {data.get("gn","")}'
+                "房间 %s 中的用户 %s 说：%s",
+                barrage.room_id,
+                barrage.nick_name,
+                barrage.content,
             )
-        elif data_type == "dfrank":
-            logger.debug(f"房间 {self.room_id} 收到了钻粉用户信息")
-        elif data_type == "ranklist":
-            logger.debug(f"房间 {self.room_id} 收到了本周点数信息")
-        elif data_type == "frank":
-            logger.debug(f"房间 {self.room_id} 收到了今日点数信息")
-        elif data_type == "newblackres":
+        return barrage
+
+    def _on_dgb(self, data: dict) -> Gift:
+        gift = Gift.parse_dgb(data)
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug(
-                f'房间 {self.room_id} 中的用户 {data.get("dnic","")} 被 {data.get("snic","")} 禁言'
+                "房间 %s 有用户 %s 送了 %s 个礼物 %s",
+                self.room_id,
+                gift.nick_name,
+                gift.gift_count,
+                gift.gift_id,
             )
-        elif data_type == "blab":
+        return gift
+
+    def _on_uenter(self, data: dict) -> UserEnter:
+        user_enter = UserEnter.parse_uenter(data)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("房间 %s 有用户 %s 加入", self.room_id, user_enter.nick_name)
+        return user_enter
+
+    def _on_spbc(self, data: dict) -> GiftBroadcast:
+        broadcast = GiftBroadcast.parse_spbc(data)
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug(
-                f'房间 {self.room_id} 中的用户 {data.get("nn","")} 粉丝牌升至 {data.get("bl","")} 级 {data.get("bnn","")}'
-            )
-        elif data_type == "srres":
-            logger.debug(f'房间 {self.room_id} 中的用户 {data.get("nickname","")} 分享了直播间')
-        elif data_type == "loginres":
-            logger.info(f"房间 {self.room_id} 收到了登录回复")
-            userid = data.get("userid")
-            if str(userid) != str(self.uid):
-                self.uid = userid
-                logger.info(f"房间 {self.room_id}  的uid已更换 {self.uid}")
-
-            # 执行进入房间操作
-            self._join()
-            # 调用一个线性发送心跳
-            self.heartbeat_server = Thread(target=self.keep_alive)
-            self.heartbeat_server.start()
-        else:
-            logger.warning(
-                f"房间 {self.room_id} 中未知的消息类型:{data_type},{json.dumps(data,ensure_ascii=False)}"
+                "用户 %s 在 其他房间 %s 送了一个 %s",
+                broadcast.sender_name,
+                broadcast.target_room_id,
+                broadcast.gift_name,
             )
+        return broadcast
+
+    def _on_loginres(self, data: dict):
+        logger.info(f"房间 {self.room_id} 收到了登录回复")
+        userid = data.get("userid")
+        if str(userid) != str(self.uid):
+            self.uid = userid
+            logger.info(f"房间 {self.room_id}  的uid已更换 {self.uid}")
+
+        # 执行进入房间操作
+        self._join()
+        self._start_heartbeat()
+        return self._on_connected()
+
+    def _on_connected(self) -> "BarrageGap|None":
+        '''登录成功，如果之前断开过，返回断开的区间'''
+        self.connected = True
+        self.connected_at = time.monotonic()
+        if self._gap_started is None:
+            return None
+        latency = self.connected_at - self._gap_started
+        gap = BarrageGap(
+            room_id=self.room_id,
+            start=self._gap_start,
+            end=self._gap_start + int(latency * 1000),
+            reconnects=self._attempts,
+        )
+        self.reconnects += 1
+        self.gap_time += latency
+        self.reconnect_latencies.append(latency)
+        self._gap_start = None
+        self._gap_started = None
+        self._attempts = 0
+        logger.info(f"房间 {self.room_id} 已重新连接，弹幕中断 {latency:.3f} 秒")
+        return gap
+
+    def _on_disconnected(self) -> None:
+        '''连接断开，主动停止时不记录'''
+        self.connected = False
+        if not self.running:
+            return
+        if self._gap_started is None:
+            self._gap_started = time.monotonic()
+            self._gap_start = int(time.time() * 1000)
+        self._attempts += 1
+
+    def reconnect_stats(self) -> dict:
+        '''重连次数、累计中断秒数和重连耗时'''
+        latencies = sorted(self.reconnect_latencies)
+        return {
+            "connected": self.connected,
+            "reconnects": self.reconnects,
+            "gap_time": self.gap_time,
+            "last_latency": self.reconnect_latencies[-1] if latencies else None,
+            "max_latency": latencies[-1] if latencies else None,
+            "p50_latency": latencies[len(latencies) // 2] if latencies else None,
+        }
+
+    def _start_heartbeat(self):
+        raise NotImplementedError
+
+    def send(self, data: bytes):
+        raise NotImplementedError
 
     def obj_to_msg(self, dict_info: "dict|list|any") -> bytes:
         '''
         将对象转为ws可发送的字节流
         '''
         # 序列化为STT结构字符串
-        content = pystt.dumps(dict_info)
-        # 以UTF-8编码格式 编码字符串，字符串转化为字节流
-        content_byte = content.encode('utf-8')
-        # 头部8字节，尾部1字节，与字符串长度相加即数据长度
-        content_length = len(content_byte) + 8 + 1
-        # 将数据长度转化为小端整数字节流
-        length_byte = int.to_bytes(content_length, length=4, byteorder='little')
-
-        # 前两个字节按照小端顺序拼接为0x02b1，转化为十进制即689（《协议》中规定的客户端发送消息类型）
-        # 后两个字节即《协议》中规定的加密字段与保留字段，置0
-        send_byte = bytearray([0xB1, 0x02, 0x00, 0x00])
-        # 尾部以'\0'结束
-        end_byte = bytearray([0x00])
-        data = length_byte + length_byte + send_byte + content_byte + end_byte
-        return data
+        content = stt.dumps(dict_info)
+        # 封装为689类型（《协议》中规定的客户端发送消息类型）的数据帧
+        return stt.encode_frame(content, stt.CLIENT_MSG_TYPE)
 
     def msg_to_obj(self, msg: bytes) -> "dict|list|any":
         '''
         将从ws接收的字节流转为字典对象
         '''
-        pos = 0
         infos = []
-        while pos < len(msg):
-            # 获取消息长度
-            content_length = int.from_bytes(msg[pos : pos + 4], byteorder='little')
-            # 获取消息内容
-            content_byte = msg[pos + 12 : pos + 4 + content_length - 1]
-            # 将消息解码为字符串
-            content = content_byte.decode(encoding='utf-8', errors='ignore')
-            # logger.debug(content)
-            # 将消息反序列化为对象
-            data = pystt.loads(content)
+        frames = self.decoder.feed(msg)
+        message_types = self.message_types
+        handlers = self.handlers
+        log_debug = logger.isEnabledFor(logging.DEBUG)
+        for content_byte in frames:
+            # 先读取消息类型，未订阅的消息直接跳过
+            data_type = stt.peek_type(content_byte)
+            if message_types is not None and data_type not in message_types:
+                continue
+            # 只记录日志的消息，在不输出DEBUG日志时无需解析
+            if not log_debug and data_type in LOG_MESSAGES and data_type not in handlers:
+                continue
+            selector = self.field_selectors.get(data_type)
+            if selector:
+                # 只提取需要的字段
+                data = selector(content_byte)
+            else:
+                # 将消息反序列化为对象
+                data = stt.loads(content_byte)
             try:
                 data = self.parse_msg(data)
             except Exception as e:
@@ -170,7 +296,6 @@ class BarrageClient:
             else:
                 if data:
                     infos.append(data)
-            pos += 4 + content_length
         return infos
 
     def _login(self):
@@ -187,59 +312,202 @@ class BarrageClient:
         }
         # 将登陆信息转为二进制数据
         data = self.obj_to_msg(msg)
-        self.ws.send(data)
+        self.send(data)
 
     def _join(self):
         logger.debug(f"房间 {self.room_id} 发送进入房间消息")
         msg = {'type': 'joingroup', 'rid': self.room_id, 'gid': '1'}
         data = self.obj_to_msg(msg)
-        self.ws.send(data)
+        self.send(data)
 
     def _heartbeat(self):
         logger.debug(f"房间 {self.room_id} 发送心跳信息")
         msg = {'type': 'mrkl'}
         data = self.obj_to_msg(msg)
+        self.send(data)
+
+    def is_uid_conflict(self, error: "Exception|str") -> bool:
+        '''弹幕服务器提示 uid 已经被占用，error 为错误或关闭连接的原因'''
+        return str(error) == f"found {self.uid}"
+
+    def _change_uid(self):
+        '''uid 已经被占用时换一个随机 uid，重新登录时使用'''
+        logger.warning(f"房间 {self.room_id} 中uid {self.uid} 已经存在！")
+        random_uid = str(random.randint(1000000000, 10000000000))
+        self.uid = random_uid
+        self.username = random_uid
+        logger.info(f"房间 {self.room_id} 的uid已更换 {self.uid}")
+
+    def _store(self, infos: list):
+        '''将解析出的对象存入 storage'''
+        if not self.storage or not infos:
+            return
+        if isinstance(self.storage, BaseSink):
+            # 一条消息中的所有数据只加锁一次
+            self.storage.put_many(infos)
+        else:
+            for info in infos:
+                self.storage.put(info)
+
+
+class BarrageClient(BaseBarrageClient):
+    '''
+    基于 websocket-client 的弹幕客户端
+    连接断开后按带随机抖动的指数退避自动重连，每个客户端只有一个心跳线程
+    '''
+
+    def __init__(
+        self,
+        room_id: str,
+        username: str = None,
+        uid: str = None,
+        proxy_type: str = None,
+        http_proxy_host: str = None,
+        http_proxy_port: int = None,
+        storage: "Queue|BaseSink" = None,
+        message_types: "set|list" = None,
+        raw_time: bool = False,
+        url: str = DANMU_URL,
+        reconnect: bool = True,
+        base_backoff: float = 0.2,
+        max_backoff: float = 30,
+        stable_time: float = 60,
+        heartbeat_interval: float = 45,
+        ping_interval: float = 30,
+        ping_timeout: float = 10,
+    ):
+        '''
+        message_types: 需要解析的消息类型，如 {"chatmsg"}，为空时解析全部类型
+        raw_time: 弹幕只保存毫秒时间戳，发送时间在第一次访问时才生成
+        reconnect: 连接断开后是否自动重连
+        base_backoff / max_backoff: 重连等待秒数的初始值和上限
+        stable_time: 连接保持超过该秒数后断开，重连等待时间重新计算
+        ping_interval / ping_timeout: websocket ping 的间隔和等待 pong 的秒数，
+            超时认为连接已经半开，断开重连；接收线程也至少每 ping_timeout 秒检查一次是否已停止
+        '''
+        super().__init__(
+            room_id,
+            username=username,
+            uid=uid,
+            storage=storage,
+            message_types=message_types,
+            raw_time=raw_time,
+        )
+        self.url = url
+        self.reconnect = reconnect
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.stable_time = stable_time
+        self.heartbeat_interval = heartbeat_interval
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.ws: "websocket.WebSocketApp" = None
+        self.proxy_type = proxy_type
+        self.http_proxy_host = http_proxy_host
+        if http_proxy_port:
+            self.http_proxy_port = str(http_proxy_port)
+        else:
+            self.http_proxy_port = None
+        self.proxies = {
+            "proxy_type": self.proxy_type,
+            "http_proxy_host": self.http_proxy_host,
+            "http_proxy_port": self.http_proxy_port,
+        }
+        # 连续重连失败的次数，决定退避时间
+        self.failures = 0
+        self._stop_event = Event()
+        self.heartbeat_server: Thread = None
+        self.barrage_server: Thread = None
+
+    def send(self, data: bytes):
         self.ws.send(data)
 
+    def _start_heartbeat(self):
+        # 心跳线程在 start 中启动，登录成功后立即发送一次心跳
+        self._heartbeat()
+
     def keep_alive(self):
-        '''保持连接，不断发送心跳'''
+        '''保持连接，不断发送心跳，重连期间跳过'''
         logger.debug(f"房间 {self.room_id} 心跳服务启动")
-        self.running = True
-        while self.running:
-            self._heartbeat()
-            # 每次心跳间隔90*0.5=45秒
-            for _ in range(90):
-                # 每隔0.5秒判断服务是否还在运行
-                time.sleep(0.5)
-                if not self.running:
-                    self.ws.close()
-                    logger.info(f"房间 {self.room_id} 弹幕服务关闭")
-                    break
+        while not self._stop_event.wait(self.heartbeat_interval):
+            if not self.connected:
+                continue
+            ws = self.ws
+            try:
+                self._heartbeat()
+            except Exception as e:
+                logger.warning(f"房间 {self.room_id} 发送心跳失败:{str(e)}")
+                # 连接可能已经半开，关闭后 run_forever 返回，由 _run 重连
+                # 只关闭发送失败的连接，_run 已经换了新连接时不处理
+                if self.connected and ws is self.ws:
+                    ws.close()
         logger.debug(f"房间 {self.room_id} 心跳服务关闭")
 
+    def backoff(self, failures: int) -> float:
+        '''第 failures 次连续失败后的等待秒数，在一半到全部之间随机，避免同时重连'''
+        delay = min(self.max_backoff, self.base_backoff * 2 ** max(failures - 1, 0))
+        return delay * (0.5 + random.random() / 2)
+
+    def _connect(self):
+        '''建立一次连接，阻塞到连接断开'''
+        # websocket-client 只有这个客户端用到，第一次连接时才导入
+        from websocket import WebSocketApp
+
+        self.ws = WebSocketApp(
+            self.url,
+            on_message=self.on_message,
+            on_error=self.on_error,
+            on_close=self.on_close,
+            on_open=self.on_open,
+        )
+        self.ws.run_forever(
+            ping_interval=self.ping_interval,
+            ping_timeout=self.ping_timeout,
+            **self.proxies,
+        )
+
+    def _run(self):
+        '''连接弹幕服务器，断开后自动重连，直到 stop'''
+        while self.running:
+            try:
+                self._connect()
+            except Exception as e:
+                logger.error(f"房间 {self.room_id} 的弹幕服务错误：{str(e)}")
+            lasted = 0.0
+            if self.connected_at is not None:
+                lasted = time.monotonic() - self.connected_at
+                self.connected_at = None
+            self._on_disconnected()
+            if not self.running or not self.reconnect:
+                break
+            if lasted >= self.stable_time:
+                self.failures = 0
+            self.failures += 1
+            delay = self.backoff(self.failures)
+            logger.info(f"房间 {self.room_id} 弹幕连接断开，{delay:.2f} 秒后重连")
+            if self._stop_event.wait(delay):
+                break
+        self.running = False
+        self._stop_event.set()
+        logger.info(f"房间 {self.room_id} 弹幕服务关闭")
+
     def on_message(self, ws, message):
-        # print(message)
         infos = self.msg_to_obj(message)
-        if self.storage:
-            for info in infos:
-                self.storage.put(info)
-        else:
-            # print(infos)
-            pass
+        self._store(infos)
 
     def on_error(self, ws, error):
-        if str(error) == f"found {self.uid}":
-            logger.warning(f"房间 {self.room_id} 中uid {self.uid} 已经存在！")
-            random_uid = str(random.randint(1000000000, 10000000000))
-            self.uid = random_uid
-            self.username = random_uid
-            logger.info(f"房间 {self.room_id} 的uid已更换 {self.uid}")
+        if self.is_uid_conflict(error):
+            self._change_uid()
             self._login()
         else:
             logger.error(f"房间 {self.room_id} 的弹幕服务错误：{str(error)}")
 
     def on_close(self, ws, close_status_code, close_msg):
-        self.running = False
+        self.connected = False
+        if close_msg and self.is_uid_conflict(close_msg):
+            # 服务端以 close 帧提示 uid 已被占用，重连后使用新的 uid 登录
+            self._change_uid()
+            return
         logger.info(
             f"房间 {self.room_id} 弹幕服务器退出:{str(close_status_code)} {str(close_msg)}"
         )
@@ -249,20 +517,25 @@ class BarrageClient:
         初始化弹幕服务器连接
         '''
         logger.info(f"房间 {self.room_id} 初始化弹幕服务器连接")
+        # 丢弃上一次连接残留的不完整数据帧
+        self.decoder.reset()
         # 执行登录操作
         self._login()
 
     def start(self):
         '''
-        生成子进程运行弹幕服务器
+        启动接收弹幕的线程和心跳线程
         '''
         if self.running == True:
             logger.info(f"房间 {self.room_id} 的弹幕已在采集中")
         else:
-            self.barrage_server = Thread(
-                target=self.ws.run_forever, kwargs=(self.proxies)
-            )
+            self.running = True
+            self.failures = 0
+            self._stop_event.clear()
+            self.barrage_server = Thread(target=self._run, daemon=True)
             self.barrage_server.start()
+            self.heartbeat_server = Thread(target=self.keep_alive, daemon=True)
+            self.heartbeat_server.start()
             logger.info(f"房间 {self.room_id} 弹幕服务已启动")
 
     def stop(self):
@@ -270,14 +543,64 @@ class BarrageClient:
             if self.running == True:
                 logger.info(f"房间 {self.room_id} 的弹幕服务正在关闭")
                 self.running = False
+                self._stop_event.set()
+                if self.ws:
+                    self.ws.close()
             else:
                 logger.info(f"房间 {self.room_id} 的弹幕下载已经为关闭状态")
         else:
             logger.debug(f"房间 {self.room_id} 的弹幕服务不存在")
 
+    def join(self, timeout: float = None):
+        '''等待弹幕线程结束'''
+        if self.barrage_server:
+            self.barrage_server.join(timeout)
+
 
 def main():
-    pass
+    '''
+    采集一个房间的弹幕并输出，可以同时录制原始消息用于回放
+
+    python -m douyu_api.barrage 房间ID [--output 弹幕.jsonl] [--record 录制文件]
+    '''
+    import argparse
+
+    from douyu_api.replay import FrameRecorder
+    from douyu_api.sink import CallableSink, JsonLinesSink
+
+    parser = argparse.ArgumentParser(description="采集斗鱼房间的弹幕")
+    parser.add_argument("room_id", help="房间ID")
+    parser.add_argument("--types", default=None, help="只解析这些消息类型，逗号分隔")
+    parser.add_argument("--output", default=None, help="以 JSON Lines 格式写入文件，默认输出到屏幕")
+    parser.add_argument("--record", default=None, help="录制原始消息的文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.output:
+        storage = JsonLinesSink(args.output, fsync=False)
+    else:
+        storage = CallableSink(
+            lambda batch: print("\n".join(JsonLinesSink.to_json(item) for item in batch))
+        )
+    message_types = args.types.split(",") if args.types else None
+    client = BarrageClient(args.room_id, storage=storage, message_types=message_types)
+    recorder = None
+    if args.record:
+        recorder = FrameRecorder(args.record)
+        recorder.attach(client)
+    client.start()
+    try:
+        while client.running:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.stop()
+        client.join(5)
+        storage.close()
+        if recorder:
+            recorder.close()
+            logger.info(f"已录制 {recorder.frames} 条消息到 {args.record}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,235 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+from douyu_api.model import RoomResult
+
+logger = logging.getLogger(__name__)
+
+
+class IntervalSet:
+    '''
+    整数集合，以有序、不相交的半开区间 [start, end) 保存
+    按顺序完成的ID会合并为少量区间，内存占用与ID个数无关
+    '''
+
+    def __init__(self, intervals: "list" = ()) -> None:
+        self._starts = []
+        self._ends = []
+        for start, end in intervals:
+            self.add_range(start, end)
+
+    def __contains__(self, value: int) -> bool:
+        index = bisect.bisect_right(self._starts, value) - 1
+        return index >= 0 and value < self._ends[index]
+
+    def __len__(self) -> int:
+        '''集合中整数的个数'''
+        return sum(end - start for start, end in zip(self._starts, self._ends))
+
+    def __iter__(self):
+        for start, end in zip(self._starts, self._ends):
+            yield from range(start, end)
+
+    def __bool__(self) -> bool:
+        return bool(self._starts)
+
+    def intervals(self) -> "list[list[int]]":
+        return [[start, end] for start, end in zip(self._starts, self._ends)]
+
+    def add(self, value: int) -> None:
+        self.add_range(value, value + 1)
+
+    def add_range(self, start: int, end: int) -> None:
+        '''加入 [start, end)，与相邻或重叠的区间合并'''
+        if start >= end:
+            return
+        starts, ends = self._starts, self._ends
+        # 第一个可能与之合并的区间：结束位置不小于 start
+        left = bisect.bisect_left(ends, start)
+        # 最后一个可能与之合并的区间：开始位置不大于 end
+        right = bisect.bisect_right(starts, end)
+        if left < right:
+            start = min(start, starts[left])
+            end = max(end, ends[right - 1])
+        starts[left:right] = [start]
+        ends[left:right] = [end]
+
+    def discard(self, value: int) -> None:
+        index = bisect.bisect_right(self._starts, value) - 1
+        if index < 0 or value >= self._ends[index]:
+            return
+        start, end = self._starts[index], self._ends[index]
+        pieces = [(s, e) for s, e in ((start, value), (value + 1, end)) if s < e]
+        self._starts[index : index + 1] = [s for s, _ in pieces]
+        self._ends[index : index + 1] = [e for _, e in pieces]
+
+    def next_missing(self, value: int) -> int:
+        '''不小于 value 且不在集合中的最小整数'''
+        index = bisect.bisect_right(self._starts, value) - 1
+        if index >= 0 and value < self._ends[index]:
+            return self._ends[index]
+        return value
+
+
+class CrawlCheckpoint:
+    '''
+    批量采集的断点记录
+    done 为采集成功的ID，failed 为房间不存在等永久错误，retry 为可以重试的临时错误
+    不在三者之中的ID（包括中断时正在采集的ID）会在恢复时重新采集
+    结果写入数据库等异步输出时，不要在采集线程中标记，而是把 committed 和 commit_failed
+    作为 BatchSink 的 on_written 和 on_failed，数据提交后才记录，
+    中断后断点中记为成功的ID都已经写入
+    '''
+
+    VERSION = 1
+
+    def __init__(self, file_path: str, save_interval: float = 10) -> None:
+        '''
+        file_path: 断点文件路径，存在时自动加载
+        save_interval: 两次自动保存之间的最短秒数
+        '''
+        self.file_path = file_path
+        self.save_interval = save_interval
+        self.done = IntervalSet()
+        self.failed = IntervalSet()
+        self.retry = IntervalSet()
+        self._lock = threading.Lock()
+        # 采集线程和写出线程都可能保存，同时只有一个线程写文件
+        self._save_lock = threading.Lock()
+        self._last_save = time.monotonic()
+        self._dirty = False
+        if os.path.exists(file_path):
+            self.load()
+
+    def load(self) -> None:
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self._lock:
+            self.done = IntervalSet(data.get("done", ()))
+            self.failed = IntervalSet(data.get("failed", ()))
+            self.retry = IntervalSet(data.get("retry", ()))
+        logger.info(
+            f"加载断点 {self.file_path}:成功 {len(self.done)} 个，"
+            f"失败 {len(self.failed)} 个，待重试 {len(self.retry)} 个"
+        )
+
+    def save(self) -> None:
+        '''先写入临时文件再替换，保存过程中中断不会损坏原文件'''
+        with self._save_lock:
+            with self._lock:
+                data = {
+                    "version": self.VERSION,
+                    "updated": int(time.time()),
+                    "done": self.done.intervals(),
+                    "failed": self.failed.intervals(),
+                    "retry": self.retry.intervals(),
+                }
+                self._dirty = False
+                self._last_save = time.monotonic()
+            dir_path = os.path.dirname(os.path.abspath(self.file_path))
+            if not os.path.exists(dir_path):
+                os.makedirs(dir_path)
+            tmp_path = f"{self.file_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+
+    def maybe_save(self) -> None:
+        '''距上次保存超过 save_interval 时保存'''
+        if self._dirty and time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def mark_done(self, room_id: int) -> None:
+        with self._lock:
+            self.done.add(room_id)
+            self.retry.discard(room_id)
+            self._dirty = True
+        self.maybe_save()
+
+    def mark_failed(self, room_id: int, transient: bool = False) -> None:
+        '''transient: 临时错误，可以通过 retry_ids 重新采集'''
+        with self._lock:
+            if transient:
+                self.retry.add(room_id)
+            else:
+                self.failed.add(room_id)
+                self.retry.discard(room_id)
+            self._dirty = True
+        self.maybe_save()
+
+    def mark(self, result: RoomResult) -> None:
+        '''按采集结果记录'''
+        room_id = int(result.room_id)
+        if result.ok:
+            self.mark_done(room_id)
+        else:
+            self.mark_failed(room_id, transient=result.transient)
+
+    def committed(self, items: list) -> None:
+        '''
+        一批数据提交成功，记录其中的采集结果，用作 BatchSink 的 on_written
+        只有 RoomResult 会被记录，单独写入的 Room、User 等数据不影响断点
+        '''
+        for item in items:
+            if isinstance(item, RoomResult):
+                self.mark(item)
+
+    def commit_failed(self, items: list, error: Exception = None) -> None:
+        '''一批数据提交失败，其中的房间记为待重试，用作 BatchSink 的 on_failed'''
+        room_ids = set()
+        for item in items:
+            room_id = getattr(item, "room_id", None)
+            if room_id is not None:
+                room_ids.add(int(room_id))
+        for room_id in room_ids:
+            self.mark_failed(room_id, transient=True)
+        logger.warning(f"{len(room_ids)} 个房间的数据没有提交，记为待重试")
+
+    def is_finished(self, room_id: int) -> bool:
+        with self._lock:
+            return room_id in self.done or room_id in self.failed
+
+    def pending(self, start: int, stop: int, include_retry: bool = False):
+        '''
+        依次返回 [start, stop) 中还没有采集的ID，整段跳过已完成的区间
+        include_retry: 是否包含临时错误的ID
+        '''
+        sets = [self.done, self.failed]
+        if not include_retry:
+            sets.append(self.retry)
+        value = start
+        while value < stop:
+            # 写出线程可能同时在标记，查找期间持有锁
+            with self._lock:
+                # 反复跳过各个集合中的区间，直到不在任何一个集合中
+                while True:
+                    skipped = value
+                    for interval_set in sets:
+                        skipped = interval_set.next_missing(skipped)
+                    if skipped == value:
+                        break
+                    value = skipped
+            if value >= stop:
+                break
+            yield value
+            value += 1
+
+    def retry_ids(self) -> "list[int]":
+        '''临时错误的ID，用于重新排队'''
+        with self._lock:
+            return list(self.retry)
+
+    def close(self) -> None:
+        self.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,45 +1,117 @@
 import requests
 import logging
+import threading
+from requests.adapters import HTTPAdapter
 from requests.models import Response
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
+# 需要重试的服务端状态码
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_shared_session: requests.Session = None
+_shared_session_lock = threading.Lock()
+
 
 class BaseClient:
-    def __init__(self, proxies: dict = None, timeout: int = 15, session: requests.Session=None) -> None:
+    def __init__(
+        self,
+        proxies: dict = None,
+        timeout: int = 15,
+        session: requests.Session = None,
+        pool_size: int = 10,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+    ) -> None:
+        '''
+        session: 可以在多个客户端之间共用，如 BaseClient.shared_session()
+        pool_size: 每个域名保持的最大连接数
+        max_retries: 连接失败或服务端错误时的重试次数
+        backoff_factor: 重试的退避系数，第 n 次重试前等待 backoff_factor * 2^(n-1) 秒
+        '''
         self.proxies = proxies
         self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
         self.requests_args = {"timeout": timeout, "proxies": proxies}
         if session:
             self.session: requests.Session = session
         else:
             self.session = self.init_session()
 
-    def post(self, url, **args) -> Response:
+    def request(self, method: str, url: str, **args) -> Response:
         requests_args = dict(**self.requests_args)
         requests_args.update(args)
-        return requests.post(url, **requests_args)
+        return self.session.request(method, url, **requests_args)
+
+    def post(self, url, **args) -> Response:
+        return self.request("POST", url, **args)
 
     def get(self, url, **args) -> Response:
-        requests_args = dict(**self.requests_args)
-        requests_args.update(args)
-        return requests.get(url, **requests_args)
+        return self.request("GET", url, **args)
 
     def put(self, url, **args) -> Response:
-        requests_args = dict(**self.requests_args)
-        requests_args.update(args)
-        return requests.put(url, **requests_args)
+        return self.request("PUT", url, **args)
 
     def delete(self, url, **args) -> Response:
-        requests_args = dict(**self.requests_args)
-        requests_args.update(args)
-        return requests.delete(url, **requests_args)
+        return self.request("DELETE", url, **args)
+
+    @staticmethod
+    def create_session(
+        pool_size: int = 10,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        pool_connections: int = 10,
+    ) -> requests.Session:
+        '''
+        创建带连接池和重试的 session，连接默认保持 keep-alive
+        pool_connections: 缓存连接池的域名个数
+        '''
+        retry_args = dict(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUS,
+            raise_on_status=False,
+        )
+        try:
+            # 接口中的 POST 都是查询请求，可以安全重试
+            retry = Retry(allowed_methods=False, **retry_args)
+        except TypeError:
+            # urllib3 < 1.26
+            retry = Retry(method_whitelist=False, **retry_args)
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+        )
+        session = requests.session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @classmethod
+    def shared_session(cls, **args) -> requests.Session:
+        '''
+        进程内共用的 session，所有客户端复用同一组连接池
+        只有第一次调用时的参数生效
+        '''
+        global _shared_session
+        with _shared_session_lock:
+            if _shared_session is None:
+                _shared_session = cls.create_session(**args)
+            return _shared_session
 
     def init_session(self, **args) -> requests.Session:
         requests_args = dict(**self.requests_args)
         requests_args.update(args)
-        session = requests.session()
+        session = self.create_session(
+            pool_size=self.pool_size,
+            max_retries=self.max_retries,
+            backoff_factor=self.backoff_factor,
+        )
         for key, value in requests_args.items():  # 遍历数据字典
-            if hasattr(session, key):  # 如果存在同名属性
+            if value is not None and hasattr(session, key):  # 如果存在同名属性
                 setattr(session, key, value)  # 则添加属性到对象中
         return session
@@ -0,0 +1,175 @@
+import logging
+
+from douyu_api.model import Room, RoomResult, User
+from douyu_api.sink import BatchSink
+
+logger = logging.getLogger(__name__)
+
+# 表名 -> (唯一键, 列名)
+ROOM_TABLE = "douyu_room"
+ROOM_COLUMNS = (
+    "room_id", "room_name", "owner_uid", "nick_name", "owner_name", "safe_uid",
+    "show_id", "room_url", "show_status", "video_loop", "game_tag_id",
+    "game_short_name", "game_tag_name", "game_tag_introduce",
+)
+USER_TABLE = "douyu_user"
+USER_COLUMNS = (
+    "user_id", "nick_name", "avatar", "gender", "group_id", "group_name", "level",
+    "fu_num", "fans_num", "safe_uid", "is_anchor",
+)
+TABLES = {
+    ROOM_TABLE: ("room_id", ROOM_COLUMNS),
+    USER_TABLE: ("user_id", USER_COLUMNS),
+}
+
+DIALECT_MYSQL = "mysql"
+DIALECT_SQLITE = "sqlite"
+
+
+def upsert_sql(table: str, dialect: str = DIALECT_MYSQL) -> str:
+    '''生成按唯一键覆盖写入的 INSERT 语句'''
+    key, columns = TABLES[table]
+    updates = [column for column in columns if column != key]
+    if dialect == DIALECT_MYSQL:
+        placeholders = ", ".join(["%s"] * len(columns))
+        update = ", ".join(f"{column}=VALUES({column})" for column in updates)
+        return (
+            f"insert into {table}({', '.join(columns)}) values ({placeholders}) "
+            f"on duplicate key update {update}"
+        )
+    elif dialect == DIALECT_SQLITE:
+        placeholders = ", ".join(["?"] * len(columns))
+        update = ", ".join(f"{column}=excluded.{column}" for column in updates)
+        return (
+            f"insert into {table}({', '.join(columns)}) values ({placeholders}) "
+            f"on conflict({key}) do update set {update}"
+        )
+    raise ValueError(f"不支持的数据库类型:{dialect}")
+
+
+def create_table_sql(table: str) -> str:
+    '''建表语句，同时适用于 MySQL 和 SQLite'''
+    key, columns = TABLES[table]
+    definitions = []
+    for column in columns:
+        if column == key:
+            definitions.append(f"{column} bigint primary key")
+        else:
+            definitions.append(f"{column} text")
+    return f"create table if not exists {table}({', '.join(definitions)})"
+
+
+def room_row(room: Room) -> tuple:
+    return (
+        room.room_id, room.room_name, room.owner_uid, room.nick_name,
+        room.owner_name, room.safe_uid, room.show_id, room.room_url,
+        room.show_status, room.video_loop, room.game_tag_id, room.game_short_name,
+        room.game_tag_name, room.game_tag_introduce,
+    )
+
+
+def user_row(user: User) -> tuple:
+    return (
+        user.user_id, user.nick_name, user.avatar, user.gender, user.group_id,
+        user.group_name, user.level, user.fu_num, user.fans_num, user.safe_uid,
+        user.is_anchor,
+    )
+
+
+class DatabaseSink(BatchSink):
+    '''
+    批量写入房间和主播信息
+    后台线程按数量或时间攒批，每批使用 executemany 写入并只提交一次事务，
+    采集线程不会等待数据库
+    '''
+
+    def __init__(
+        self,
+        connect: "callable",
+        dialect: str = DIALECT_MYSQL,
+        create_tables: bool = False,
+        max_retries: int = 2,
+        batch_size: int = 500,
+        flush_interval: float = 5.0,
+        **kwargs,
+    ) -> None:
+        '''
+        connect: 创建数据库连接的函数，连接在写入线程中创建，如
+                 lambda: pymysql.connect(...) 或 lambda: sqlite3.connect(path)
+        dialect: mysql 或 sqlite，决定占位符和覆盖写入语法
+        create_tables: 第一次连接时创建不存在的表
+        max_retries: 写入失败后重新连接并重试的次数
+        '''
+        self.connect = connect
+        self.dialect = dialect
+        self.create_tables = create_tables
+        self.max_retries = max_retries
+        self.sqls = {table: upsert_sql(table, dialect) for table in TABLES}
+        self.db = None
+        super().__init__(
+            batch_size=batch_size, flush_interval=flush_interval, **kwargs
+        )
+
+    def _connect(self):
+        db = self.connect()
+        if self.create_tables:
+            cursor = db.cursor()
+            for table in TABLES:
+                cursor.execute(create_table_sql(table))
+            db.commit()
+        return db
+
+    def _close_db(self) -> None:
+        if self.db is not None:
+            try:
+                self.db.close()
+            except Exception:
+                pass
+            self.db = None
+
+    @staticmethod
+    def split_rows(batch: list) -> "dict[str, list]":
+        '''把一批对象按表分组并转为行'''
+        rooms = {}
+        users = {}
+        for item in batch:
+            if isinstance(item, RoomResult):
+                if item.room:
+                    rooms[item.room.room_id] = room_row(item.room)
+                if item.user:
+                    users[item.user.user_id] = user_row(item.user)
+            elif isinstance(item, Room):
+                rooms[item.room_id] = room_row(item)
+            elif isinstance(item, User):
+                users[item.user_id] = user_row(item)
+            else:
+                raise ValueError(f"不支持写入的数据类型:{type(item)}")
+        # 同一批中重复的主键只保留最后一条
+        return {ROOM_TABLE: list(rooms.values()), USER_TABLE: list(users.values())}
+
+    def write_batch(self, batch: list) -> None:
+        rows = self.split_rows(batch)
+        for retry in range(self.max_retries + 1):
+            try:
+                if self.db is None:
+                    self.db = self._connect()
+                cursor = self.db.cursor()
+                for table, table_rows in rows.items():
+                    if table_rows:
+                        cursor.executemany(self.sqls[table], table_rows)
+                self.db.commit()
+                return
+            except Exception as e:
+                logger.warning(
+                    f"写入数据库失败，第 {retry + 1} 次:{str(type(e))} {str(e)}"
+                )
+                try:
+                    self.db.rollback()
+                except Exception:
+                    pass
+                self._close_db()
+                if retry >= self.max_retries:
+                    raise
+
+    def on_close(self) -> None:
+        self._close_db()
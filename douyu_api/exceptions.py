@@ -28,3 +28,31 @@ class RoomNotExistError(DouYuApiException):
 
 class ObsoleteError(DouYuApiException):
     """session过期错误"""
+
+
+class FrameError(DouYuApiException):
+    """弹幕数据帧格式错误"""
+
+
+class FlvError(DouYuApiException):
+    """FLV视频流格式错误"""
+
+
+def is_transient(error: Exception) -> bool:
+    '''
+    判断错误是否为网络波动等临时错误，临时错误可以重试
+    只有连接错误、超时和服务端返回 429 或 5xx 是临时错误，房间状态、解析失败等其余错误重试也不会成功
+    '''
+    # 弹幕等模块会导入本模块，requests 在这里才导入
+    import requests
+
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, requests.HTTPError):
+        response = error.response
+        return response is not None and (
+            response.status_code == 429 or response.status_code >= 500
+        )
+    return False
@@ -0,0 +1,417 @@
+import bisect
+import datetime
+import json
+import logging
+import os
+import time
+
+from douyu_api.exceptions import FlvError
+
+logger = logging.getLogger(__name__)
+
+FLV_SIGNATURE = b"FLV"
+# 文件头 9 字节 + 第一个 PreviousTagSize 4 字节
+FLV_HEADER_SIZE = 9 + 4
+# 类型(1) + 数据长度(3) + 时间戳(3) + 时间戳扩展(1) + StreamID(3)
+TAG_HEADER_SIZE = 11
+PREVIOUS_TAG_SIZE = 4
+
+# 标签类型，FLV_HEADER 表示文件头，不是真正的标签
+FLV_HEADER = 0
+TAG_AUDIO = 8
+TAG_VIDEO = 9
+TAG_SCRIPT = 18
+TAG_TYPES = (TAG_AUDIO, TAG_VIDEO, TAG_SCRIPT)
+
+CODEC_AVC = 7
+SOUND_AAC = 10
+
+
+class FlvTag:
+    '''
+    FLV 标签，data 为包含标签头和尾部 PreviousTagSize 的完整字节，
+    原样写入文件即可
+    '''
+
+    __slots__ = ("tag_type", "timestamp", "keyframe", "sequence_header", "data")
+
+    def __init__(
+        self,
+        tag_type: int,
+        data: memoryview,
+        timestamp: int = 0,
+        keyframe: bool = False,
+        sequence_header: bool = False,
+    ) -> None:
+        self.tag_type = tag_type
+        self.data = data
+        self.timestamp = timestamp
+        self.keyframe = keyframe
+        self.sequence_header = sequence_header
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __repr__(self) -> str:
+        return (
+            f"FlvTag(type={self.tag_type}, timestamp={self.timestamp}, "
+            f"size={len(self.data)}, keyframe={self.keyframe})"
+        )
+
+
+class FlvParser:
+    '''
+    增量式的 FLV 解析器
+
+    与弹幕的 FrameDecoder 一样复用同一个缓冲区，返回的标签数据为
+    memoryview 切片，在下一次调用 feed 之前有效。
+    同时保存文件头、onMetaData 和音视频的 sequence header，
+    用于在分段后的新文件开头重新写入。
+    '''
+
+    def __init__(self, max_tag_size: int = 16 * 1024 * 1024) -> None:
+        self.max_tag_size = max_tag_size
+        self._buffer = bytearray()
+        self._consumed = 0
+        self.header: bytes = None
+        self.metadata: bytes = None
+        self.video_sequence_header: bytes = None
+        self.audio_sequence_header: bytes = None
+        # 是否出现过视频标签，纯音频的流按音频标签分段
+        self.has_video = False
+
+    def __len__(self) -> int:
+        return len(self._buffer) - self._consumed
+
+    def reset(self) -> None:
+        '''重新开始解析一个新的视频流'''
+        self._compact()
+        self._buffer.clear()
+        self.header = None
+        self.metadata = None
+        self.video_sequence_header = None
+        self.audio_sequence_header = None
+        self.has_video = False
+
+    def preamble(self) -> bytes:
+        '''新文件开头需要写入的内容：文件头、onMetaData 和 sequence header'''
+        parts = [self.header]
+        for part in (
+            self.metadata,
+            self.video_sequence_header,
+            self.audio_sequence_header,
+        ):
+            if part:
+                parts.append(part)
+        return b"".join(parts)
+
+    def feed(self, data: bytes) -> "list[FlvTag]":
+        '''
+        输入一段字节流，返回其中所有完整的标签
+        格式错误时抛出 FlvError，异常的 unparsed 属性为本次还没有返回的全部数据
+        '''
+        self._compact()
+        buffered = bool(self._buffer)
+        try:
+            if buffered:
+                self._buffer += data
+                view = memoryview(self._buffer)
+                tags, pos = self._split(view)
+                self._consumed = pos
+            else:
+                view = memoryview(data)
+                tags, pos = self._split(view)
+                if pos < len(view):
+                    self._buffer += view[pos:]
+        except FlvError as e:
+            e.unparsed = bytes(self._buffer) if buffered else bytes(data)
+            self._buffer = bytearray()
+            self._consumed = 0
+            raise
+        return tags
+
+    def _compact(self) -> None:
+        if not self._consumed:
+            return
+        try:
+            del self._buffer[: self._consumed]
+        except BufferError:
+            # 上一批返回的标签仍被外部引用，改用新的缓冲区
+            self._buffer = bytearray(memoryview(self._buffer)[self._consumed :])
+        self._consumed = 0
+
+    def _split(self, view: memoryview) -> "tuple[list[FlvTag], int]":
+        tags = []
+        pos = 0
+        total = len(view)
+        if self.header is None:
+            if total < FLV_HEADER_SIZE:
+                return tags, pos
+            if view[:3] != FLV_SIGNATURE:
+                raise FlvError("不是FLV格式的数据")
+            header_size = int.from_bytes(view[5:9], byteorder="big")
+            pos = header_size + PREVIOUS_TAG_SIZE
+            if total < pos:
+                return tags, 0
+            self.header = bytes(view[:pos])
+            tags.append(FlvTag(FLV_HEADER, view[:pos]))
+        while total - pos >= TAG_HEADER_SIZE:
+            tag_type = view[pos] & 0x1F
+            data_size = int.from_bytes(view[pos + 1 : pos + 4], byteorder="big")
+            if tag_type not in TAG_TYPES or data_size > self.max_tag_size:
+                raise FlvError(f"FLV标签异常:类型 {tag_type}，长度 {data_size}")
+            end = pos + TAG_HEADER_SIZE + data_size + PREVIOUS_TAG_SIZE
+            if end > total:
+                break
+            timestamp = int.from_bytes(view[pos + 4 : pos + 7], byteorder="big") | (
+                view[pos + 7] << 24
+            )
+            tag = FlvTag(tag_type, view[pos:end], timestamp)
+            body = pos + TAG_HEADER_SIZE
+            if tag_type == TAG_VIDEO and data_size >= 2:
+                self.has_video = True
+                tag.keyframe = view[body] >> 4 == 1
+                if view[body] & 0x0F == CODEC_AVC and view[body + 1] == 0:
+                    tag.sequence_header = True
+                    self.video_sequence_header = bytes(tag.data)
+            elif tag_type == TAG_AUDIO and data_size >= 2:
+                if view[body] >> 4 == SOUND_AAC and view[body + 1] == 0:
+                    tag.sequence_header = True
+                    self.audio_sequence_header = bytes(tag.data)
+            elif tag_type == TAG_SCRIPT and self.metadata is None:
+                if b"onMetaData" in bytes(view[body : body + 16]):
+                    self.metadata = bytes(tag.data)
+            tags.append(tag)
+            pos = end
+        return tags, pos
+
+
+def index_path(file_path: str) -> str:
+    '''关键帧索引文件的路径'''
+    return f"{file_path}.idx.json"
+
+
+class KeyframeIndex:
+    '''
+    关键帧索引，记录每个视频关键帧的时间戳(毫秒)和在文件中的位置
+    保存格式与 onMetaData 中的 keyframes 相同，时间单位为秒
+    '''
+
+    __slots__ = ("times", "positions", "first_timestamp", "last_timestamp")
+
+    def __init__(self) -> None:
+        self.times = []
+        self.positions = []
+        self.first_timestamp: int = None
+        self.last_timestamp: int = None
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def add_tag(self, tag: FlvTag, position: int) -> None:
+        '''position: 标签在文件中的起始位置'''
+        if tag.sequence_header or tag.tag_type == TAG_SCRIPT:
+            # 分段开头重新写入的标签时间戳为 0，不计入时长
+            return
+        if self.first_timestamp is None:
+            self.first_timestamp = tag.timestamp
+        self.last_timestamp = tag.timestamp
+        if tag.keyframe:
+            self.times.append(tag.timestamp)
+            self.positions.append(position)
+
+    @property
+    def duration(self) -> float:
+        if self.first_timestamp is None:
+            return 0.0
+        return (self.last_timestamp - self.first_timestamp) / 1000
+
+    def seek(self, seconds: float) -> int:
+        '''不晚于给定时间(秒，与标签时间戳一致)的最近关键帧在文件中的位置'''
+        if not self.times:
+            return 0
+        index = bisect.bisect_right(self.times, int(seconds * 1000)) - 1
+        return self.positions[max(index, 0)]
+
+    def to_dict(self) -> dict:
+        return {
+            "start": (self.first_timestamp or 0) / 1000,
+            "duration": self.duration,
+            "keyframes": {
+                "times": [t / 1000 for t in self.times],
+                "filepositions": self.positions,
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "KeyframeIndex":
+        index = cls()
+        keyframes = data["keyframes"]
+        index.times = [round(t * 1000) for t in keyframes["times"]]
+        index.positions = list(keyframes["filepositions"])
+        if index.times:
+            index.first_timestamp = round(data.get("start", keyframes["times"][0]) * 1000)
+            index.last_timestamp = index.first_timestamp + round(data["duration"] * 1000)
+        return index
+
+    def save(self, file_path: str) -> None:
+        '''写入视频文件旁边的索引文件'''
+        path = index_path(file_path)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, file_path: str) -> "KeyframeIndex":
+        with open(index_path(file_path), "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+def build_keyframe_index(file_path: str, chunk_size: int = 1024 * 1024) -> KeyframeIndex:
+    '''扫描已有的 FLV 文件生成关键帧索引，用于没有索引文件的旧录像'''
+    parser = FlvParser()
+    index = KeyframeIndex()
+    position = 0
+    with open(file_path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            for tag in parser.feed(data):
+                if tag.tag_type != FLV_HEADER:
+                    index.add_tag(tag, position)
+                position += len(tag.data)
+    return index
+
+
+class FlvSegment:
+    '''一个分段文件的信息'''
+
+    __slots__ = ("file_path", "start_time", "end_time", "size", "keyframes")
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.start_time = datetime.datetime.now()
+        self.end_time: datetime.datetime = None
+        self.size = 0
+        self.keyframes = KeyframeIndex()
+
+
+class FlvSegmentWriter:
+    '''
+    把 FLV 视频流写入按时间或大小分段的文件
+
+    分段发生在视频关键帧之前，新文件以文件头、onMetaData 和 sequence header 开头，
+    每个分段都可以单独播放，且不需要断开 HTTP 连接。
+    数据不是 FLV 格式时按原样写入，在数据块之间分段。
+    '''
+
+    # path_factory 返回的路径已存在时，重新获取路径的次数
+    OPEN_ATTEMPTS = 10
+
+    def __init__(
+        self,
+        path_factory: "callable",
+        interval: float = None,
+        size: int = None,
+        on_close: "callable" = None,
+        index: bool = True,
+    ) -> None:
+        '''
+        path_factory: 返回新分段文件路径的函数
+        interval: 每个分段的最长秒数
+        size: 每个分段的最大字节数
+        on_close: 分段文件关闭后调用，参数为 FlvSegment
+        index: 分段文件关闭时在旁边写入关键帧索引 .idx.json
+        '''
+        self.path_factory = path_factory
+        self.interval = interval
+        self.size = size
+        self.on_close = on_close
+        self.index = index
+        self.parser = FlvParser()
+        self.raw = False
+        self.segment: FlvSegment = None
+        self.fp = None
+        self._opened_at = 0
+
+    def _open(self) -> None:
+        '''
+        以独占方式创建新文件，从不写入已有的文件：
+        追加会在同一个文件中出现第二个文件头，关键帧索引也会被覆盖
+        '''
+        for _ in range(self.OPEN_ATTEMPTS):
+            file_path = self.path_factory()
+            try:
+                self.fp = open(file_path, "xb")
+                break
+            except FileExistsError:
+                logger.warning(f"分段文件已存在:{file_path}")
+        else:
+            raise FileExistsError(f"连续 {self.OPEN_ATTEMPTS} 次生成的分段文件都已存在")
+        self.segment = FlvSegment(file_path)
+        self._opened_at = time.monotonic()
+
+    def _close(self) -> None:
+        if self.fp is None:
+            return
+        self.fp.close()
+        self.fp = None
+        self.segment.end_time = datetime.datetime.now()
+        if self.index and not self.raw and self.segment.keyframes:
+            try:
+                self.segment.keyframes.save(self.segment.file_path)
+            except OSError as e:
+                logger.warning(f"写入关键帧索引失败:{str(e)}")
+        if self.on_close:
+            self.on_close(self.segment)
+
+    def _write(self, data) -> None:
+        self.fp.write(data)
+        self.segment.size += len(data)
+
+    def should_rotate(self) -> bool:
+        if self.fp is None:
+            return False
+        if self.interval and time.monotonic() - self._opened_at >= self.interval:
+            return True
+        return bool(self.size and self.segment.size >= self.size)
+
+    def rotate(self) -> None:
+        '''关闭当前文件并打开新文件，写入新文件的开头部分'''
+        self._close()
+        self._open()
+        if not self.raw and self.parser.header:
+            self._write(self.parser.preamble())
+        logger.info(f"视频分段:{self.segment.file_path}")
+
+    def write(self, data: bytes) -> None:
+        if self.fp is None:
+            self._open()
+        if self.raw:
+            if self.should_rotate():
+                self.rotate()
+            self._write(data)
+            return
+        try:
+            tags = self.parser.feed(data)
+        except FlvError as e:
+            logger.warning(f"视频流解析失败，按原始数据写入:{str(e)}")
+            self.raw = True
+            self._write(e.unparsed)
+            return
+        for tag in tags:
+            if (
+                tag.tag_type != FLV_HEADER
+                and not tag.sequence_header
+                and (tag.keyframe or not self.parser.has_video)
+                and self.should_rotate()
+            ):
+                self.rotate()
+            if tag.tag_type != FLV_HEADER:
+                self.segment.keyframes.add_tag(tag, self.segment.size)
+            self._write(tag.data)
+
+    def close(self) -> None:
+        self._close()
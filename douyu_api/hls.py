@@ -0,0 +1,579 @@
+import bisect
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urljoin
+
+from requests import Session
+
+from douyu_api.core import BaseClient
+
+logger = logging.getLogger(__name__)
+
+
+def parse_m3u8(text: str, base_url: str = "") -> "list[str]":
+    '''返回 m3u8 中所有分片的完整地址'''
+    return [
+        urljoin(base_url, line)
+        for line in (line.strip() for line in text.splitlines())
+        if line and not line.startswith("#")
+    ]
+
+
+class HlsProgress:
+    '''下载进度计数'''
+
+    __slots__ = ("total", "done", "bytes", "retries", "started")
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.done = 0
+        self.bytes = 0
+        self.retries = 0
+        self.started = time.monotonic()
+
+    @property
+    def speed(self) -> float:
+        '''平均下载速度，字节/秒'''
+        elapsed = time.monotonic() - self.started
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "done": self.done,
+            "bytes": self.bytes,
+            "retries": self.retries,
+            "speed": self.speed,
+        }
+
+
+def file_md5(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for data in iter(lambda: f.read(chunk_size), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def append_file(output, file_path: str) -> None:
+    '''把文件追加到 output 末尾，支持时使用 sendfile 在内核中复制'''
+    output.flush()
+    with open(file_path, "rb") as part:
+        size = os.fstat(part.fileno()).st_size
+        if hasattr(os, "sendfile"):
+            try:
+                offset = 0
+                while offset < size:
+                    sent = os.sendfile(output.fileno(), part.fileno(), offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return
+            except OSError:
+                # 部分平台不支持写入普通文件，改用普通复制
+                output.seek(0, os.SEEK_END)
+                part.seek(offset)
+        shutil.copyfileobj(part, output)
+
+
+class HlsManifest:
+    '''
+    分片下载进度
+    segments 为已经下载完成、还没有拼接的分片：序号 -> {"size", "md5"}，
+    assembled 为已经按顺序拼接到结果文件的分片数，assembled_size 为其字节数
+    完成的分片每 save_every 个或每 save_interval 秒保存一次，拼接后和 close 时立即保存，
+    中断时没有保存的分片重新下载，临时文件还在时按 Range 续传
+    '''
+
+    VERSION = 1
+
+    def __init__(
+        self,
+        file_path: str,
+        urls_hash: str,
+        total: int,
+        save_every: int = 16,
+        save_interval: float = 5,
+    ) -> None:
+        self.file_path = file_path
+        self.urls_hash = urls_hash
+        self.total = total
+        self.save_every = save_every
+        self.save_interval = save_interval
+        self.segments = {}
+        self.assembled = 0
+        self.assembled_size = 0
+        self.complete = False
+        # 是否从已有的进度文件加载
+        self.resumed = False
+        # 上次保存之后的改动数
+        self._unsaved = 0
+        self._last_save = time.monotonic()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, file_path: str, urls: "list[str]", **kwargs) -> "HlsManifest":
+        '''加载已有的进度，分片列表不同时重新开始'''
+        urls_hash = hashlib.md5("\n".join(urls).encode("utf-8")).hexdigest()
+        manifest = cls(file_path, urls_hash, len(urls), **kwargs)
+        if not os.path.exists(file_path):
+            return manifest
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except ValueError as e:
+            logger.warning(f"下载进度文件损坏，重新下载:{file_path} {str(e)}")
+            return manifest
+        if data.get("urls_hash") != urls_hash:
+            logger.warning(f"分片列表已变化，重新下载:{file_path}")
+            return manifest
+        manifest.assembled = data["assembled"]
+        manifest.segments = {
+            int(k): v for k, v in data["segments"].items() if int(k) >= manifest.assembled
+        }
+        manifest.assembled_size = data["assembled_size"]
+        manifest.complete = data.get("complete", False)
+        manifest.resumed = True
+        logger.info(
+            f"从断点继续下载:已拼接 {manifest.assembled}/{manifest.total} 个分片"
+        )
+        return manifest
+
+    def is_done(self, index: int, part_path: str) -> bool:
+        '''分片已下载完成，且临时文件的大小和 md5 与记录一致'''
+        segment = self.segments.get(index)
+        return bool(
+            segment
+            and os.path.exists(part_path)
+            and os.path.getsize(part_path) == segment["size"]
+            and file_md5(part_path) == segment["md5"]
+        )
+
+    def mark_done(self, index: int, size: int, md5: str) -> None:
+        with self._lock:
+            self.segments[index] = {"size": size, "md5": md5}
+            self._unsaved += 1
+        self.maybe_save()
+
+    def mark_assembled(self, index: int) -> None:
+        '''记录拼接完成的分片并从 segments 中删除，由调用方在一轮拼接后保存'''
+        with self._lock:
+            self.assembled = index + 1
+            self.assembled_size += self.segments.pop(index)["size"]
+            self._unsaved += 1
+
+    def maybe_save(self) -> None:
+        '''改动达到 save_every 个或距上次保存超过 save_interval 秒时保存'''
+        with self._lock:
+            due = self._unsaved and (
+                self._unsaved >= self.save_every
+                or time.monotonic() - self._last_save >= self.save_interval
+            )
+        if due:
+            self.save()
+
+    def close(self) -> None:
+        '''保存还没有写入文件的改动'''
+        if self._unsaved:
+            self.save()
+
+    def save(self) -> None:
+        '''先写入临时文件再替换，保存过程中中断不会损坏原文件'''
+        # 多个线程同时保存时共用同一个临时文件，需要依次写入
+        with self._save_lock:
+            with self._lock:
+                self._unsaved = 0
+                self._last_save = time.monotonic()
+                data = {
+                    "version": self.VERSION,
+                    "urls_hash": self.urls_hash,
+                    "total": self.total,
+                    "assembled": self.assembled,
+                    "assembled_size": self.assembled_size,
+                    "complete": self.complete,
+                    "segments": dict(self.segments),
+                }
+            tmp_path = f"{self.file_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+
+
+class TokenBucket:
+    '''令牌桶限速，rate 为每秒字节数，多个线程共用'''
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int) -> None:
+        '''取出 amount 个令牌，不足时等待'''
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # 允许透支，等待的时间由欠下的令牌数决定
+            self._tokens -= amount
+            wait_time = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait_time:
+            time.sleep(wait_time)
+
+
+class HlsJob:
+    '''
+    一个视频的分片下载状态，可以由多个线程共同下载
+
+    take 按顺序领取需要下载的分片，segment_done 记录完成的分片，
+    assemble 把已经连续完成的分片按顺序拼接到结果文件。
+    拼接只在锁内领取分片，复制文件时不持有锁，同一时间只有一个线程在拼接。
+    '''
+
+    def __init__(self, urls: "list[str]", file_path: str, window: int = 32) -> None:
+        self.urls = urls
+        self.file_path = file_path
+        self.window = window
+        self.parts_dir = f"{file_path}.parts"
+        self.progress = HlsProgress(len(urls))
+        self.manifest = HlsManifest.open(f"{file_path}.manifest.json", urls)
+        # 已完成等待拼接的分片：序号 -> 临时文件路径
+        self.ready = {}
+        # 下载失败、等待重新领取的分片序号
+        self.retry = []
+        # 分片序号 -> 重新排队的次数
+        self.requeues = {}
+        self.next_write = self.manifest.assembled
+        self.next_submit = self.next_write
+        self.progress.done = self.next_write
+        self.progress.bytes = self.manifest.assembled_size
+        self.output = None
+        self.closed = False
+        self._assembling = False
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    @property
+    def finished(self) -> bool:
+        return self.manifest.complete or self.next_write >= len(self.urls)
+
+    def open(self) -> None:
+        '''准备临时目录和结果文件，拼接上次已经下载完成的分片'''
+        if self.finished:
+            self.progress.done = len(self.urls)
+            return
+        if not self.manifest.resumed:
+            # 没有可用的进度，之前的临时文件不能再使用
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+            self.manifest.save()
+        if not os.path.exists(self.parts_dir):
+            os.makedirs(self.parts_dir)
+        # 不使用追加模式，sendfile 不支持写入 O_APPEND 的文件
+        mode = "r+b" if os.path.exists(self.file_path) else "wb"
+        self.output = open(self.file_path, mode)
+        # 丢弃上次中断时拼接了一半的分片
+        self.output.truncate(self.manifest.assembled_size)
+        self.output.seek(self.manifest.assembled_size)
+        # 校验上次已经下载完成、还没有拼接的分片，需要读取文件，不在 take 中进行
+        for index in sorted(self.manifest.segments):
+            if index < self.next_write:
+                continue
+            part_path = self._part_path(index)
+            if self.manifest.is_done(index, part_path):
+                self.ready[index] = part_path
+                self.progress.done += 1
+            elif os.path.exists(part_path):
+                # 记录为已完成但临时文件已损坏，不能再按 Range 续传
+                logger.warning(f"分片临时文件校验失败，重新下载:{part_path}")
+                os.remove(part_path)
+        self.assemble()
+
+    def _part_path(self, index: int) -> str:
+        return os.path.join(self.parts_dir, f"{index}.ts")
+
+    def take(self, limit: int = None) -> "list[tuple[int, str, str]]":
+        '''
+        领取需要下载的分片，返回 [(序号, 地址, 临时文件路径)]
+        先领取重新排队的分片，领取位置最多领先拼接位置 window 个分片
+        '''
+        segments = []
+        with self._lock:
+            while self.retry and (limit is None or len(segments) < limit):
+                index = self.retry.pop(0)
+                segments.append((index, self.urls[index], self._part_path(index)))
+            while (
+                self.next_submit < len(self.urls)
+                and self.next_submit - self.next_write < self.window
+                and (limit is None or len(segments) < limit)
+            ):
+                index = self.next_submit
+                if index not in self.ready:
+                    segments.append((index, self.urls[index], self._part_path(index)))
+                self.next_submit += 1
+        return segments
+
+    def can_take(self) -> bool:
+        return bool(self.retry) or (
+            self.next_submit < len(self.urls)
+            and self.next_submit - self.next_write < self.window
+        )
+
+    def wait_for_work(self, timeout: float = None) -> bool:
+        '''
+        没有可领取的分片时，等待其他线程拼接推进窗口
+        可以继续领取或已经完成时返回 True；没有线程在拼接、等不到进展或超时时返回 False
+        '''
+        with self._lock:
+            self._idle.wait_for(
+                lambda: self.can_take() or self.finished or not self._assembling, timeout
+            )
+            return self.can_take() or self.finished
+
+    def requeue(self, index: int, limit: int) -> bool:
+        '''
+        下载失败的分片重新排队，由之后的 take 再次领取
+        同一个分片重新排队超过 limit 次时返回 False
+        '''
+        with self._lock:
+            count = self.requeues.get(index, 0)
+            if count >= limit:
+                return False
+            self.requeues[index] = count + 1
+            self.progress.retries += 1
+            bisect.insort(self.retry, index)
+        return True
+
+    def segment_done(self, index: int, size: int, md5: str) -> None:
+        self.manifest.mark_done(index, size, md5)
+        with self._lock:
+            closed = self.closed
+            if not closed:
+                self.ready[index] = self._part_path(index)
+                self.progress.done += 1
+                self.progress.bytes += size
+        if closed:
+            # 关闭之后完成的分片也要记录，下次可以直接使用
+            self.manifest.close()
+            return
+        self.assemble()
+
+    def assemble(self) -> None:
+        '''
+        按顺序拼接已经连续完成的分片
+        已经有线程在拼接时直接返回，该线程会继续拼接新完成的分片
+        '''
+        with self._lock:
+            if self._assembling or self.closed:
+                return
+            self._assembling = True
+        try:
+            while self._assemble_ready():
+                pass
+        except BaseException:
+            with self._lock:
+                self._assembling = False
+                self._idle.notify_all()
+            raise
+
+    def _assemble_ready(self) -> bool:
+        '''拼接一轮，没有需要做的事情时清除拼接标记并返回 False'''
+        with self._lock:
+            parts = []
+            while not self.closed and self.next_write + len(parts) in self.ready:
+                index = self.next_write + len(parts)
+                parts.append((index, self.ready.pop(index)))
+            complete = (
+                not parts
+                and self.next_write >= len(self.urls)
+                and not self.manifest.complete
+            )
+            if not parts and not complete:
+                # 与检查 ready 在同一次加锁中清除，不会漏掉刚完成的分片
+                self._assembling = False
+                self._idle.notify_all()
+                return False
+        if complete:
+            self.manifest.complete = True
+            self.manifest.save()
+            self.output.close()
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+            return True
+        for index, part_path in parts:
+            append_file(self.output, part_path)
+            self.manifest.mark_assembled(index)
+            with self._lock:
+                self.next_write = index + 1
+                # 窗口向前移动，唤醒等待领取分片的线程
+                self._idle.notify_all()
+        # 每轮拼接保存一次，保存之后才删除临时文件，中断时没有保存的分片仍可使用
+        self.manifest.save()
+        for index, part_path in parts:
+            os.remove(part_path)
+        return True
+
+    def close(self) -> None:
+        '''
+        停止拼接并关闭结果文件，之后完成的分片保留在临时目录中
+        正在拼接时等待当前这一轮结束
+        '''
+        with self._lock:
+            self.closed = True
+            self._idle.wait_for(lambda: not self._assembling)
+            if self.output and not self.output.closed:
+                self.output.close()
+        self.manifest.close()
+
+
+class HlsDownloader(BaseClient):
+    '''
+    并发下载 HLS 分片并按顺序拼接为一个文件
+
+    分片以流的方式写入临时文件，按顺序追加到结果文件后删除。
+    已完成但还不能拼接的分片不超过 window 个，磁盘占用有上限。
+    下载进度保存在结果文件旁边的 .manifest.json 中，中断后可以从断点继续。
+    '''
+
+    def __init__(
+        self,
+        workers: int = 8,
+        window: int = 32,
+        segment_retries: int = 3,
+        chunk_size: int = 256 * 1024,
+        on_progress: "callable" = None,
+        headers: dict = None,
+        proxies: dict = None,
+        timeout: int = 15,
+        session: Session = None,
+        throttle: "callable" = None,
+    ) -> None:
+        '''
+        workers: 同时下载的分片数
+        window: 下载位置最多领先拼接位置的分片数
+        segment_retries: 每个分片失败后的重试次数
+        on_progress: 每完成一个分片调用一次，参数为 HlsProgress
+        throttle: 每收到一块数据调用一次，参数为字节数，用于限速，如 TokenBucket.consume
+        '''
+        super().__init__(
+            proxies=proxies, timeout=timeout, session=session, pool_size=workers
+        )
+        self.workers = workers
+        self.window = max(window, workers)
+        self.segment_retries = segment_retries
+        self.chunk_size = chunk_size
+        self.on_progress = on_progress
+        self.headers = headers
+        self.throttle = throttle
+        self.progress: HlsProgress = None
+        self.running = False
+        self._lock = threading.Lock()
+
+    def fetch_segment(
+        self, url: str, part_path: str, progress: HlsProgress = None
+    ) -> "tuple[int, str]":
+        '''
+        下载一个分片到临时文件，失败时重试，返回 (字节数, md5)
+        临时文件已有部分数据时使用 Range 请求继续下载
+        progress: 记录重试次数，默认为当前下载的进度
+        '''
+        progress = progress or self.progress
+        for retry in range(self.segment_retries + 1):
+            try:
+                return self._fetch_segment(url, part_path)
+            except InterruptedError:
+                raise
+            except Exception as e:
+                if retry >= self.segment_retries:
+                    raise
+                with self._lock:
+                    progress.retries += 1
+                logger.warning(
+                    f"分片下载失败，第 {retry + 1} 次重试:{url} {str(type(e))} {str(e)}"
+                )
+                time.sleep(0.5 * 2 ** retry)
+
+    def _fetch_segment(self, url: str, part_path: str) -> "tuple[int, str]":
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = dict(self.headers or {})
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        with self.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 416:
+                # 临时文件已经是完整的分片
+                return offset, file_md5(part_path)
+            response.raise_for_status()
+            if response.status_code != 206:
+                # 服务端不支持 Range，重新下载整个分片
+                offset = 0
+            digest = hashlib.md5()
+            if offset:
+                with open(part_path, "rb") as f:
+                    for data in iter(lambda: f.read(self.chunk_size), b""):
+                        digest.update(data)
+            size = offset
+            with open(part_path, "ab" if offset else "wb") as f:
+                for data in response.iter_content(chunk_size=self.chunk_size):
+                    if not self.running:
+                        raise InterruptedError("下载已停止")
+                    if self.throttle:
+                        self.throttle(len(data))
+                    f.write(data)
+                    digest.update(data)
+                    size += len(data)
+        return size, digest.hexdigest()
+
+    def download(self, urls: "list[str]", file_path: str) -> HlsProgress:
+        '''
+        下载所有分片并按顺序追加写入 file_path
+        file_path 旁边的 .manifest.json 记录下载进度，中断后再次调用会从断点继续，
+        分片列表不同时重新下载
+        '''
+        self.running = True
+        job = HlsJob(urls, file_path, self.window)
+        self.progress = job.progress
+        job.open()
+        # future -> 分片序号
+        pending = {}
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            while not job.finished:
+                for index, url, part_path in job.take():
+                    future = executor.submit(
+                        self.fetch_segment, url, part_path, job.progress
+                    )
+                    pending[future] = index
+                if not pending:
+                    # 没有正在下载的分片，只能等其他线程拼接推进窗口
+                    if not job.wait_for_work(self.timeout):
+                        raise RuntimeError(
+                            f"没有可下载的分片，已拼接 {job.next_write}/{len(urls)}:{file_path}"
+                        )
+                    continue
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    size, md5 = future.result()
+                    job.segment_done(index, size, md5)
+                    if self.on_progress:
+                        self.on_progress(job.progress)
+        finally:
+            self.running = False
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            job.close()
+        return job.progress
+
+    def stop(self) -> None:
+        self.running = False
@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import math
+import queue
+import random
+
+from douyu_api.aiows import ConnectionClosed, WebSocket
+from douyu_api.barrage import DANMU_URL, BaseBarrageClient
+from douyu_api.sink import BaseSink
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    '''
+    单层时间轮，每个槽位对应一个 tick
+    加入的对象每转一圈（interval 秒）被取出一次，用于周期性发送心跳
+    '''
+
+    def __init__(self, interval: float = 45, tick: float = 1) -> None:
+        self.tick = tick
+        self.slots = [set() for _ in range(max(1, math.ceil(interval / tick)))]
+        # 下一次 advance 要取出的槽位
+        self.cursor = 0
+        self._positions = {}
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def add(self, item) -> None:
+        '''加入时间轮，一整圈之后第一次被取出'''
+        self.remove(item)
+        slot = (self.cursor - 1) % len(self.slots)
+        self.slots[slot].add(item)
+        self._positions[item] = slot
+
+    def remove(self, item) -> None:
+        slot = self._positions.pop(item, None)
+        if slot is not None:
+            self.slots[slot].discard(item)
+
+    def advance(self) -> list:
+        '''转动一格，返回当前槽位中的对象'''
+        items = list(self.slots[self.cursor])
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        return items
+
+
+class AsyncBarrageClient(BaseBarrageClient):
+    '''
+    基于 asyncio 的弹幕客户端，心跳由所属的 BarrageHub 统一发送
+    '''
+
+    def __init__(
+        self,
+        room_id: str,
+        username: str = None,
+        uid: str = None,
+        storage: "asyncio.Queue|Queue|BaseSink" = None,
+        message_types: "set|list" = None,
+        raw_time: bool = False,
+        url: str = DANMU_URL,
+        hub: "BarrageHub" = None,
+        reconnect_interval: float = 5,
+        proxy_type: str = None,
+        http_proxy_host: str = None,
+        http_proxy_port: int = None,
+    ):
+        '''
+        reconnect_interval: 连接断开后等待 1~2 倍该秒数再重连
+        proxy_type / http_proxy_host / http_proxy_port: 与 BarrageClient 相同，
+            只支持 HTTP 代理（CONNECT 隧道）
+        '''
+        if proxy_type not in (None, "http"):
+            raise ValueError(f"不支持的代理类型:{proxy_type}")
+        super().__init__(
+            room_id,
+            username=username,
+            uid=uid,
+            storage=storage,
+            message_types=message_types,
+            raw_time=raw_time,
+        )
+        self.url = url
+        self.hub = hub
+        self.reconnect_interval = reconnect_interval
+        self.http_proxy_host = http_proxy_host
+        self.http_proxy_port = http_proxy_port
+        self.websocket: WebSocket = None
+        self.task: asyncio.Task = None
+
+    def send(self, data: bytes):
+        if self.websocket and not self.websocket.closed:
+            self.websocket.send(data)
+
+    def _start_heartbeat(self):
+        self._heartbeat()
+        if self.hub:
+            self.hub.wheel.add(self)
+
+    def _store(self, infos: list):
+        '''在事件循环中调用，不能等待 storage，否则会阻塞所有房间'''
+        if not self.storage or not infos:
+            return
+        if isinstance(self.storage, BaseSink):
+            # 队列已满时丢弃新数据，不阻塞事件循环
+            self.storage.put_many_nowait(infos)
+            return
+        # asyncio.Queue 或 queue.Queue
+        try:
+            for info in infos:
+                self.storage.put_nowait(info)
+        except (asyncio.QueueFull, queue.Full):
+            logger.warning(f"房间 {self.room_id} 的 storage 已满，丢弃数据")
+
+    async def _connect(self):
+        kwargs = {}
+        if self.http_proxy_host:
+            kwargs = {"proxy_host": self.http_proxy_host, "proxy_port": self.http_proxy_port}
+        if self.hub:
+            async with self.hub.connect_semaphore:
+                return await WebSocket.connect(self.url, **kwargs)
+        return await WebSocket.connect(self.url, **kwargs)
+
+    async def run(self):
+        '''
+        连接弹幕服务器并持续接收消息，连接断开后自动重连
+        '''
+        self.running = True
+        while self.running:
+            try:
+                self.websocket = await self._connect()
+                logger.info(f"房间 {self.room_id} 初始化弹幕服务器连接")
+                # 丢弃上一次连接残留的不完整数据帧
+                self.decoder.reset()
+                self._login()
+                while self.running:
+                    message = await self.websocket.recv()
+                    self._store(self.msg_to_obj(message))
+            except asyncio.CancelledError:
+                self.running = False
+                raise
+            except ConnectionClosed as e:
+                if self.is_uid_conflict(e.reason):
+                    # 服务端以 close 帧提示 uid 已被占用，重连后使用新的 uid 登录
+                    self._change_uid()
+                else:
+                    logger.info(f"房间 {self.room_id} 弹幕服务器退出:{str(e)}")
+            except (OSError, asyncio.TimeoutError) as e:
+                logger.info(f"房间 {self.room_id} 弹幕服务器退出:{str(e)}")
+            except Exception as e:
+                logger.error(f"房间 {self.room_id} 的弹幕服务错误：{str(e)}")
+            finally:
+                self._on_disconnected()
+                if self.hub:
+                    self.hub.wheel.remove(self)
+                if self.websocket:
+                    await self.websocket.close()
+                    self.websocket = None
+            if self.running:
+                # 错开重连时间，避免大量房间同时重连
+                await asyncio.sleep(self.reconnect_interval * (1 + random.random()))
+        logger.info(f"房间 {self.room_id} 弹幕服务关闭")
+
+    def start(self) -> asyncio.Task:
+        '''在当前事件循环中启动'''
+        if self.task and not self.task.done():
+            logger.info(f"房间 {self.room_id} 的弹幕已在采集中")
+        else:
+            self.task = asyncio.ensure_future(self.run())
+            logger.info(f"房间 {self.room_id} 弹幕服务已启动")
+        return self.task
+
+    async def stop(self):
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+
+class BarrageHub:
+    '''
+    在一个事件循环中复用多个房间的弹幕连接
+    所有房间的 mrkl 心跳由同一个时间轮发送，不再为每个房间创建线程
+    '''
+
+    def __init__(
+        self,
+        storage: "asyncio.Queue|Queue|BaseSink" = None,
+        message_types: "set|list" = None,
+        url: str = DANMU_URL,
+        heartbeat_interval: float = 45,
+        tick: float = 1,
+        connect_concurrency: int = 50,
+    ) -> None:
+        '''
+        storage: 所有房间共用的存储，房间也可以单独指定
+        connect_concurrency: 同时进行握手的连接数上限
+        '''
+        self.storage = storage
+        self.message_types = message_types
+        self.url = url
+        self.wheel = TimerWheel(interval=heartbeat_interval, tick=tick)
+        self.connect_concurrency = connect_concurrency
+        self.connect_semaphore: asyncio.Semaphore = None
+        self.clients = {}
+        self.running = False
+        self._heartbeat_task: asyncio.Task = None
+
+    def add_room(self, room_id: str, **kwargs) -> AsyncBarrageClient:
+        '''
+        添加房间，hub 已经运行时立即开始采集
+        '''
+        room_id = str(room_id)
+        client = self.clients.get(room_id)
+        if client:
+            return client
+        kwargs.setdefault("storage", self.storage)
+        kwargs.setdefault("message_types", self.message_types)
+        kwargs.setdefault("url", self.url)
+        client = AsyncBarrageClient(room_id, hub=self, **kwargs)
+        self.clients[room_id] = client
+        if self.running:
+            client.start()
+        return client
+
+    async def remove_room(self, room_id: str) -> None:
+        client = self.clients.pop(str(room_id), None)
+        if client:
+            self.wheel.remove(client)
+            await client.stop()
+
+    async def _heartbeat_loop(self):
+        loop = asyncio.get_event_loop()
+        next_tick = loop.time()
+        while self.running:
+            for client in self.wheel.advance():
+                try:
+                    client._heartbeat()
+                except Exception as e:
+                    logger.error(f"房间 {client.room_id} 发送心跳失败:{str(e)}")
+            next_tick += self.wheel.tick
+            await asyncio.sleep(max(0, next_tick - loop.time()))
+
+    def start(self) -> None:
+        '''在当前事件循环中启动所有房间和心跳'''
+        if self.running:
+            return
+        self.running = True
+        self.connect_semaphore = asyncio.Semaphore(self.connect_concurrency)
+        self._heartbeat_task = asyncio.ensure_future(self._heartbeat_loop())
+        for client in self.clients.values():
+            client.start()
+
+    async def stop(self) -> None:
+        self.running = False
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+        await asyncio.gather(
+            *(client.stop() for client in self.clients.values()),
+            return_exceptions=True,
+        )
+
+    async def run(self) -> None:
+        '''启动并一直运行，直到被取消'''
+        self.start()
+        try:
+            await self._heartbeat_task
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await self.stop()
+
+    def run_forever(self, room_ids: "list" = ()) -> None:
+        '''阻塞运行，适合作为独立进程的入口'''
+        for room_id in room_ids:
+            self.add_room(room_id)
+        asyncio.run(self.run())
@@ -0,0 +1,141 @@
+import time
+from collections import deque
+
+
+class StreamMetrics:
+    '''
+    直播录制的吞吐统计
+
+    下载循环中每个数据块只调用一次 add，只做几次整数加法和比较；
+    码率、卡顿等指标在 snapshot 时才计算。
+    '''
+
+    def __init__(self, window: int = 10, stall_timeout: float = 5) -> None:
+        '''
+        window: 计算码率的滑动窗口秒数
+        stall_timeout: 超过该秒数没有收到数据视为卡顿
+        '''
+        self.window = window
+        self.stall_timeout = stall_timeout
+        self.bytes = 0
+        self.chunks = 0
+        self.stalls = 0
+        self.requests = 0
+        self.segments = 0
+        # 是否正在下载，从 request_started 到 stopped
+        self.running = False
+        self.last_data: float = None
+        self.ttfb: float = None
+        self.resolve_time: float = None
+        self.segment_durations = deque(maxlen=100)
+        self._request_started: float = None
+        # 每秒收到的字节数：(秒, 字节数)
+        self._buckets = deque(maxlen=window)
+        self._second = 0
+        self._current = 0
+
+    def add(self, size: int) -> None:
+        '''收到 size 字节的数据'''
+        now = time.monotonic()
+        self.bytes += size
+        self.chunks += 1
+        if self._request_started is not None:
+            self.ttfb = now - self._request_started
+            self._request_started = None
+        elif self.last_data is not None and now - self.last_data > self.stall_timeout:
+            self.stalls += 1
+        self.last_data = now
+        second = int(now)
+        if second != self._second:
+            self._buckets.append((self._second, self._current))
+            self._second = second
+            self._current = 0
+        self._current += size
+
+    def request_started(self) -> None:
+        '''开始请求视频流，下一次 add 时计算首字节时间'''
+        self.requests += 1
+        self.running = True
+        self._request_started = time.monotonic()
+
+    def stopped(self) -> None:
+        '''下载结束，不再计算卡顿，重新开始后的第一块数据也不计为卡顿恢复'''
+        self.running = False
+        self.last_data = None
+        self._request_started = None
+
+    def resolved(self, seconds: float) -> None:
+        '''记录获取视频流地址花费的秒数'''
+        self.resolve_time = seconds
+
+    def segment_closed(self, seconds: float) -> None:
+        '''记录一个分段文件的时长'''
+        self.segments += 1
+        self.segment_durations.append(seconds)
+
+    def bitrate(self) -> float:
+        '''最近 window 秒的平均码率，比特/秒'''
+        now = int(time.monotonic())
+        start = now - self.window
+        total = self._current if self._second > start else 0
+        for second, size in self._buckets:
+            if second > start:
+                total += size
+        return total * 8 / self.window
+
+    @property
+    def stalled(self) -> bool:
+        '''正在下载，且等待首字节或已经超过 stall_timeout 秒没有收到数据'''
+        if not self.running:
+            return False
+        last = self.last_data if self._request_started is None else self._request_started
+        return last is not None and time.monotonic() - last > self.stall_timeout
+
+    def snapshot(self) -> dict:
+        durations = self.segment_durations
+        return {
+            "bytes": self.bytes,
+            "chunks": self.chunks,
+            "bitrate": self.bitrate(),
+            "stalled": self.stalled,
+            "stalls": self.stalls,
+            "requests": self.requests,
+            "ttfb": self.ttfb,
+            "resolve_time": self.resolve_time,
+            "segments": self.segments,
+            "last_segment_duration": durations[-1] if durations else None,
+            "avg_segment_duration": sum(durations) / len(durations) if durations else None,
+        }
+
+
+# snapshot 中的字段 -> (指标名, 类型, 说明)
+PROMETHEUS_METRICS = (
+    ("bytes", "douyu_stream_bytes_total", "counter", "Bytes received"),
+    ("bitrate", "douyu_stream_bitrate_bps", "gauge", "Rolling bitrate in bits per second"),
+    ("stalled", "douyu_stream_stalled", "gauge", "1 if no data for stall_timeout seconds"),
+    ("stalls", "douyu_stream_stalls_total", "counter", "Stalls recovered from"),
+    ("requests", "douyu_stream_requests_total", "counter", "Stream requests"),
+    ("ttfb", "douyu_stream_ttfb_seconds", "gauge", "Time to first byte of the last request"),
+    ("resolve_time", "douyu_stream_resolve_seconds", "gauge", "Last stream URL resolution time"),
+    ("segments", "douyu_stream_segments_total", "counter", "Closed segment files"),
+    (
+        "last_segment_duration",
+        "douyu_stream_segment_duration_seconds",
+        "gauge",
+        "Duration of the last closed segment",
+    ),
+)
+
+
+def prometheus_text(snapshots: "dict[str, dict]") -> str:
+    '''把各个房间的 snapshot 转为 Prometheus 文本格式'''
+    lines = []
+    for key, name, metric_type, help_text in PROMETHEUS_METRICS:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for room_id, snapshot in snapshots.items():
+            value = snapshot.get(key)
+            if value is None:
+                continue
+            lines.append(f'{name}{{room="{room_id}"}} {float(value)}')
+    return "\n".join(lines) + "\n"
@@ -1,11 +1,19 @@
 import datetime
 import json
 import logging
+from array import array
+
+from douyu_api.exceptions import is_transient
 
 logger = logging.getLogger(__name__)
 
+# 北京时间，所有弹幕共用同一个时区对象
+TZ_UTC_8 = datetime.timezone(datetime.timedelta(hours=8))
+
 
 class BaseModel:
+    __slots__ = ()
+
     def to_dict(self) -> dict:
         raise NotImplementedError
 
@@ -14,6 +22,12 @@ class BaseModel:
 
 
 class Room(BaseModel):
+    __slots__ = (
+        "owner_uid", "show_id", "room_name", "nick_name", "room_id", "owner_name",
+        "room_url", "safe_uid", "show_status", "video_loop", "game_tag_id",
+        "game_short_name", "game_tag_name", "game_tag_introduce",
+    )
+
     def __init__(
         self,
         room_id: "str|int",  # 房间id
@@ -66,6 +80,11 @@ class Room(BaseModel):
 
 
 class User(BaseModel):
+    __slots__ = (
+        "user_id", "nick_name", "avatar", "gender", "group_id", "group_name",
+        "level", "fu_num", "fans_num", "safe_uid", "is_anchor",
+    )
+
     def __init__(
         self,
         user_id: int = None,  # 主播个人主页id
@@ -109,6 +128,13 @@ class User(BaseModel):
 
 
 class Barrage(BaseModel):
+    __slots__ = (
+        "room_id", "user_id", "nick_name", "level", "content", "cst", "_send_time",
+    )
+
+    # parse_chatmsg 需要用到的 chatmsg 字段
+    CHATMSG_FIELDS = ("type", "rid", "uid", "nn", "level", "txt", "cst")
+
     def __init__(
         self,
         room_id: str = None,
@@ -117,6 +143,7 @@ class Barrage(BaseModel):
         content: str = None,
         send_time: datetime.datetime = None,
         level: str = None,
+        cst: int = None,
     ) -> None:
         super().__init__()
         # 房间ID
@@ -129,8 +156,22 @@ class Barrage(BaseModel):
         self.level = level
         # 弹幕内容
         self.content = content
-        # 发送时间
-        self.send_time = send_time
+        # 发送时间戳（毫秒）
+        self.cst = cst
+        # 发送时间，为空时由 cst 按需生成
+        self._send_time = send_time
+
+    @property
+    def send_time(self) -> datetime.datetime:
+        if self._send_time is None and self.cst is not None:
+            self._send_time = datetime.datetime.fromtimestamp(
+                self.cst / 1000, tz=TZ_UTC_8
+            )
+        return self._send_time
+
+    @send_time.setter
+    def send_time(self, send_time: datetime.datetime):
+        self._send_time = send_time
 
     def to_dict(self) -> dict:
         return {
@@ -153,22 +194,514 @@ class Barrage(BaseModel):
         return json.dumps(dict_info, ensure_ascii=False)
 
     @staticmethod
-    def parse_chatmsg(chatmsg: dict):
+    def parse_chatmsg(chatmsg: dict, raw_time: bool = False):
+        '''
+        解析成对象
+        raw_time: 只保存毫秒时间戳 cst，发送时间在第一次访问时才生成
+        '''
+        barrage = Barrage(
+            # 房间ID
+            room_id=chatmsg.get("rid"),
+            # 用户ID
+            user_id=chatmsg.get("uid"),
+            # 用户昵称
+            nick_name=chatmsg.get("nn"),
+            # 用户等级
+            level=chatmsg.get("level"),
+            # 弹幕内容
+            content=chatmsg.get("txt"),
+            # 发送时间
+            cst=int(chatmsg.get("cst")),
+        )
+        if not raw_time:
+            barrage.send_time = datetime.datetime.fromtimestamp(
+                barrage.cst / 1000, tz=TZ_UTC_8
+            )
+        return barrage
+
+
+class Gift(BaseModel):
+    __slots__ = (
+        "room_id", "user_id", "nick_name", "level", "gift_id", "gift_count", "hits",
+        "badge_name", "badge_level",
+    )
+
+    # parse_dgb 需要用到的 dgb 字段
+    DGB_FIELDS = (
+        "type", "rid", "uid", "nn", "level", "gfid", "gfcnt", "hits", "bnn", "bl",
+    )
+
+    def __init__(
+        self,
+        room_id: str = None,
+        user_id: str = None,
+        nick_name: str = None,
+        level: str = None,
+        gift_id: str = None,
+        gift_count: int = None,
+        hits: int = None,
+        badge_name: str = None,
+        badge_level: str = None,
+    ) -> None:
+        super().__init__()
+        # 房间ID
+        self.room_id = room_id
+        # 送礼用户ID
+        self.user_id = user_id
+        # 送礼用户昵称
+        self.nick_name = nick_name
+        # 用户等级
+        self.level = level
+        # 礼物ID
+        self.gift_id = gift_id
+        # 礼物个数
+        self.gift_count = gift_count
+        # 连击次数
+        self.hits = hits
+        # 粉丝牌名称
+        self.badge_name = badge_name
+        # 粉丝牌等级
+        self.badge_level = badge_level
+
+    def to_dict(self) -> dict:
+        return {
+            "room_id": self.room_id,
+            "user_id": self.user_id,
+            "nick_name": self.nick_name,
+            "level": self.level,
+            "gift_id": self.gift_id,
+            "gift_count": self.gift_count,
+            "hits": self.hits,
+            "badge_name": self.badge_name,
+            "badge_level": self.badge_level,
+        }
+
+    @staticmethod
+    def parse_dgb(dgb: dict):
         '''解析成对象'''
-        barrage = Barrage()
+        return Gift(
+            room_id=dgb.get("rid"),
+            user_id=dgb.get("uid"),
+            nick_name=dgb.get("nn"),
+            level=dgb.get("level"),
+            gift_id=dgb.get("gfid"),
+            gift_count=int(dgb.get("gfcnt") or 1),
+            hits=int(dgb.get("hits") or 1),
+            badge_name=dgb.get("bnn"),
+            badge_level=dgb.get("bl"),
+        )
+
+
+class UserEnter(BaseModel):
+    __slots__ = ("room_id", "user_id", "nick_name", "level", "noble_level")
+
+    # parse_uenter 需要用到的 uenter 字段
+    UENTER_FIELDS = ("type", "rid", "uid", "nn", "level", "nl")
+
+    def __init__(
+        self,
+        room_id: str = None,
+        user_id: str = None,
+        nick_name: str = None,
+        level: str = None,
+        noble_level: str = None,
+    ) -> None:
+        super().__init__()
         # 房间ID
-        barrage.room_id = chatmsg.get("rid")
+        self.room_id = room_id
         # 用户ID
-        barrage.user_id = chatmsg.get("uid")
+        self.user_id = user_id
         # 用户昵称
-        barrage.nick_name = chatmsg.get("nn")
+        self.nick_name = nick_name
         # 用户等级
-        barrage.level = chatmsg.get("level")
-        # 弹幕内容
-        barrage.content = chatmsg.get("txt")
-        # 发送时间
-        send_timestamp = int(chatmsg.get("cst")) / 1000
-        tz_utc_8 = datetime.timezone(datetime.timedelta(hours=8))
-        send_time = datetime.datetime.fromtimestamp(send_timestamp, tz=tz_utc_8)
-        barrage.send_time = send_time
-        return barrage
+        self.level = level
+        # 贵族等级
+        self.noble_level = noble_level
+
+    def to_dict(self) -> dict:
+        return {
+            "room_id": self.room_id,
+            "user_id": self.user_id,
+            "nick_name": self.nick_name,
+            "level": self.level,
+            "noble_level": self.noble_level,
+        }
+
+    @staticmethod
+    def parse_uenter(uenter: dict):
+        '''解析成对象'''
+        return UserEnter(
+            room_id=uenter.get("rid"),
+            user_id=uenter.get("uid"),
+            nick_name=uenter.get("nn"),
+            level=uenter.get("level"),
+            noble_level=uenter.get("nl"),
+        )
+
+
+class GiftBroadcast(BaseModel):
+    __slots__ = (
+        "room_id", "target_room_id", "sender_name", "receiver_name", "gift_name",
+        "gift_count", "gift_id",
+    )
+
+    # parse_spbc 需要用到的 spbc 字段
+    SPBC_FIELDS = ("type", "rid", "drid", "sn", "dn", "gn", "gc", "gfid")
+
+    def __init__(
+        self,
+        room_id: str = None,
+        target_room_id: str = None,
+        sender_name: str = None,
+        receiver_name: str = None,
+        gift_name: str = None,
+        gift_count: int = None,
+        gift_id: str = None,
+    ) -> None:
+        super().__init__()
+        # 收到广播的房间ID
+        self.room_id = room_id
+        # 礼物送出的房间ID
+        self.target_room_id = target_room_id
+        # 送礼用户昵称
+        self.sender_name = sender_name
+        # 收礼主播昵称
+        self.receiver_name = receiver_name
+        # 礼物名称
+        self.gift_name = gift_name
+        # 礼物个数
+        self.gift_count = gift_count
+        # 礼物ID
+        self.gift_id = gift_id
+
+    def to_dict(self) -> dict:
+        return {
+            "room_id": self.room_id,
+            "target_room_id": self.target_room_id,
+            "sender_name": self.sender_name,
+            "receiver_name": self.receiver_name,
+            "gift_name": self.gift_name,
+            "gift_count": self.gift_count,
+            "gift_id": self.gift_id,
+        }
+
+    @staticmethod
+    def parse_spbc(spbc: dict):
+        '''解析成对象'''
+        return GiftBroadcast(
+            room_id=spbc.get("rid"),
+            target_room_id=spbc.get("drid"),
+            sender_name=spbc.get("sn"),
+            receiver_name=spbc.get("dn"),
+            gift_name=spbc.get("gn"),
+            gift_count=int(spbc.get("gc") or 1),
+            gift_id=spbc.get("gfid"),
+        )
+
+
+class BarrageGap(BaseModel):
+    '''
+    弹幕连接断开的区间，重连成功后与弹幕一起存入 storage
+    区间内的弹幕没有被采集
+    '''
+
+    __slots__ = ("room_id", "start", "end", "reconnects")
+
+    def __init__(
+        self,
+        room_id: str = None,
+        start: int = None,
+        end: int = None,
+        reconnects: int = 0,
+    ) -> None:
+        super().__init__()
+        # 房间ID
+        self.room_id = room_id
+        # 连接断开的时间戳（毫秒）
+        self.start = start
+        # 重新登录成功的时间戳（毫秒）
+        self.end = end
+        # 期间尝试重连的次数
+        self.reconnects = reconnects
+
+    @property
+    def duration(self) -> float:
+        '''断开的秒数'''
+        return (self.end - self.start) / 1000
+
+    def to_dict(self) -> dict:
+        return {
+            "type": "gap",
+            "room_id": self.room_id,
+            "start": self.start,
+            "end": self.end,
+            "duration": self.duration,
+            "reconnects": self.reconnects,
+        }
+
+
+class BarrageBatch:
+    '''
+    按列存储的弹幕集合，数值字段使用 array，文本字段拼接为一个 UTF-8 缓冲区并记录偏移
+    适合在内存中长时间保存大量弹幕
+
+    为 None 的字段记录在 nulls 中，取出时仍为 None；数值字段为空字符串时同样按 None 保存。
+    房间ID、用户ID和等级需要是整数，等级以 16 位整数保存，取出时转为字符串
+    '''
+
+    __slots__ = (
+        "room_ids", "user_ids", "levels", "csts", "nulls",
+        "_nick_names", "nick_name_offsets", "_contents", "content_offsets",
+    )
+
+    # nulls 中每条弹幕一个字节，对应的位为 1 表示该字段为 None
+    NULL_ROOM_ID = 1
+    NULL_USER_ID = 2
+    NULL_LEVEL = 4
+    NULL_NICK_NAME = 8
+    NULL_CONTENT = 16
+    _NULL_FIELDS = (
+        (NULL_ROOM_ID, "room_id"),
+        (NULL_USER_ID, "user_id"),
+        (NULL_LEVEL, "level"),
+        (NULL_NICK_NAME, "nick_name"),
+        (NULL_CONTENT, "content"),
+    )
+
+    def __init__(self, barrages: "list[Barrage]" = ()) -> None:
+        self.room_ids = array("q")
+        self.user_ids = array("q")
+        self.levels = array("h")
+        # 发送时间戳（毫秒）
+        self.csts = array("q")
+        self.nulls = array("B")
+        # 第 i 条文本为 buffer[offsets[i]:offsets[i + 1]]
+        self._nick_names = bytearray()
+        self.nick_name_offsets = array("Q", [0])
+        self._contents = bytearray()
+        self.content_offsets = array("Q", [0])
+        self.extend(barrages)
+
+    def __len__(self) -> int:
+        return len(self.csts)
+
+    def __getitem__(self, index: int) -> Barrage:
+        if index < 0:
+            index += len(self)
+        nulls = self.nulls[index]
+        return Barrage(
+            room_id=None if nulls & self.NULL_ROOM_ID else str(self.room_ids[index]),
+            user_id=None if nulls & self.NULL_USER_ID else str(self.user_ids[index]),
+            nick_name=None if nulls & self.NULL_NICK_NAME else self.nick_name(index),
+            level=None if nulls & self.NULL_LEVEL else str(self.levels[index]),
+            content=None if nulls & self.NULL_CONTENT else self.content(index),
+            cst=self.csts[index],
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(
+        self,
+        room_id: "str|int",
+        user_id: "str|int",
+        nick_name: str,
+        level: "str|int",
+        content: str,
+        cst: int,
+    ) -> None:
+        nulls = 0
+        if room_id is None or room_id == "":
+            nulls |= self.NULL_ROOM_ID
+            room_id = 0
+        if user_id is None or user_id == "":
+            nulls |= self.NULL_USER_ID
+            user_id = 0
+        if level is None or level == "":
+            nulls |= self.NULL_LEVEL
+            level = 0
+        if nick_name is None:
+            nulls |= self.NULL_NICK_NAME
+            nick_name = ""
+        if content is None:
+            nulls |= self.NULL_CONTENT
+            content = ""
+        self.room_ids.append(int(room_id))
+        self.user_ids.append(int(user_id))
+        self.levels.append(int(level))
+        self.csts.append(int(cst))
+        self.nulls.append(nulls)
+        self._nick_names += nick_name.encode("utf-8")
+        self.nick_name_offsets.append(len(self._nick_names))
+        self._contents += content.encode("utf-8")
+        self.content_offsets.append(len(self._contents))
+
+    def append_barrage(self, barrage: Barrage) -> None:
+        cst = barrage.cst
+        if cst is None:
+            cst = int(barrage.send_time.timestamp() * 1000)
+        self.append(
+            barrage.room_id,
+            barrage.user_id,
+            barrage.nick_name,
+            barrage.level,
+            barrage.content,
+            cst,
+        )
+
+    def append_chatmsg(self, chatmsg: dict) -> None:
+        '''直接从 chatmsg 字典追加，不创建 Barrage 对象'''
+        self.append(
+            chatmsg.get("rid"),
+            chatmsg.get("uid"),
+            chatmsg.get("nn"),
+            chatmsg.get("level"),
+            chatmsg.get("txt"),
+            chatmsg.get("cst"),
+        )
+
+    def extend(self, barrages: "list[Barrage]") -> None:
+        for barrage in barrages:
+            self.append_barrage(barrage)
+
+    def nick_name(self, index: int) -> str:
+        offsets = self.nick_name_offsets
+        return self._nick_names[offsets[index] : offsets[index + 1]].decode("utf-8")
+
+    def content(self, index: int) -> str:
+        offsets = self.content_offsets
+        return self._contents[offsets[index] : offsets[index + 1]].decode("utf-8")
+
+    @staticmethod
+    def _split(buffer: bytearray, offsets: array) -> "list[str]":
+        data = bytes(buffer)
+        return [
+            data[start:end].decode("utf-8")
+            for start, end in zip(offsets, offsets[1:])
+        ]
+
+    def drop_before(self, cst: int) -> int:
+        '''
+        删除发送时间早于 cst 的弹幕，返回删除的条数
+        弹幕需要按时间顺序追加
+        '''
+        count = 0
+        for count, value in enumerate(self.csts):
+            if value >= cst:
+                break
+        else:
+            count = len(self)
+        if not count:
+            return 0
+        del self.room_ids[:count]
+        del self.user_ids[:count]
+        del self.levels[:count]
+        del self.csts[:count]
+        del self.nulls[:count]
+        for buffer_name, offsets_name in (
+            ("_nick_names", "nick_name_offsets"),
+            ("_contents", "content_offsets"),
+        ):
+            offsets = getattr(self, offsets_name)
+            shift = offsets[count]
+            del getattr(self, buffer_name)[:shift]
+            setattr(
+                self,
+                offsets_name,
+                array("Q", [offset - shift for offset in offsets[count:]]),
+            )
+        return count
+
+    def to_dicts(self, raw_time: bool = False) -> "list[dict]":
+        '''
+        转为字典列表，字段与 Barrage.to_dict 一致
+        raw_time: send_time 保留为毫秒时间戳
+        '''
+        if raw_time:
+            send_times = self.csts
+        else:
+            fromtimestamp = datetime.datetime.fromtimestamp
+            send_times = [fromtimestamp(cst / 1000, tz=TZ_UTC_8) for cst in self.csts]
+        result = [
+            {
+                "room_id": str(room_id),
+                "user_id": str(user_id),
+                "nick_name": nick_name,
+                "level": str(level),
+                "content": content,
+                "send_time": send_time,
+            }
+            for room_id, user_id, nick_name, level, content, send_time in zip(
+                self.room_ids,
+                self.user_ids,
+                self._split(self._nick_names, self.nick_name_offsets),
+                self.levels,
+                self._split(self._contents, self.content_offsets),
+                send_times,
+            )
+        ]
+        # 绝大多数弹幕没有为 None 的字段，只处理有标记的几条
+        for index, nulls in enumerate(self.nulls):
+            if nulls:
+                info = result[index]
+                for flag, field in self._NULL_FIELDS:
+                    if nulls & flag:
+                        info[field] = None
+        return result
+
+    def to_json_lines(self) -> str:
+        '''转为 JSON Lines 文本，每行与 Barrage.to_json 一致'''
+        fromtimestamp = datetime.datetime.fromtimestamp
+        dumps = json.dumps
+        lines = []
+        for info in self.to_dicts(raw_time=True):
+            info["send_time"] = fromtimestamp(
+                info["send_time"] / 1000, tz=TZ_UTC_8
+            ).strftime("%Y-%m-%d %H:%M:%S")
+            lines.append(dumps(info, ensure_ascii=False))
+        lines.append("")
+        return "\n".join(lines)
+
+
+class RoomResult(BaseModel):
+    '''
+    批量采集时单个房间的结果，失败时 error 为对应的异常
+    '''
+
+    __slots__ = ("room_id", "room", "user", "error")
+
+    def __init__(
+        self,
+        room_id: "str|int",
+        room: Room = None,
+        user: User = None,
+        error: Exception = None,
+    ) -> None:
+        self.room_id = room_id
+        self.room = room
+        self.user = user
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def error_type(self) -> str:
+        '''错误类型名称，如 RoomNotFindError'''
+        return type(self.error).__name__ if self.error else None
+
+    @property
+    def transient(self) -> bool:
+        '''是否为可以重试的临时错误'''
+        return self.error is not None and is_transient(self.error)
+
+    def to_dict(self) -> dict:
+        return {
+            "room_id": self.room_id,
+            "room": self.room.to_dict() if self.room else None,
+            "user": self.user.to_dict() if self.user else None,
+            "error_type": self.error_type,
+            "error": str(self.error) if self.error else None,
+        }
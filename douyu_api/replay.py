@@ -0,0 +1,207 @@
+'''
+弹幕原始数据的录制与回放
+
+录制：FrameRecorder 把收到的每一条 WebSocket 消息连同接收时间写入文件
+回放：ReplayDriver 把录制的消息按原速或最快速度交给客户端的 on_message，
+     不需要网络即可测量解码和分发的性能
+
+python -m douyu_api.replay 录制文件 [--speed 1] [--types chatmsg,dgb]
+'''
+import argparse
+import os
+import struct
+import threading
+import time
+
+from douyu_api.barrage import BarrageClient, BaseBarrageClient
+
+# 文件头
+MAGIC = b"DYRF1\n"
+# 每条消息：接收时间（秒）、消息长度
+FRAME_HEADER = struct.Struct("<dI")
+
+
+class FrameRecorder:
+    '''
+    把原始 WebSocket 消息追加写入文件，可以在多个线程中调用 record
+    '''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        dir_path = os.path.dirname(path)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.fp = open(path, "ab")
+        if new:
+            self.fp.write(MAGIC)
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.bytes = 0
+
+    def record(self, message: bytes, timestamp: float = None) -> None:
+        if timestamp is None:
+            timestamp = time.time()
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        with self._lock:
+            self.fp.write(FRAME_HEADER.pack(timestamp, len(message)))
+            self.fp.write(message)
+            self.frames += 1
+            self.bytes += len(message)
+
+    def attach(self, client: BaseBarrageClient) -> BaseBarrageClient:
+        '''录制客户端收到的每一条消息，需要在客户端启动前调用'''
+        msg_to_obj = client.msg_to_obj
+
+        def recording_msg_to_obj(msg: bytes):
+            self.record(msg)
+            return msg_to_obj(msg)
+
+        client.msg_to_obj = recording_msg_to_obj
+        return client
+
+    def flush(self) -> None:
+        with self._lock:
+            self.fp.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if not self.fp.closed:
+                self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def iter_frames(path: str):
+    '''按录制顺序返回 (接收时间, 消息)，末尾不完整的消息被忽略'''
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} 不是录制文件")
+    view = memoryview(data)
+    pos = len(MAGIC)
+    total = len(data)
+    while pos + FRAME_HEADER.size <= total:
+        timestamp, length = FRAME_HEADER.unpack_from(view, pos)
+        pos += FRAME_HEADER.size
+        if pos + length > total:
+            break
+        yield timestamp, bytes(view[pos:pos + length])
+        pos += length
+
+
+def load_frames(path: str) -> list:
+    return list(iter_frames(path))
+
+
+class ReplayClient(BarrageClient):
+    '''回放用的客户端，消息处理与 BarrageClient 相同，不建立连接，发送的消息被丢弃'''
+
+    def send(self, data: bytes):
+        pass
+
+    def _start_heartbeat(self):
+        pass
+
+
+def percentile(values: list, q: float) -> float:
+    '''已排序列表的分位数'''
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class ReplayDriver:
+    '''
+    把录制的消息交给客户端的 on_message，与收到 WebSocket 消息时的处理路径相同
+    speed 为空时以最快速度回放，否则按录制时的间隔除以 speed 等待
+    '''
+
+    def __init__(self, client: BarrageClient, speed: float = None) -> None:
+        self.client = client
+        self.speed = speed
+        self.items = 0
+        # 统计存入 storage 的对象数
+        store = client._store
+
+        def counting_store(infos: list):
+            self.items += len(infos)
+            store(infos)
+
+        client._store = counting_store
+
+    def feed(self, message: bytes) -> int:
+        '''处理一条消息，返回存入 storage 的对象数'''
+        items = self.items
+        self.client.on_message(None, message)
+        return self.items - items
+
+    def run(self, frames: "list|str") -> dict:
+        '''
+        回放并返回统计：消息数、对象数、字节数、耗时、每秒消息数和单条消息处理耗时的分位数
+        frames: (接收时间, 消息) 列表，或录制文件路径
+        '''
+        if isinstance(frames, str):
+            frames = load_frames(frames)
+        feed = self.feed
+        perf_counter = time.perf_counter
+        latencies = []
+        append = latencies.append
+        items = 0
+        size = 0
+        first_ts = None
+        started = perf_counter()
+        for timestamp, message in frames:
+            if self.speed:
+                if first_ts is None:
+                    first_ts = timestamp
+                delay = (timestamp - first_ts) / self.speed - (perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            begin = perf_counter()
+            items += feed(message)
+            append(perf_counter() - begin)
+            size += len(message)
+        seconds = perf_counter() - started
+        latencies.sort()
+        return {
+            "frames": len(latencies),
+            "items": items,
+            "bytes": size,
+            "seconds": seconds,
+            "frames_per_second": len(latencies) / seconds if seconds else None,
+            "p50": percentile(latencies, 0.5),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的弹幕消息并输出处理性能")
+    parser.add_argument("path", help="FrameRecorder 录制的文件")
+    parser.add_argument("--speed", type=float, default=None, help="回放倍速，默认最快速度")
+    parser.add_argument("--types", default=None, help="只解析这些消息类型，逗号分隔")
+    parser.add_argument("--room", default="0", help="房间ID")
+    args = parser.parse_args()
+
+    message_types = args.types.split(",") if args.types else None
+    client = ReplayClient(args.room, message_types=message_types, raw_time=True)
+    result = ReplayDriver(client, speed=args.speed).run(args.path)
+    print(f"消息数    {result['frames']}")
+    print(f"对象数    {result['items']}")
+    print(f"字节数    {result['bytes']}")
+    print(f"耗时      {result['seconds']:.3f} 秒")
+    if result["frames"]:
+        print(f"吞吐      {result['frames_per_second']:.0f} 条/秒")
+        print(f"p50       {result['p50'] * 1e6:.2f} us")
+        print(f"p99       {result['p99'] * 1e6:.2f} us")
+        print(f"max       {result['max'] * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,37 @@
 import json
 import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
+from requests import Session
 from requests.models import Response
 
 from .core import BaseClient
-from .model import Room, User
+from .model import Room, RoomResult, User
 from .exceptions import NotOpenError, RoomCloseError, UnknownError, RoomNotFindError
 
 
 class RoomClient(BaseClient):
-    def __init__(self, proxies: dict = None, timeout: int = 15) -> None:
-        super().__init__(proxies=proxies, timeout=timeout)
+    def __init__(
+        self,
+        proxies: dict = None,
+        timeout: int = 15,
+        session: Session = None,
+        pool_size: int = 10,
+        max_retries: int = 3,
+    ) -> None:
+        super().__init__(
+            proxies=proxies,
+            timeout=timeout,
+            session=session,
+            pool_size=pool_size,
+            max_retries=max_retries,
+        )
+
+    @staticmethod
+    def _raise_for_server_error(response: Response) -> None:
+        '''连接池重试后仍是 429 或 5xx 时抛出 HTTPError，由调用方作为临时错误重试'''
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
 
     def get_room_id_by_room_url(self, room_url: str, **kwargs) -> "int|str":
         '''
@@ -46,6 +67,7 @@ class RoomClient(BaseClient):
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.159 Safari/537.36"
         }
         response = self.get(url, headers=headers, **kwargs)
+        self._raise_for_server_error(response)
         text_response = response.text
         if "您观看的房间已被关闭" in text_response:
             raise RoomCloseError("房间被关闭")
@@ -85,12 +107,13 @@ class RoomClient(BaseClient):
         if safe_uid:
             pass
         elif room_id:
-            room = self.get_room_info(room_id)
+            room = self.get_room_info(room_id, **kwargs)
             safe_uid = room.safe_uid
         else:
             raise ValueError("up_id和room_id必须指定一个")
 
-        response = self.get(f"https://yuba.douyu.com/wbapi/web/user/detail/{safe_uid}")
+        response = self.get(f"https://yuba.douyu.com/wbapi/web/user/detail/{safe_uid}", **kwargs)
+        self._raise_for_server_error(response)
         json_info = response.json().get("data")
 
         return User(
@@ -106,3 +129,115 @@ class RoomClient(BaseClient):
             safe_uid=json_info.get("safe_uid"),
             is_anchor=json_info.get("is_anchor"),
         )
+
+    def iter_room_infos(
+        self,
+        room_ids: "iterable",
+        concurrency: int = 8,
+        with_user: bool = True,
+        **kwargs,
+    ) -> "iterator[RoomResult]":
+        '''
+        并发采集多个房间的信息，按完成顺序返回 RoomResult
+        room_ids 可以是 range 等惰性序列，同时进行中的请求不超过 concurrency 个
+        with_user: 房间信息获取成功后，继续用其 safe_uid 获取主播信息
+        连接池大小 pool_size 应不小于 concurrency
+        '''
+        room_ids = iter(room_ids)
+        # future -> (阶段, 结果)
+        pending = {}
+        exhausted = False
+
+        def fill(executor):
+            nonlocal exhausted
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    room_id = next(room_ids)
+                except StopIteration:
+                    exhausted = True
+                    break
+                future = executor.submit(self.get_room_info, room_id=room_id, **kwargs)
+                pending[future] = ("room", RoomResult(room_id))
+
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            fill(executor)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, result = pending.pop(future)
+                    try:
+                        value = future.result()
+                    except Exception as e:
+                        result.error = e
+                        yield result
+                        continue
+                    if stage == "room":
+                        result.room = value
+                        if with_user and value.safe_uid:
+                            # 主播信息依赖房间信息中的 safe_uid，完成后立即提交
+                            future = executor.submit(
+                                self.get_user_info, safe_uid=value.safe_uid, **kwargs
+                            )
+                            pending[future] = ("user", result)
+                            continue
+                    else:
+                        result.user = value
+                    yield result
+                fill(executor)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def retry_user_infos(
+        self,
+        results: "iterable[RoomResult]",
+        concurrency: int = 8,
+        **kwargs,
+    ) -> "iterator[RoomResult]":
+        '''
+        房间信息已获取、主播信息获取失败的结果，只重新获取主播信息，按完成顺序返回
+        成功时填入 user 并清除 error，失败时 error 更新为本次的异常
+        '''
+        results = [result for result in results if result.room and result.room.safe_uid]
+        if not results:
+            return
+        pending = {}
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            for result in results:
+                future = executor.submit(
+                    self.get_user_info, safe_uid=result.room.safe_uid, **kwargs
+                )
+                pending[future] = result
+            for future in as_completed(pending):
+                result = pending[future]
+                try:
+                    result.user = future.result()
+                    result.error = None
+                except Exception as e:
+                    result.error = e
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def get_room_infos(
+        self,
+        room_ids: "list",
+        concurrency: int = 8,
+        with_user: bool = True,
+        **kwargs,
+    ) -> "list[RoomResult]":
+        '''
+        并发采集多个房间的信息，结果按 room_ids 的顺序返回
+        '''
+        room_ids = list(room_ids)
+        results = {}
+        for result in self.iter_room_infos(
+            room_ids, concurrency=concurrency, with_user=with_user, **kwargs
+        ):
+            results[result.room_id] = result
+        return [results[room_id] for room_id in room_ids]
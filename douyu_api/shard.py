@@ -0,0 +1,486 @@
+'''
+多进程分片：按一致性哈希把房间分配到多个工作进程，每个进程运行自己的事件循环
+
+房间较多时，视频流的数据拷贝和弹幕的 STT 解析会占满一个解释器的 GIL，
+分到多个进程后可以使用多个 CPU。协调进程通过管道向工作进程发送
+添加、移除房间的命令并定期收集各分片的统计，工作进程退出时重新启动，
+短时间内反复退出的分片从哈希环中移除，其房间分配到其余分片。
+'''
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 工作进程的类型
+KIND_BARRAGE = "barrage"  # 每个进程一个 BarrageHub
+KIND_STREAM = "stream"  # 每个进程一个 StreamSupervisor
+KINDS = (KIND_BARRAGE, KIND_STREAM)
+
+# 分片状态
+SHARD_RUNNING = "running"
+SHARD_REMOVED = "removed"  # 反复退出，已从哈希环中移除
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    '''
+    一致性哈希环，每个节点对应 replicas 个虚拟节点
+    增减节点时只有相邻区间的键需要移动
+    '''
+
+    def __init__(self, nodes: "list" = (), replicas: int = 100) -> None:
+        self.replicas = replicas
+        self._keys = []
+        self._nodes = []
+        self.nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def add(self, node) -> None:
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            key = _hash(f"{node}#{i}")
+            index = bisect.bisect(self._keys, key)
+            self._keys.insert(index, key)
+            self._nodes.insert(index, node)
+
+    def remove(self, node) -> None:
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        pairs = [(k, n) for k, n in zip(self._keys, self._nodes) if n != node]
+        self._keys = [k for k, _ in pairs]
+        self._nodes = [n for _, n in pairs]
+
+    def get(self, key: str):
+        '''键所属的节点，环为空时返回 None'''
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._nodes[index]
+
+
+class _ShardWorker:
+    '''工作进程中运行的部分，通过管道接收命令'''
+
+    def __init__(self, conn, shard_id: int, kind: str, storage_factory, options: dict):
+        self.conn = conn
+        self.shard_id = shard_id
+        self.kind = kind
+        self.storage_factory = storage_factory
+        self.options = options
+        self.storage = None
+        self.hub = None
+        self.supervisor = None
+        self.rooms = set()
+        self.started = time.monotonic()
+        self._stopped: asyncio.Event = None
+
+    async def run(self) -> None:
+        loop = asyncio.get_event_loop()
+        self._stopped = asyncio.Event()
+        if self.storage_factory:
+            self.storage = self.storage_factory(self.shard_id)
+        if self.kind == KIND_BARRAGE:
+            from douyu_api.hub import BarrageHub
+
+            self.hub = BarrageHub(storage=self.storage, **self.options)
+            self.hub.start()
+        else:
+            from douyu_api.supervisor import StreamSupervisor
+
+            self.supervisor = StreamSupervisor(**self.options)
+            self.supervisor.start()
+        loop.add_reader(self.conn.fileno(), self._on_command)
+        logger.info(f"分片 {self.shard_id} 已启动，进程 {os.getpid()}")
+        try:
+            await self._stopped.wait()
+        finally:
+            loop.remove_reader(self.conn.fileno())
+            if self.hub:
+                await self.hub.stop()
+            if self.supervisor:
+                # 停止录制会等待下载线程，不阻塞事件循环
+                await loop.run_in_executor(None, self.supervisor.stop)
+            if self.storage is not None and hasattr(self.storage, "close"):
+                self.storage.close()
+            logger.info(f"分片 {self.shard_id} 已停止")
+
+    def _on_command(self) -> None:
+        try:
+            while self.conn.poll():
+                command, *args = self.conn.recv()
+                self._dispatch(command, *args)
+        except (EOFError, OSError):
+            # 协调进程已经退出
+            self._stopped.set()
+
+    def _dispatch(self, command: str, *args) -> None:
+        if command == "add":
+            for room_id in args[0]:
+                self.rooms.add(room_id)
+                if self.hub:
+                    self.hub.add_room(room_id)
+                else:
+                    self.supervisor.add_room(room_id)
+        elif command == "remove":
+            for room_id in args[0]:
+                self.rooms.discard(room_id)
+                if self.hub:
+                    asyncio.ensure_future(self.hub.remove_room(room_id))
+                else:
+                    self.supervisor.remove_room(room_id)
+        elif command == "stats":
+            # 回复时带上请求的序号，协调进程据此丢弃超时后才到达的回复
+            self.conn.send(("stats", args[0], self.stats()))
+        elif command == "stop":
+            self._stopped.set()
+
+    def stats(self) -> dict:
+        times = os.times()
+        info = {
+            "pid": os.getpid(),
+            "rooms": len(self.rooms),
+            "uptime": time.monotonic() - self.started,
+            "cpu_time": times.user + times.system,
+        }
+        if self.hub:
+            clients = list(self.hub.clients.values())
+            info["connected"] = sum(1 for client in clients if client.connected)
+            info["reconnects"] = sum(client.reconnects for client in clients)
+            info["gap_time"] = sum(client.gap_time for client in clients)
+        if self.supervisor:
+            status = self.supervisor.status()
+            info["recording"] = sum(
+                1 for room in status.values() if room["state"] == "recording"
+            )
+            info["bytes"] = sum(room["bytes"] for room in status.values())
+            info["bitrate"] = sum(room["metrics"]["bitrate"] for room in status.values())
+        if self.storage is not None and hasattr(self.storage, "stats"):
+            info["storage"] = self.storage.stats()
+        return info
+
+
+def _worker_main(conn, shard_id, kind, storage_factory, initializer, options) -> None:
+    '''工作进程的入口'''
+    # Ctrl+C 由协调进程处理，工作进程等待 stop 命令
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer:
+        initializer()
+    worker = _ShardWorker(conn, shard_id, kind, storage_factory, options)
+    asyncio.run(worker.run())
+
+
+class _Shard:
+    '''协调进程中一个分片的状态'''
+
+    __slots__ = (
+        "shard_id", "process", "conn", "lock", "state", "restarts", "deaths",
+        "stats", "stats_time", "stats_seq",
+    )
+
+    def __init__(self, shard_id: int) -> None:
+        self.shard_id = shard_id
+        self.process: multiprocessing.Process = None
+        self.conn = None
+        # 管道同时只能有一个线程读写
+        self.lock = threading.Lock()
+        self.state = SHARD_RUNNING
+        self.restarts = 0
+        # 最近几次退出的时间(time.monotonic())
+        self.deaths = []
+        self.stats: dict = None
+        self.stats_time: float = None
+        # 最近一次统计请求的序号
+        self.stats_seq = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "shard_id": self.shard_id,
+            "state": self.state,
+            "pid": self.process.pid if self.process else None,
+            "alive": bool(self.process and self.process.is_alive()),
+            "restarts": self.restarts,
+            "stats": self.stats,
+        }
+
+
+class ShardCoordinator:
+    '''
+    把房间按一致性哈希分配到 workers 个工作进程
+
+    kind 为 barrage 时每个进程运行一个 BarrageHub，options 传给 BarrageHub，
+    storage_factory(shard_id) 在工作进程中创建该分片的 storage，如 BarrageArchive；
+    kind 为 stream 时每个进程运行一个 StreamSupervisor，options 传给 StreamSupervisor。
+    storage_factory、initializer 和 options 需要可以被 pickle。
+    '''
+
+    def __init__(
+        self,
+        workers: int = None,
+        kind: str = KIND_BARRAGE,
+        storage_factory: "callable" = None,
+        initializer: "callable" = None,
+        replicas: int = 100,
+        check_interval: float = 1,
+        stats_interval: float = 10,
+        stats_timeout: float = 2,
+        max_restarts: int = 3,
+        restart_window: float = 60,
+        start_method: str = None,
+        **options,
+    ) -> None:
+        '''
+        workers: 工作进程数，默认为 CPU 数
+        initializer: 工作进程启动时调用，如配置日志
+        check_interval: 检查工作进程是否存活的间隔秒数
+        stats_interval: 收集各分片统计的间隔秒数
+        max_restarts / restart_window: 分片在 restart_window 秒内退出超过 max_restarts 次，
+            不再重启，其房间分配到其余分片
+        start_method: multiprocessing 的启动方式，默认 spawn
+        '''
+        if kind not in KINDS:
+            raise ValueError(f"不支持的工作进程类型:{kind}")
+        self.workers = workers or os.cpu_count() or 1
+        self.kind = kind
+        self.storage_factory = storage_factory
+        self.initializer = initializer
+        self.check_interval = check_interval
+        self.stats_interval = stats_interval
+        self.stats_timeout = stats_timeout
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.options = options
+        self.context = multiprocessing.get_context(start_method or "spawn")
+        self.ring = HashRing(replicas=replicas)
+        self.shards = {shard_id: _Shard(shard_id) for shard_id in range(self.workers)}
+        # 房间ID -> 分片ID
+        self.assignment = {}
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread = None
+        self.running = False
+
+    def _spawn(self, shard: _Shard) -> None:
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(
+            target=_worker_main,
+            args=(
+                child_conn, shard.shard_id, self.kind, self.storage_factory,
+                self.initializer, self.options,
+            ),
+            name=f"douyu-shard-{shard.shard_id}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        with shard.lock:
+            shard.process = process
+            shard.conn = parent_conn
+        shard.state = SHARD_RUNNING
+
+    def _send(self, shard: _Shard, *message) -> bool:
+        with shard.lock:
+            try:
+                shard.conn.send(message)
+                return True
+            except (OSError, ValueError) as e:
+                logger.warning(f"分片 {shard.shard_id} 发送命令失败:{str(e)}")
+                return False
+
+    def _rooms_of(self, shard_id: int) -> list:
+        return [room_id for room_id, sid in self.assignment.items() if sid == shard_id]
+
+    def add_room(self, room_id: str) -> int:
+        '''添加房间，返回所在的分片ID'''
+        room_id = str(room_id)
+        with self._lock:
+            shard_id = self.assignment.get(room_id)
+            if shard_id is not None:
+                return shard_id
+            shard_id = self.ring.get(room_id)
+            self.assignment[room_id] = shard_id
+            if self.running and shard_id is not None:
+                self._send(self.shards[shard_id], "add", [room_id])
+        return shard_id
+
+    def remove_room(self, room_id: str) -> None:
+        room_id = str(room_id)
+        with self._lock:
+            shard_id = self.assignment.pop(room_id, None)
+            if self.running and shard_id is not None:
+                self._send(self.shards[shard_id], "remove", [room_id])
+
+    def rebalance(self) -> dict:
+        '''
+        按当前的哈希环重新分配房间，只移动所属分片发生变化的房间
+        返回 {房间ID: (原分片, 新分片)}
+        '''
+        moves = {}
+        with self._lock:
+            for room_id, old in self.assignment.items():
+                new = self.ring.get(room_id)
+                if new != old:
+                    moves[room_id] = (old, new)
+            removed = {}
+            added = {}
+            for room_id, (old, new) in moves.items():
+                self.assignment[room_id] = new
+                if old is not None and self.shards[old].state == SHARD_RUNNING:
+                    removed.setdefault(old, []).append(room_id)
+                if new is not None:
+                    added.setdefault(new, []).append(room_id)
+            if self.running:
+                for shard_id, room_ids in removed.items():
+                    self._send(self.shards[shard_id], "remove", room_ids)
+                for shard_id, room_ids in added.items():
+                    self._send(self.shards[shard_id], "add", room_ids)
+        if moves:
+            logger.info(f"重新分配了 {len(moves)} 个房间")
+        return moves
+
+    def _on_death(self, shard: _Shard) -> None:
+        '''工作进程退出，调用时已持有锁'''
+        now = time.monotonic()
+        shard.deaths = [t for t in shard.deaths if now - t < self.restart_window]
+        shard.deaths.append(now)
+        with shard.lock:
+            shard.conn.close()
+        logger.error(
+            f"分片 {shard.shard_id} 的进程 {shard.process.pid} 已退出:{shard.process.exitcode}"
+        )
+        if len(shard.deaths) > self.max_restarts:
+            # 反复退出，房间交给其余分片
+            shard.state = SHARD_REMOVED
+            shard.stats = None
+            self.ring.remove(shard.shard_id)
+            logger.error(f"分片 {shard.shard_id} 反复退出，不再重启")
+            self.rebalance()
+            return
+        shard.restarts += 1
+        self._spawn(shard)
+        room_ids = self._rooms_of(shard.shard_id)
+        if room_ids:
+            self._send(shard, "add", room_ids)
+        logger.info(f"分片 {shard.shard_id} 已重启，恢复 {len(room_ids)} 个房间")
+
+    def check(self) -> None:
+        '''检查工作进程是否存活，退出的进程重新启动或移除'''
+        with self._lock:
+            for shard in self.shards.values():
+                if shard.state == SHARD_REMOVED or shard.process is None:
+                    continue
+                if not shard.process.is_alive():
+                    self._on_death(shard)
+
+    def collect_stats(self) -> dict:
+        '''向所有分片请求统计，返回 {分片ID: 统计}，未按时回复的分片为 None'''
+        with self._lock:
+            shards = [s for s in self.shards.values() if s.state == SHARD_RUNNING]
+        for shard in shards:
+            with shard.lock:
+                try:
+                    shard.stats_seq += 1
+                    shard.conn.send(("stats", shard.stats_seq))
+                    deadline = time.monotonic() + self.stats_timeout
+                    while True:
+                        if not shard.conn.poll(max(0, deadline - time.monotonic())):
+                            logger.warning(f"分片 {shard.shard_id} 没有按时返回统计")
+                            break
+                        _, seq, stats = shard.conn.recv()
+                        # 之前超时的请求迟到的回复
+                        if seq != shard.stats_seq:
+                            continue
+                        shard.stats = stats
+                        shard.stats_time = time.monotonic()
+                        break
+                except (EOFError, OSError, ValueError) as e:
+                    logger.warning(f"分片 {shard.shard_id} 获取统计失败:{str(e)}")
+        return {shard.shard_id: shard.stats for shard in shards}
+
+    def _loop(self) -> None:
+        next_stats = time.monotonic() + self.stats_interval
+        while not self._stop_event.wait(self.check_interval):
+            try:
+                self.check()
+                if time.monotonic() >= next_stats:
+                    next_stats = time.monotonic() + self.stats_interval
+                    self.collect_stats()
+            except Exception as e:
+                logger.error(f"分片检查报错:{str(type(e))} {str(e)}")
+
+    def start(self) -> None:
+        if self.running:
+            return
+        with self._lock:
+            self.running = True
+            self._stop_event.clear()
+            for shard in self.shards.values():
+                self._spawn(shard)
+                self.ring.add(shard.shard_id)
+            # 启动前添加的房间
+            for room_id in self.assignment:
+                self.assignment[room_id] = self.ring.get(room_id)
+            for shard in self.shards.values():
+                room_ids = self._rooms_of(shard.shard_id)
+                if room_ids:
+                    self._send(shard, "add", room_ids)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        logger.info(f"已启动 {self.workers} 个分片，共 {len(self.assignment)} 个房间")
+
+    def stop(self, timeout: float = 30) -> None:
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+            self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        shards = [s for s in self.shards.values() if s.state != SHARD_REMOVED]
+        for shard in shards:
+            if shard.process and shard.process.is_alive():
+                self._send(shard, "stop")
+        deadline = time.monotonic() + timeout
+        for shard in shards:
+            if shard.process is None:
+                continue
+            shard.process.join(max(0, deadline - time.monotonic()))
+            if shard.process.is_alive():
+                logger.warning(f"分片 {shard.shard_id} 没有按时退出，强制结束")
+                shard.process.terminate()
+                shard.process.join()
+            shard.conn.close()
+        logger.info("所有分片已停止")
+
+    def status(self) -> dict:
+        '''每个分片的进程、重启次数、房间数和最近一次统计'''
+        with self._lock:
+            result = {}
+            for shard_id, shard in self.shards.items():
+                info = shard.to_dict()
+                info["rooms"] = len(self._rooms_of(shard_id))
+                result[shard_id] = info
+            return result
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
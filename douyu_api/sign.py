@@ -0,0 +1,657 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+from douyu_api.exceptions import RoomNotExistError
+
+logger = logging.getLogger(__name__)
+
+# 常驻 node 进程的启动脚本：每行一个 JSON 请求，每行返回一个 JSON 结果
+NODE_BOOTSTRAP = r'''
+const vm = require('vm');
+const readline = require('readline');
+const contexts = {};
+readline.createInterface({input: process.stdin}).on('line', (line) => {
+  let out;
+  try {
+    const msg = JSON.parse(line);
+    if (msg.op === 'compile') {
+      const ctx = vm.createContext({});
+      vm.runInContext(msg.source, ctx);
+      contexts[msg.id] = ctx;
+      out = {ok: true, result: null};
+    } else if (msg.op === 'call') {
+      const func = vm.runInContext(msg.name, contexts[msg.id]);
+      out = {ok: true, result: func.apply(null, msg.args)};
+    } else if (msg.op === 'free') {
+      delete contexts[msg.id];
+      out = {ok: true, result: null};
+    }
+  } catch (e) {
+    out = {ok: false, error: String(e)};
+  }
+  process.stdout.write(JSON.stringify(out) + '\n');
+});
+'''
+
+
+def md5(data: str) -> str:
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+
+class ExecJsRuntime:
+    '''通过 execjs 执行，外部运行时每次调用都会启动新进程'''
+
+    def __init__(self) -> None:
+        import execjs
+
+        self.execjs = execjs
+
+    def compile(self, source: str):
+        return self.execjs.compile(source)
+
+
+class NodeContext:
+    def __init__(self, runtime: "NodeRuntime", source: str) -> None:
+        self.runtime = runtime
+        self.source = source
+        self.context_id = None
+        self.generation = None
+
+    def call(self, name: str, *args):
+        return self.runtime.call(self, name, *args)
+
+
+class NodeRuntime:
+    '''
+    常驻的 node 进程，编译后的函数保留在进程中，调用时不再启动新进程
+    进程意外退出或超时没有响应时会被结束，下次调用时自动重启并重新编译
+    '''
+
+    def __init__(self, node: str = "node", timeout: float = 10) -> None:
+        '''
+        timeout: 每个请求等待 node 返回的最长秒数
+        '''
+        self.node = node
+        self.timeout = timeout
+        self._process: subprocess.Popen = None
+        # 当前进程的输出，由读取线程逐行放入
+        self._lines: queue.Queue = None
+        # 每次重启进程加一，旧进程中的编译结果全部失效
+        self._generation = 0
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available(node: str = "node") -> bool:
+        return shutil.which(node) is not None
+
+    def _ensure_process(self) -> None:
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen(
+                [self.node, "-e", NODE_BOOTSTRAP],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                universal_newlines=True,
+                encoding="utf-8",
+                bufsize=1,
+            )
+            # 管道的 readline 不支持超时，在线程中读取，请求时从队列中等待
+            self._lines = queue.Queue()
+            threading.Thread(
+                target=self._read_lines,
+                args=(self._process.stdout, self._lines),
+                daemon=True,
+            ).start()
+            self._generation += 1
+            logger.debug(f"启动 node 进程 {self._process.pid}")
+
+    @staticmethod
+    def _read_lines(stdout, lines: queue.Queue) -> None:
+        try:
+            for line in stdout:
+                lines.put(line)
+        except (OSError, ValueError):
+            pass
+        # 空字符串表示进程已退出
+        lines.put("")
+
+    def _kill(self) -> None:
+        '''结束当前进程，调用时已持有锁'''
+        process, self._process = self._process, None
+        if process is None:
+            return
+        process.kill()
+        try:
+            process.wait(self.timeout)
+        except subprocess.TimeoutExpired:
+            pass
+        for stream in (process.stdin, process.stdout):
+            try:
+                stream.close()
+            except (OSError, ValueError):
+                pass
+
+    def _request(self, message: dict):
+        try:
+            self._process.stdin.write(json.dumps(message) + "\n")
+            self._process.stdin.flush()
+        except OSError:
+            self._kill()
+            raise RuntimeError("node 进程已退出")
+        try:
+            line = self._lines.get(timeout=self.timeout)
+        except queue.Empty:
+            logger.warning(f"node 进程 {self.timeout} 秒内没有响应，结束进程")
+            self._kill()
+            raise TimeoutError(f"node 进程 {self.timeout} 秒内没有响应")
+        if not line:
+            self._kill()
+            raise RuntimeError("node 进程已退出")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def compile(self, source: str) -> NodeContext:
+        context = NodeContext(self, source)
+        with self._lock:
+            self._compile(context)
+        return context
+
+    def _compile(self, context: NodeContext) -> None:
+        self._ensure_process()
+        context_id = next(self._ids)
+        self._request({"op": "compile", "id": context_id, "source": context.source})
+        context.context_id = context_id
+        context.generation = self._generation
+
+    def call(self, context: NodeContext, name: str, *args):
+        with self._lock:
+            self._ensure_process()
+            if context.generation != self._generation:
+                self._compile(context)
+            return self._request(
+                {"op": "call", "id": context.context_id, "name": name, "args": args}
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._process and self._process.poll() is None:
+                self._process.stdin.close()
+                try:
+                    self._process.wait(self.timeout)
+                except subprocess.TimeoutExpired:
+                    pass
+            self._kill()
+
+
+def default_runtime():
+    '''优先使用常驻 node 进程，没有安装 node 时退回 execjs'''
+    if NodeRuntime.available():
+        return NodeRuntime()
+    return ExecJsRuntime()
+
+
+def extract_h5(html: str) -> str:
+    '''从 m.douyu.com 的房间页面中提取 ub98484234'''
+    result = re.search(r'(function ub98484234.*)\s(var.*)', html).group()
+    return re.sub(r'eval.*;}', 'strc;}', result)
+
+
+def extract_pc(html: str) -> str:
+    '''提取 H5 播放接口使用的 ub98484234'''
+    result = re.search(
+        r'(vdwdae325w_64we[\s\S]*function ub98484234[\s\S]*?)function', html
+    ).group(1)
+    return re.sub(r'eval.*?;}', 'strc;}', result)
+
+
+def extract_video(html: str) -> "tuple[str, str]":
+    '''从 v.douyu.com 的视频页面中提取 ub98484234 和 point_id'''
+    match = re.search(
+        r'(vdwdae325w_64we[\s\S]*function ub98484234[\s\S]*?)function', html
+    )
+    if not match:
+        raise RoomNotExistError("视频不存在")
+    point_id = re.findall(r'point_id":(\d+),', html)[0]
+    func_ub9 = re.sub(r'eval.*?;}', 'strc;}', match.group(1))
+    func_ub9 = re.sub(r'</script><script>!', '', func_ub9)
+    return func_ub9, point_id
+
+
+# 检测 sign 函数是否与已知模板一致时使用的输入
+PROBE_ARGS = ("288016", "10000000000000000000000000001501", "1600000000")
+
+# 签名模板的默认缓存目录，识别过的 JS 重启后不再需要执行
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "douyu_api", "sign")
+
+# 提取后的 ub98484234：把 rk 数组逐个异或得到 sign 函数的源码并返回
+UB9_PATTERN = re.compile(
+    r'function ub98484234\s*\((\w+),(\w+),(\w+)\)\s*\{\s*'
+    r'var rk\s*=\s*\[([\d,\s]*)\];\s*'
+    r'var strc\s*=\s*"";\s*'
+    r'for\s*\(var i\s*=\s*0;\s*i\s*<\s*rk\.length;\s*i\+\+\)\s*\{\s*'
+    r'strc\s*\+=\s*String\.fromCharCode\(rk\[i\]\s*\^\s*(\d+)\);?\s*\}\s*'
+    r'return strc;\s*\}'
+)
+JS_TOKEN = re.compile(
+    r'\s*("[^"\\]*"|\'[^\'\\]*\'|[\w$.]+|[=!]==?|\+\+|--|\+=|[^\s\w$])'
+)
+SIGN_HEADER = re.compile(r'\s*\(\s*function\s*\((\w+),\s*(\w+),\s*(\w+)\)\s*\{')
+
+
+def native_sign(v: str, key_id: str, d_id: str, t_10: str) -> str:
+    '''
+    已知模板的 sign 函数的 Python 实现
+    签名为 md5(key_id + d_id + t_10 + v)，返回 v=..&did=..&tt=..&sign=..
+    '''
+    rb = md5(key_id + d_id + t_10 + v)
+    return f"v={v}&did={d_id}&tt={t_10}&sign={rb}"
+
+
+def decode_ub9(func_ub9: str) -> str:
+    '''
+    不执行 JS，直接解出 ub98484234 返回的 sign 函数源码
+    只识别 rk 数组与固定数字异或的写法，其他写法返回 None
+    '''
+    match = UB9_PATTERN.search(func_ub9)
+    if not match:
+        return None
+    key = int(match.group(5))
+    return "".join(chr(int(code) ^ key) for code in match.group(4).split(","))
+
+
+def _split_statements(body: str) -> list:
+    '''按顶层的分号和代码块切分语句，字符串中的符号不参与切分'''
+    statements = []
+    current = []
+    depth = 0
+    for token in JS_TOKEN.findall(body):
+        if token in "({[":
+            depth += 1
+        elif token in ")}]":
+            depth -= 1
+        if depth == 0 and token == ";":
+            statements.append(current)
+            current = []
+            continue
+        current.append(token)
+        if depth == 0 and token == "}":
+            statements.append(current)
+            current = []
+    if current:
+        statements.append(current)
+    return [statement for statement in statements if statement]
+
+
+def _concat(*parts: tuple) -> tuple:
+    '''拼接表达式，相邻的字符串合并，不同的拼接写法得到相同的结果'''
+    merged = []
+    for part in parts:
+        for term in part:
+            if merged and term[0] == "lit" and merged[-1][0] == "lit":
+                merged[-1] = ("lit", merged[-1][1] + term[1])
+            else:
+                merged.append(term)
+    return tuple(merged)
+
+
+def _eval_term(tokens: list, params: tuple, env: dict):
+    if len(tokens) == 1:
+        token = tokens[0]
+        if token[0] in "\"'":
+            return (("lit", token[1:-1]),)
+        if token in params:
+            return (("arg", params.index(token)),)
+        return env.get(token)
+    # CryptoJS.MD5(cb).toString()
+    if (
+        len(tokens) == 7
+        and tokens[:2] == ["CryptoJS.MD5", "("]
+        and tokens[3:] == [")", ".toString", "(", ")"]
+    ):
+        value = _eval_term(tokens[2:3], params, env)
+        return value and (("md5", value),)
+    return None
+
+
+def _eval_concat(tokens: list, params: tuple, env: dict):
+    '''
+    计算由字符串、参数、变量和 MD5 相加的表达式
+    返回 ("lit", 字符串)、("arg", 序号)、("md5", 表达式) 组成的元组，无法识别时返回 None
+    '''
+    parts = []
+    term = []
+    for token in tokens + ["+"]:
+        if token != "+":
+            term.append(token)
+            continue
+        value = _eval_term(term, params, env)
+        if value is None:
+            return None
+        parts.append(value)
+        term = []
+    return _concat(*parts)
+
+
+def match_sign_source(source: str) -> str:
+    '''
+    检查 sign 函数是否与已知模板结构一致，一致时返回其中的 v，否则返回 None
+    已知模板：rb = md5(key_id + did + tt + v)，返回 v=..&did=..&tt=..&sign=rb
+    只跟踪字符串拼接，其他语句中对这些变量的改动都会使结果无法识别
+    '''
+    header = SIGN_HEADER.match(source)
+    if not header:
+        return None
+    params = header.groups()
+    env = {}
+    result = None
+    for statement in _split_statements(source[header.end():]):
+        if result is not None:
+            # return 之后只能是函数结尾
+            if "".join(statement).rstrip(";") != "})":
+                return None
+            continue
+        if "eval" in statement or "Function" in statement or "with" in statement:
+            return None
+        if statement[0] == "return":
+            result = _eval_concat(statement[1:], params, env)
+            if result is None:
+                return None
+            continue
+        if statement[0] == "var":
+            statement = statement[1:]
+        if len(statement) >= 3 and statement[1] in ("=", "+="):
+            name = statement[0]
+            if name in params:
+                return None
+            value = _eval_concat(statement[2:], params, env)
+            if statement[1] == "+=":
+                value = value and env.get(name) and _concat(env[name], value)
+            # 无法识别的值记为 None，之后用到它的拼接都无法识别
+            env[name] = value
+            continue
+        # 循环等其他语句不能给参数或已跟踪的变量赋值
+        for i, token in enumerate(statement[:-1]):
+            if (token in env or token in params) and statement[i + 1] in ("=", "+=", "++", "--"):
+                return None
+    if not result:
+        return None
+    head = result[0]
+    if head[0] != "lit" or not re.fullmatch(r"v=\d+&did=", head[1]):
+        return None
+    v = head[1][2:-5]
+    expected = (
+        ("lit", f"v={v}&did="),
+        ("arg", 1),
+        ("lit", "&tt="),
+        ("arg", 2),
+        ("lit", "&sign="),
+        ("md5", (("arg", 0), ("arg", 1), ("arg", 2), ("lit", v))),
+    )
+    return v if result == expected else None
+
+
+def build_sign_source(res: str) -> str:
+    '''把 ub98484234 返回的函数改写为 __sign(rb, ...)，md5 结果由参数传入'''
+    func_sign = re.sub(r'return rt;}\);?', 'return rt;}', res)
+    func_sign = re.sub(r'\(function \(', 'function sign(', func_sign)
+    func_sign = func_sign.replace('CryptoJS.MD5(cb).toString()', '__rb')
+    return (
+        'var __rb = "";\n'
+        + func_sign
+        + '\nfunction __sign(rb, a, b, c) { __rb = rb; return sign(a, b, c); }'
+    )
+
+
+class SignTemplate:
+    '''
+    由 ub98484234 生成的 sign 函数，md5 结果作为参数传入，同一版本只编译一次
+    native 为真时与已知模板一致，直接用 Python 计算，不再调用 JS
+    '''
+
+    def __init__(self, source: str, v: str, native: bool = False) -> None:
+        self.source = source
+        self.v = v
+        self.native = native
+        self.context = None
+
+    def js_sign(self, runtime, key_id: str, d_id: str, t_10: str) -> str:
+        if self.context is None:
+            self.context = runtime.compile(self.source)
+        rb = md5(key_id + d_id + t_10 + self.v)
+        return self.context.call('__sign', rb, key_id, d_id, t_10)
+
+    def to_dict(self) -> dict:
+        return {"source": self.source, "v": self.v, "native": self.native}
+
+
+class Signer:
+    '''
+    斗鱼接口签名
+    缓存页面中提取的 JS、按 JS 的哈希缓存编译好的 sign 函数，
+    并在有效期内复用同一个 (key_id, d_id) 的签名结果
+    '''
+
+    def __init__(
+        self,
+        runtime=None,
+        page_ttl: float = 600,
+        sign_ttl: float = 30,
+        native: bool = True,
+        verify: bool = False,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+    ) -> None:
+        '''
+        runtime: JS 运行时，默认优先使用常驻 node 进程
+        page_ttl: 页面中提取的 JS 的缓存秒数
+        sign_ttl: 签名结果的缓存秒数，期间复用同一个时间戳 t_10
+        native: 与已知模板一致时使用 Python 计算签名
+        verify: 每次签名都同时用 JS 计算并比对，不一致时记录并改用 JS
+        cache_dir: 按 JS 哈希保存识别出的 sign 函数，重启后无需再识别或执行 JS，为空时不保存
+        '''
+        self._runtime = runtime
+        self.page_ttl = page_ttl
+        self.sign_ttl = sign_ttl
+        self.native = native
+        self.verify = verify
+        self.cache_dir = cache_dir
+        self._lock = threading.RLock()
+        # (url, 提取函数) -> (过期时间, 提取结果)
+        self._pages = {}
+        # JS 哈希 -> SignTemplate
+        self._templates = {}
+        # (JS 哈希, key_id, d_id) -> (过期时间, t_10, 签名参数)
+        self._signs = {}
+        self.metrics = {
+            "page_hits": 0,
+            "page_misses": 0,
+            "template_hits": 0,
+            "template_misses": 0,
+            "sign_hits": 0,
+            "sign_misses": 0,
+            "native_signs": 0,
+            "js_signs": 0,
+            "verify_mismatches": 0,
+        }
+
+    @property
+    def runtime(self):
+        if self._runtime is None:
+            self._runtime = default_runtime()
+        return self._runtime
+
+    def page(self, url: str, fetch: "callable", extract: "callable"):
+        '''
+        获取页面并提取签名需要的内容，结果缓存 page_ttl 秒
+        fetch: 接收 url 返回页面文本；extract: 接收页面文本返回提取结果
+        '''
+        key = (url, extract)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._pages.get(key)
+            if cached and cached[0] > now:
+                self.metrics["page_hits"] += 1
+                return cached[1]
+            self.metrics["page_misses"] += 1
+        result = extract(fetch(url))
+        with self._lock:
+            self._pages[key] = (now + self.page_ttl, result)
+        return result
+
+    def _cache_path(self, js_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{js_hash}.json")
+
+    def _load_template(self, js_hash: str) -> SignTemplate:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cache_path(js_hash), "r", encoding="utf-8") as f:
+                return SignTemplate(**json.load(f))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取签名缓存失败:{str(type(e))} {str(e)}")
+            return None
+
+    def _save_template(self, js_hash: str, template: SignTemplate) -> None:
+        if not self.cache_dir:
+            return
+        path = self._cache_path(js_hash)
+        tmp_path = f"{path}.tmp"
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(template.to_dict(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # 缓存目录不可写时只是下次重新识别
+            logger.warning(f"保存签名缓存失败:{str(type(e))} {str(e)}")
+
+    def _is_native(self, template: SignTemplate) -> bool:
+        '''用固定输入比对 JS 与 Python 的结果，一致则认为与已知模板相同'''
+        try:
+            expected = template.js_sign(self.runtime, *PROBE_ARGS)
+        except Exception as e:
+            logger.warning(f"执行 sign 函数失败:{str(type(e))} {str(e)}")
+            return False
+        if expected == native_sign(template.v, *PROBE_ARGS):
+            return True
+        logger.warning(f"sign 函数与已知模板不一致，v={template.v}，使用 JS 计算签名")
+        return False
+
+    def _build_template(self, func_ub9: str, *args) -> SignTemplate:
+        '''
+        先在 Python 中解出 sign 函数并按结构与已知模板比对，一致时不需要 JS
+        解不出时才执行 ub98484234，结构不一致时再用固定输入比对
+        '''
+        res = decode_ub9(func_ub9)
+        if res is None:
+            res = self.runtime.compile(func_ub9).call('ub98484234', *args)
+        v = match_sign_source(res)
+        if v is not None:
+            return SignTemplate(build_sign_source(res), v, native=True)
+        v = re.search(r'v=(\d+)', res).group(1)
+        template = SignTemplate(build_sign_source(res), v)
+        template.native = self._is_native(template)
+        return template
+
+    def template(self, func_ub9: str, *args) -> SignTemplate:
+        '''
+        识别 ub98484234 得到 sign 函数，按 JS 的哈希缓存在内存和 cache_dir 中
+        ub98484234 返回的是 sign 函数的源码，与传入的参数无关
+        '''
+        js_hash = md5(func_ub9)
+        with self._lock:
+            template = self._templates.get(js_hash)
+            if template:
+                self.metrics["template_hits"] += 1
+                return template
+            self.metrics["template_misses"] += 1
+            template = self._load_template(js_hash)
+            if template is None:
+                template = self._build_template(func_ub9, *args)
+                self._save_template(js_hash, template)
+            self._templates[js_hash] = template
+            return template
+
+    def _sign(self, template: SignTemplate, key_id: str, d_id: str, t_10: str) -> str:
+        if not (self.native and template.native):
+            with self._lock:
+                self.metrics["js_signs"] += 1
+            return template.js_sign(self.runtime, key_id, d_id, t_10)
+        with self._lock:
+            self.metrics["native_signs"] += 1
+        params = native_sign(template.v, key_id, d_id, t_10)
+        if self.verify:
+            expected = template.js_sign(self.runtime, key_id, d_id, t_10)
+            if expected != params:
+                with self._lock:
+                    self.metrics["verify_mismatches"] += 1
+                logger.error(
+                    f"签名结果不一致，v={template.v}:python {params}，js {expected}"
+                )
+                template.native = False
+                return expected
+        return params
+
+    def sign(
+        self,
+        func_ub9: str,
+        key_id: str,
+        d_id: str,
+        ub9_args: tuple = (),
+    ) -> "tuple[str, str]":
+        '''
+        生成签名参数，返回 (t_10, 签名参数)
+        ub9_args: 第一次执行 ub98484234 时传入的参数
+        '''
+        key = (md5(func_ub9), key_id, d_id)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._signs.get(key)
+            if cached and cached[0] > now:
+                self.metrics["sign_hits"] += 1
+                return cached[1], cached[2]
+            self.metrics["sign_misses"] += 1
+        template = self.template(func_ub9, *ub9_args)
+        t_10 = str(int(time.time()))
+        params = self._sign(template, key_id, d_id, t_10)
+        with self._lock:
+            self._signs[key] = (now + self.sign_ttl, t_10, params)
+            # 清理过期的签名，避免房间很多时无限增长
+            if len(self._signs) > 1024:
+                self._signs = {
+                    k: value for k, value in self._signs.items() if value[0] > now
+                }
+        return t_10, params
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.metrics)
+            stats["templates"] = len(self._templates)
+            stats["pages"] = len(self._pages)
+        return stats
+
+
+_default_signer: Signer = None
+_default_signer_lock = threading.Lock()
+
+
+def get_default_signer() -> Signer:
+    '''进程内共用的签名器'''
+    global _default_signer
+    with _default_signer_lock:
+        if _default_signer is None:
+            _default_signer = Signer()
+        return _default_signer
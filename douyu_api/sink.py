@@ -0,0 +1,304 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 队列已满时的处理策略
+OVERFLOW_BLOCK = "block"  # 阻塞等待消费者
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # 丢弃最早的数据
+OVERFLOW_SAMPLE = "sample"  # 按比例抽样保留新数据，其余丢弃
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SAMPLE)
+
+
+class BaseSink:
+    '''
+    数据输出的统一接口，可以替代 Queue 作为各个客户端的 storage
+    '''
+
+    def put(self, item) -> None:
+        raise NotImplementedError
+
+    def put_many(self, items: list) -> None:
+        for item in items:
+            self.put(item)
+
+    def put_many_nowait(self, items: list) -> None:
+        '''不等待的 put_many，供事件循环中调用，可能阻塞的子类需要重写'''
+        self.put_many(items)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BatchSink(BaseSink):
+    '''
+    有界的批量输出，后台线程按数量或时间把数据成批交给 write_batch
+    '''
+
+    def __init__(
+        self,
+        batch_size: int = 1000,
+        flush_interval: float = 1.0,
+        capacity: int = 100000,
+        overflow: str = OVERFLOW_BLOCK,
+        sample_rate: float = 0.1,
+        block_timeout: float = None,
+        on_written: "callable" = None,
+        on_failed: "callable" = None,
+    ) -> None:
+        '''
+        batch_size: 每批最多的数据条数，攒够即写出
+        flush_interval: 不足一批时最长等待的秒数
+        capacity: 队列容量上限
+        overflow: 队列已满时的策略 block / drop_oldest / sample
+            block 会阻塞调用 put 的线程，只适用于在线程中调用；
+            在事件循环中应调用 put_many_nowait，队列已满时丢弃新数据
+        sample_rate: sample 策略下新数据被保留的比例
+        block_timeout: block 策略下最长等待的秒数，超时后丢弃，为空时一直等待
+        on_written: on_written(batch)，一批数据写出成功后在写出线程中调用，
+            如 CrawlCheckpoint.committed，只记录已经提交的数据
+        on_failed: on_failed(batch, error)，一批数据写出失败后在写出线程中调用
+        '''
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"不支持的溢出策略:{overflow}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self.overflow = overflow
+        self.sample_rate = sample_rate
+        self.block_timeout = block_timeout
+        self.on_written = on_written
+        self.on_failed = on_failed
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._flush_requested = False
+        # 正在写出的批次数，flush 需要等待其完成
+        self._writing = 0
+        self._idle = threading.Condition(self._lock)
+        self.running = True
+
+        # 统计计数
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def write_batch(self, batch: list) -> None:
+        '''写出一批数据，由子类实现'''
+        raise NotImplementedError
+
+    def on_close(self) -> None:
+        '''写出线程退出前调用，用于释放在写出线程中创建的资源'''
+
+    def put(self, item) -> None:
+        self.put_many((item,))
+
+    def put_many(self, items: "list|tuple") -> None:
+        '''一次加锁放入多条数据'''
+        self._put_many(items, block=True)
+
+    def put_many_nowait(self, items: "list|tuple") -> None:
+        '''
+        一次加锁放入多条数据，从不等待
+        block 策略下队列已满时丢弃新数据并计入 dropped，其他策略与 put_many 相同
+        '''
+        self._put_many(items, block=False)
+
+    def _put_many(self, items: "list|tuple", block: bool) -> None:
+        if not items:
+            return
+        with self._lock:
+            if not self.running:
+                raise ValueError("sink 已经关闭")
+            queue = self._queue
+            for item in items:
+                if len(queue) >= self.capacity and not self._make_room(item, block):
+                    continue
+                queue.append(item)
+                self.enqueued += 1
+            if len(queue) >= self.batch_size:
+                self._not_empty.notify()
+
+    def _make_room(self, item, block: bool = True) -> bool:
+        '''队列已满时按策略腾出空间，返回是否接收这条数据，调用时已持有锁'''
+        if self.overflow == OVERFLOW_BLOCK and not block:
+            self._not_empty.notify()
+            self.dropped += 1
+            return False
+        if self.overflow == OVERFLOW_BLOCK:
+            # 唤醒消费者立即写出
+            self._not_empty.notify()
+            deadline = None
+            if self.block_timeout is not None:
+                deadline = time.monotonic() + self.block_timeout
+            while len(self._queue) >= self.capacity and self.running:
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        self.dropped += 1
+                        return False
+                self._not_full.wait(timeout)
+            return True
+        elif self.overflow == OVERFLOW_SAMPLE and random.random() >= self.sample_rate:
+            self.dropped += 1
+            return False
+        # drop_oldest 以及被抽中的 sample
+        self._queue.popleft()
+        self.dropped += 1
+        return True
+
+    def _take_batch(self) -> list:
+        '''取出一批数据，调用时已持有锁'''
+        queue = self._queue
+        if len(queue) <= self.batch_size:
+            batch = list(queue)
+            queue.clear()
+        else:
+            batch = [queue.popleft() for _ in range(self.batch_size)]
+        self._not_full.notify_all()
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                deadline = time.monotonic() + self.flush_interval
+                while (
+                    self.running
+                    and not self._flush_requested
+                    and len(self._queue) < self.batch_size
+                ):
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._not_empty.wait(timeout)
+                if not self._queue:
+                    self._flush_requested = False
+                    self._idle.notify_all()
+                    if not self.running:
+                        break
+                    continue
+                batch = self._take_batch()
+                self._writing += 1
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"写出 {len(batch)} 条数据失败:{str(type(e))} {str(e)}")
+                if self.on_failed is not None:
+                    self._notify(self.on_failed, batch, e)
+            else:
+                self.written += len(batch)
+                self.batches += 1
+                if self.on_written is not None:
+                    self._notify(self.on_written, batch)
+            finally:
+                with self._lock:
+                    self._writing -= 1
+        self.on_close()
+
+    @staticmethod
+    def _notify(callback: "callable", *args) -> None:
+        '''调用写出结果的回调，回调出错不影响写出线程'''
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.error(f"写出回调失败:{str(type(e))} {str(e)}")
+
+    def flush(self, timeout: float = None) -> None:
+        '''立即写出队列中的所有数据，并等待写出完成'''
+        with self._lock:
+            self._flush_requested = True
+            self._not_empty.notify()
+            self._idle.wait_for(
+                lambda: not self._queue and not self._writing, timeout
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+            self._not_empty.notify()
+            self._not_full.notify_all()
+        self._worker.join()
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "written": self.written,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+
+class CallableSink(BatchSink):
+    '''
+    把每一批数据交给一个函数处理，如批量写入数据库
+    '''
+
+    def __init__(self, consumer: "callable", **kwargs) -> None:
+        self.consumer = consumer
+        super().__init__(**kwargs)
+
+    def write_batch(self, batch: list) -> None:
+        self.consumer(batch)
+
+
+class JsonLinesSink(BatchSink):
+    '''
+    以 JSON Lines 格式追加写入文件，每一批数据只调用一次 fsync
+    '''
+
+    def __init__(self, file_path: str, fsync: bool = True, **kwargs) -> None:
+        self.file_path = file_path
+        self.fsync = fsync
+        dir_path = os.path.dirname(file_path)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        self.fp = open(file_path, "a", encoding="utf-8")
+        super().__init__(**kwargs)
+
+    @staticmethod
+    def to_json(item) -> str:
+        if hasattr(item, "to_json"):
+            return item.to_json()
+        return json.dumps(item, ensure_ascii=False, default=str)
+
+    def write_batch(self, batch: list) -> None:
+        to_json = self.to_json
+        self.fp.write("".join([to_json(item) + "\n" for item in batch]))
+        self.fp.flush()
+        if self.fsync:
+            os.fsync(self.fp.fileno())
+
+    def close(self) -> None:
+        super().close()
+        if not self.fp.closed:
+            self.fp.close()
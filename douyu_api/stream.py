@@ -3,10 +3,12 @@ import re
 import time
 import sys
 import logging
-import execjs
 import threading
 from douyu_api.exceptions import RoomNotExistError
 from douyu_api.core import BaseClient
+from douyu_api import sign
+from douyu_api.flv import FlvSegment, FlvSegmentWriter, index_path
+from douyu_api.metrics import StreamMetrics
 from requests import Session
 import datetime
 from io import BufferedWriter
@@ -16,6 +18,16 @@ import os
 
 logger = logging.getLogger(__name__)
 
+# 视频流地址模板，{key} 为 get_pre/get_js 获取的 key
+STREAM_URL_TEMPLATE = "http://tx2play1.douyucdn.cn/live/{key}.xs?uuid="
+
+# 下载结束的原因
+EXIT_STOPPED = "stopped"  # 调用了 stop
+EXIT_OFFLINE = "offline"  # 未开播
+EXIT_NOT_EXIST = "not_exist"  # 房间不存在
+EXIT_ENDED = "ended"  # 视频流中断
+EXIT_ERROR = "error"  # 其他错误
+
 
 class StreamClient(BaseClient):
     def __init__(
@@ -28,10 +40,22 @@ class StreamClient(BaseClient):
         storage: "BufferedWriter|Queue|str" = "./stream",
         interval_queue: Queue = None,
         file_interval: int = 10 * 60,
+        file_size: int = None,
         chunk_size: int = 102400,
+        signer: sign.Signer = None,
+        key_ttl: int = 300,
+        error_ttl: int = 30,
+        stream_url: str = STREAM_URL_TEMPLATE,
+        on_exit: "callable" = None,
     ) -> None:
         '''
         rate: 1流畅；2高清；3超清；4蓝光4M；0蓝光8M或10M
+        file_interval: 每个分段文件的秒数；file_size: 每个分段文件的最大字节数
+        signer: 签名器，默认使用进程内共用的签名器
+        key_ttl: 视频流地址的缓存秒数，分段和重连时复用，过期前在后台刷新
+        error_ttl: 房间不存在或未开播的结果缓存秒数
+        stream_url: 视频流地址模板，{key} 会被替换为视频流的 key
+        on_exit: 下载结束后在下载线程中调用，参数为 (client, 结束原因, 异常)
         '''
         super().__init__(proxies=proxies, timeout=timeout, session=session)
 
@@ -39,15 +63,26 @@ class StreamClient(BaseClient):
         self.rate = rate
         self.storage = storage
         self.chunk_size = chunk_size
-        self.download_size = 0
+        self.metrics = StreamMetrics()
         self.running = False
         self.stream_server: threading.Thread = None
         self.interval_queue = interval_queue
+        self.signer = signer or sign.get_default_signer()
+        self.stream_url = stream_url
+        self.on_exit = on_exit
+        self.exit_reason: str = None
+        self.key_ttl = key_ttl
+        self.error_ttl = error_ttl
+        # (过期时间, error, key)
+        self._resolved: tuple = None
+        self._resolve_lock = threading.Lock()
+        self._refresh_timer: threading.Timer = None
 
         if file_interval:
             self.file_interval = file_interval
         else:
             self.file_interval = None
+        self.file_size = file_size
 
         self.d_id = '10000000000000000000000000001501'
         self.t_10 = str(int(time.time()))
@@ -64,9 +99,7 @@ class StreamClient(BaseClient):
         data = {'rid': self.room_id, 'did': self.d_id}
         auth = self.md5(self.room_id + self.t_13)
         headers = {'rid': self.room_id, 'time': self.t_13, 'auth': auth}
-        res = self.session.post(
-            url, headers=headers, data=data, proxies=self.proxies
-        ).json()
+        res = self.post(url, headers=headers, data=data).json()
         error = res['error']
         data = res['data']
         key = ''
@@ -77,28 +110,72 @@ class StreamClient(BaseClient):
             ).group(1)
         return error, key
 
+    def _resolve(self) -> "tuple[int, str]":
+        error, key = self.get_pre()
+        if error not in (0, 102, 104):
+            key = self.get_js()
+            error = 0
+        return error, key
+
+    def resolve(self, force: bool = False) -> "tuple[int, str]":
+        '''
+        获取视频流的 key，返回 (error, key)，error 为 102 房间不存在，104 未开播
+        结果在有效期内缓存，force 为真时重新获取
+        '''
+        with self._resolve_lock:
+            if (
+                not force
+                and self._resolved
+                and self._resolved[0] > time.monotonic()
+            ):
+                return self._resolved[1], self._resolved[2]
+            error, key = self._resolve()
+            ttl = self.key_ttl if error == 0 else self.error_ttl
+            self._resolved = (time.monotonic() + ttl, error, key)
+        if error == 0:
+            self._schedule_refresh()
+        return error, key
+
+    def invalidate(self) -> None:
+        '''丢弃缓存的视频流地址，下次使用时重新获取'''
+        with self._resolve_lock:
+            self._resolved = None
+
+    def _schedule_refresh(self) -> None:
+        '''在缓存过期前刷新，分段时不用等待获取地址'''
+        if self._refresh_timer:
+            self._refresh_timer.cancel()
+        self._refresh_timer = threading.Timer(self.key_ttl * 0.8, self._refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _refresh(self) -> None:
+        if not self.running:
+            return
+        try:
+            error, key = self._resolve()
+        except Exception as e:
+            # 刷新失败时继续使用旧的地址直到过期
+            logger.warning(f"房间 {self.room_id} 刷新视频地址失败:{str(type(e))} {str(e)}")
+            return
+        ttl = self.key_ttl if error == 0 else self.error_ttl
+        with self._resolve_lock:
+            self._resolved = (time.monotonic() + ttl, error, key)
+        if error == 0:
+            self._schedule_refresh()
+
+    def _fetch_text(self, url: str) -> str:
+        return self.get(url).text
+
     def get_js(self):
-        res = self.session.get(
-            'https://m.douyu.com/' + str(self.room_id), proxies=self.proxies
-        ).text
-        result = re.search(r'(function ub98484234.*)\s(var.*)', res).group()
-        func_ub9 = re.sub(r'eval.*;}', 'strc;}', result)
-        js = execjs.compile(func_ub9)
-        res = js.call('ub98484234')
-
-        v = re.search(r'v=(\d+)', res).group(1)
-        rb = self.md5(self.room_id + self.d_id + self.t_10 + v)
-
-        func_sign = re.sub(r'return rt;}\);?', 'return rt;}', res)
-        func_sign = func_sign.replace('(function (', 'function sign(')
-        func_sign = func_sign.replace('CryptoJS.MD5(cb).toString()', '"' + rb + '"')
-
-        js = execjs.compile(func_sign)
-        params = js.call('sign', self.room_id, self.d_id, self.t_10)
+        func_ub9 = self.signer.page(
+            'https://m.douyu.com/' + str(self.room_id), self._fetch_text, sign.extract_h5
+        )
+        self.t_10, params = self.signer.sign(func_ub9, self.room_id, self.d_id)
         params += '&ver=219032101&rid={}&rate=-1'.format(self.room_id)
 
         url = 'https://m.douyu.com/api/room/ratestream'
-        res = self.session.post(url, params=params, proxies=self.proxies).text
+        res = self.post(url, params=params).text
         key = re.search(r'(\d{1,8}[0-9a-zA-Z]+)_?\d{0,4}(.m3u8|/playlist)', res).group(
             1
         )
@@ -106,70 +183,83 @@ class StreamClient(BaseClient):
         return key
 
     def get_pc_js(self, cdn='ws-h5'):
-        res = self.session.get(
-            'https://m.douyu.com/' + str(self.room_id), proxies=self.proxies
-        ).text
-        result = re.search(
-            r'(vdwdae325w_64we[\s\S]*function ub98484234[\s\S]*?)function', res
-        ).group(1)
-        func_ub9 = re.sub(r'eval.*?;}', 'strc;}', result)
-        js = execjs.compile(func_ub9)
-        res = js.call('ub98484234')
-
-        v = re.search(r'v=(\d+)', res).group(1)
-        rb = self.md5(self.room_id + self.d_id + self.t_10 + v)
-
-        func_sign = re.sub(r'return rt;}\);?', 'return rt;}', res)
-        func_sign = func_sign.replace('(function (', 'function sign(')
-        func_sign = func_sign.replace('CryptoJS.MD5(cb).toString()', '"' + rb + '"')
-
-        js = execjs.compile(func_sign)
-        params = js.call('sign', self.room_id, self.d_id, self.t_10)
+        func_ub9 = self.signer.page(
+            'https://m.douyu.com/' + str(self.room_id), self._fetch_text, sign.extract_pc
+        )
+        self.t_10, params = self.signer.sign(func_ub9, self.room_id, self.d_id)
 
         params += '&cdn={}&rate={}'.format(cdn, self.rate)
         url = 'https://www.douyu.com/lapi/live/getH5Play/{}'.format(self.room_id)
-        res = self.session.post(url, params=params, proxies=self.proxies).json()
+        res = self.post(url, params=params).json()
 
         return res
 
+    @property
+    def download_size(self) -> int:
+        '''实际收到的字节数'''
+        return self.metrics.bytes
+
+    def _on_segment_close(self, segment: FlvSegment) -> None:
+        '''分段文件关闭后将视频信息存入interval_queue'''
+        logger.debug(f"房间 {self.room_id} 存入视频数据")
+        self.metrics.segment_closed(
+            (segment.end_time - segment.start_time).total_seconds()
+        )
+        if self.interval_queue:
+            self.interval_queue.put(
+                {
+                    "room_id": self.room_id,
+                    "start_time": segment.start_time,
+                    "end_time": segment.end_time,
+                    "file_path": segment.file_path,
+                }
+            )
+
     def get_save_file_path(self, save_path, room_id) -> str:
         format_string = "%Y-%m-%d %H-%M-%S"
         date_string = "%Y-%m-%d"
         now_time = datetime.datetime.now()
         time_string = now_time.strftime(format_string)
         date_string = now_time.strftime(date_string)
-        file_name = f"{time_string}[{room_id}].flv"
-        file_path = os.path.join(save_path, date_string, str(room_id))
-        if not os.path.exists(file_path):
-            os.makedirs(file_path)
-        file_path = os.path.join(file_path, file_name)
+        dir_path = os.path.join(save_path, date_string, str(room_id))
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+        # 同一秒内多次分段或重连时加上序号，每个分段都是单独的文件
+        file_path = os.path.join(dir_path, f"{time_string}[{room_id}].flv")
+        sequence = 1
+        while os.path.exists(file_path) or os.path.exists(index_path(file_path)):
+            file_path = os.path.join(dir_path, f"{time_string}[{room_id}]_{sequence}.flv")
+            sequence += 1
 
         return file_path
 
     def download_video(self):
         while self.running:
             try:
-                error, key = self.get_pre()
+                # 分段和重连时复用缓存的地址
+                resolve_start = time.monotonic()
+                error, key = self.resolve()
+                self.metrics.resolved(time.monotonic() - resolve_start)
                 if error == 0:
                     pass
                 elif error == 102:
                     self.running = False
+                    self.exit_reason = EXIT_NOT_EXIST
                     logger.error(f"房间 {self.room_id} 不存在")
                     raise RoomNotExistError(f"房间 {self.room_id} 不存在")
                 elif error == 104:
                     self.running = False
+                    self.exit_reason = EXIT_OFFLINE
                     logger.info(f"房间 {self.room_id} 未开播")
                     break
                     # raise NotOnlineError('房间未开播')
-                else:
-                    key = self.get_js()
             except Exception as e:
                 self.running = False
                 logger.error(f"房间 {self.room_id} 获取真实视频地址报错:{str(type(e))} {str(e)}")
                 raise
             # real_url = {}
             # real_url = "http://dyscdnali1.douyucdn.cn/live/{}.flv?uuid=".format(key)
-            real_url = "http://tx2play1.douyucdn.cn/live/{}.xs?uuid=".format(key)
+            real_url = self.stream_url.format(key=key)
             # real_url["flv"] = "http://dyscdnali1.douyucdn.cn/live/{}.flv?uuid=".format(key)
             # real_url["x-p2p"] = "http://tx2play1.douyucdn.cn/live/{}.xs?uuid=".format(key)
             headers = {
@@ -177,8 +267,10 @@ class StreamClient(BaseClient):
                 'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.159 Safari/537.36',
             }
 
-            last_time = time.time()
             start_time = datetime.datetime.now()
+            # 下载循环中只调用 add，避免每个数据块格式化日志
+            add = self.metrics.add
+            self.metrics.request_started()
             try:
                 with self.session.get(
                     real_url, headers=headers, stream=True, proxies=self.proxies
@@ -186,41 +278,38 @@ class StreamClient(BaseClient):
 
                     # 目前主要使用该模式
                     if isinstance(self.storage, str):
-                        file_path = self.get_save_file_path(self.storage, self.room_id)
-                        fp = open(file_path, "ab")
-
-                        for data in response.iter_content(chunk_size=self.chunk_size):
-                            self.download_size += self.chunk_size
-                            logger.debug(f"房间 {self.room_id} 视频下载中")
-                            fp.write(data)
-                            # 判断是否需要停止
-                            if not self.running:
-                                logger.debug(f"房间 {self.room_id} 视频下载停止")
-                                fp.close()
-                                break
-                            now_time = time.time()
-                            # 判断是否需要分割
-                            if (
-                                self.file_interval
-                                and now_time - last_time > self.file_interval
-                            ):
-                                fp.close()
-                                logger.info(f"房间 {self.room_id} 视频分段")
-                                break
-                        else:
-                            self.running = False
-                            logger.warning(f"房间 {self.room_id} 直播视频流中断")
-                        fp.close()
+                        # 在同一个连接中按关键帧分段，分段时不中断下载
+                        writer = FlvSegmentWriter(
+                            lambda: self.get_save_file_path(self.storage, self.room_id),
+                            interval=self.file_interval,
+                            size=self.file_size,
+                            on_close=self._on_segment_close,
+                        )
+                        try:
+                            for data in response.iter_content(chunk_size=self.chunk_size):
+                                add(len(data))
+                                writer.write(data)
+                                # 判断是否需要停止
+                                if not self.running:
+                                    logger.debug(f"房间 {self.room_id} 视频下载停止")
+                                    break
+                            else:
+                                self.running = False
+                                self.exit_reason = EXIT_ENDED
+                                self.invalidate()
+                                logger.warning(f"房间 {self.room_id} 直播视频流中断")
+                        finally:
+                            writer.close()
                     elif isinstance(self.storage, BufferedWriter):
                         for data in response.iter_content(chunk_size=self.chunk_size):
-                            self.download_size += self.chunk_size
+                            add(len(data))
                             self.storage.write(data)
                             if not self.running:
                                 logger.debug(f"房间 {self.room_id} 视频下载停止")
                                 break
                     elif isinstance(self.storage, Queue):
                         for data in response.iter_content(chunk_size=self.chunk_size):
-                            self.download_size += self.chunk_size
+                            add(len(data))
                             self.storage.put(
                                 {
                                     "room_id": self.room_id,
@@ -236,27 +325,36 @@ class StreamClient(BaseClient):
                         raise ValueError("不支持的storage类型")
             except Exception as e:
                 self.running = False
+                self.invalidate()
                 logger.error(f"房间 {self.room_id} 下载视频报错:{str(type(e))} {str(e)}")
                 raise
-            finally:
-                # 最后将此次保存的视频信息存入interval_queue
-                logger.debug(f"房间 {self.room_id} 存入视频数据")
-                if isinstance(self.storage, str) and self.interval_queue:
-                    self.interval_queue.put(
-                        {
-                            "room_id": self.room_id,
-                            "start_time": start_time,
-                            "end_time": datetime.datetime.now(),
-                            "file_path": file_path,
-                        }
-                    )
+
+    def _run(self) -> None:
+        '''下载线程，结束后记录原因并通知 on_exit'''
+        error = None
+        self.exit_reason = None
+        try:
+            self.download_video()
+        except Exception as e:
+            error = e
+            if self.exit_reason is None:
+                self.exit_reason = EXIT_ERROR
+        finally:
+            self.metrics.stopped()
+        if self.exit_reason is None:
+            # 没有其他原因时为主动停止
+            self.exit_reason = EXIT_STOPPED
+        if self.on_exit:
+            self.on_exit(self, self.exit_reason, error)
+        elif error is not None:
+            raise error
 
     def start(self):
         if self.running == True:
             logger.info(f"房间 {self.room_id} 的视频已在采集中")
         else:
             self.running = True
-            self.stream_server = threading.Thread(target=self.download_video)
+            self.stream_server = threading.Thread(target=self._run)
             self.stream_server.start()
             logger.info(f"房间 {self.room_id} 的视频下载服务已启动")
 
@@ -265,6 +363,8 @@ class StreamClient(BaseClient):
             if self.running == True:
                 logger.info(f"房间 {self.room_id} 的视频下载服务正在关闭")
                 self.running = False
+                if self._refresh_timer:
+                    self._refresh_timer.cancel()
             else:
                 logger.info(f"房间 {self.room_id} 的视频下载已经为关闭状态")
         else:
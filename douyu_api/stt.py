@@ -0,0 +1,277 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# 客户端发送消息类型（《协议》中规定为689）
+CLIENT_MSG_TYPE = 689
+# 服务端下发消息类型（《协议》中规定为690）
+SERVER_MSG_TYPE = 690
+# 数据帧头部长度：长度(4) + 长度(4) + 消息类型(2) + 加密字段(1) + 保留字段(1)
+HEADER_SIZE = 12
+# 长度字段本身不计入长度，剩余头部8字节 + 尾部'\0'1字节
+MIN_FRAME_LENGTH = 8 + 1
+# 判断消息类型时只查看开头的字节数
+PEEK_SIZE = 64
+# 头部的消息类型(689/690)和置0的加密字段、保留字段，用于出错后重新定位数据帧
+_HEADER_TAIL = re.compile(rb"[\xb1\xb2]\x02\x00\x00")
+
+
+class FrameDecoder:
+    '''
+    增量式的STT数据帧解码器
+
+    在多次 feed 调用之间复用同一个 bytearray 缓冲区，
+    跨越多条 WebSocket 消息的数据帧会被拼接完整后再返回。
+    遇到错误的头部时保留之前已解析出的数据帧，跳过错误数据并重新定位下一帧。
+    返回的帧内容为 memoryview 切片，不会产生中间拷贝，
+    在下一次调用 feed 之前有效。
+    '''
+
+    def __init__(self, max_frame_size: int = 1024 * 1024) -> None:
+        # 单个数据帧允许的最大长度，防止错误数据撑爆缓冲区
+        self.max_frame_size = max_frame_size
+        # 未解析完成的残余数据
+        self._buffer = bytearray()
+        # 缓冲区中已经解析过的字节数
+        self._consumed = 0
+        # 遇到错误头部并重新同步的次数
+        self.errors = 0
+
+    def __len__(self) -> int:
+        '''缓冲区中等待拼接的字节数'''
+        return len(self._buffer) - self._consumed
+
+    def reset(self) -> None:
+        '''丢弃所有残余数据，通常在重新连接后调用'''
+        self._compact()
+        self._buffer.clear()
+
+    def feed(self, data: bytes) -> "list[memoryview]":
+        '''
+        输入一段字节流，返回其中所有完整数据帧的内容（不含头部和尾部'\\0'）
+        '''
+        self._compact()
+        if self._buffer:
+            # 上次有残余数据，拼接后再解析
+            self._buffer += data
+            view = memoryview(self._buffer)
+            frames, pos = self._split(view)
+            self._consumed = pos
+        else:
+            # 绝大多数消息都包含完整的数据帧，直接在原始数据上切片
+            view = memoryview(data)
+            frames, pos = self._split(view)
+            if pos < len(view):
+                self._buffer += view[pos:]
+        return frames
+
+    def _compact(self) -> None:
+        '''从缓冲区中移除已经解析过的数据'''
+        if not self._consumed:
+            return
+        try:
+            del self._buffer[: self._consumed]
+        except BufferError:
+            # 上一批返回的帧仍被外部引用，改用新的缓冲区
+            self._buffer = bytearray(memoryview(self._buffer)[self._consumed :])
+        self._consumed = 0
+
+    def _split(self, view: memoryview) -> "tuple[list[memoryview], int]":
+        frames = []
+        pos = 0
+        total = len(view)
+        max_frame_size = self.max_frame_size
+        while total - pos >= HEADER_SIZE:
+            # 获取消息长度，协议中长度字段会重复两次
+            content_length = int.from_bytes(view[pos : pos + 4], byteorder='little')
+            msg_type = int.from_bytes(view[pos + 8 : pos + 10], byteorder='little')
+            if (
+                content_length != int.from_bytes(view[pos + 4 : pos + 8], byteorder='little')
+                or content_length < MIN_FRAME_LENGTH
+                or content_length > max_frame_size
+                or (msg_type != SERVER_MSG_TYPE and msg_type != CLIENT_MSG_TYPE)
+            ):
+                # 保留已经解析出的数据帧，跳过错误数据后继续查找下一帧
+                self.errors += 1
+                logger.warning(
+                    f"{self._check_header(view, pos)}，丢弃错误数据后重新查找数据帧"
+                )
+                pos = self._resync(view, pos + 1)
+                continue
+            end = pos + 4 + content_length
+            if end > total:
+                # 数据帧不完整，等待下一条消息
+                break
+            # 去掉头部12字节和尾部'\0'
+            frames.append(view[pos + HEADER_SIZE : end - 1])
+            pos = end
+        return frames, pos
+
+    def _check_header(self, view: memoryview, pos: int) -> "str|None":
+        '''检查 pos 处的数据帧头部，合法时返回 None，否则返回错误说明'''
+        content_length = int.from_bytes(view[pos : pos + 4], byteorder='little')
+        if content_length != int.from_bytes(view[pos + 4 : pos + 8], byteorder='little'):
+            return f"数据帧的两个长度字段不一致:位置 {pos}"
+        if content_length < MIN_FRAME_LENGTH or content_length > self.max_frame_size:
+            return f"数据帧长度异常:{content_length}"
+        msg_type = int.from_bytes(view[pos + 8 : pos + 10], byteorder='little')
+        if msg_type != SERVER_MSG_TYPE and msg_type != CLIENT_MSG_TYPE:
+            return f"未知的数据帧类型:{msg_type}"
+        return None
+
+    def _resync(self, view: memoryview, pos: int) -> int:
+        '''
+        从 pos 开始查找下一个合法的数据帧头部，返回其位置
+        找不到时返回末尾不足一个头部的位置，这部分数据留到下一次 feed 再判断
+        '''
+        total = len(view)
+        # 按消息类型和加密、保留字段定位候选头部，它们位于头部的第 8~11 字节
+        for match in _HEADER_TAIL.finditer(view, pos + 8):
+            start = match.start() - 8
+            if self._check_header(view, start) is None:
+                return start
+        return max(pos, total - HEADER_SIZE + 1)
+
+
+def escape(value: str) -> str:
+    '''STT转义：'@' 转为 '@A'，'/' 转为 '@S' '''
+    if '@' in value:
+        value = value.replace('@', '@A')
+    if '/' in value:
+        value = value.replace('/', '@S')
+    return value
+
+
+def unescape(value: str) -> str:
+    '''STT反转义，与 escape 互逆'''
+    if '@' in value:
+        value = value.replace('@S', '/').replace('@A', '@')
+    return value
+
+
+def dumps(obj: "dict|list|any") -> str:
+    '''
+    将对象序列化为STT结构字符串
+    字典序列化为 key@=value/，列表序列化为 item/，嵌套结构逐层转义
+    '''
+    if isinstance(obj, dict):
+        return ''.join(
+            f"{escape(str(key))}@={escape(dumps(value))}/"
+            for key, value in obj.items()
+        )
+    elif isinstance(obj, (list, tuple)):
+        return ''.join(f"{escape(dumps(item))}/" for item in obj)
+    elif obj is None:
+        return ''
+    else:
+        return str(obj)
+
+
+def loads(content: "str|bytes|memoryview") -> "dict|list|str":
+    '''
+    将STT结构字符串反序列化为对象，嵌套的字典和由字典、列表组成的列表会递归解析
+
+    以 '/' 结尾的普通字符串和由普通字符串组成的列表序列化后完全相同，
+    嵌套的值中这种情况按字符串处理，避免弹幕内容等以 '/' 结尾的文本被误解析
+    '''
+    if not isinstance(content, str):
+        content = str(content, encoding='utf-8', errors='ignore')
+    # 序列化后的字典和列表总是以 '/' 结尾，其余都按普通字符串处理
+    if not content.endswith('/'):
+        return content
+    items = content.split('/')
+    # 末尾的 '/' 会切分出一个空字符串
+    if not items[-1]:
+        items.pop()
+    if '@=' in items[0]:
+        data = {}
+        for item in items:
+            key, sep, value = item.partition('@=')
+            if sep:
+                data[unescape(key)] = _loads_value(unescape(value))
+        return data
+    return [_loads_value(unescape(item)) for item in items]
+
+
+def _loads_value(value: str) -> "dict|list|str":
+    '''嵌套的值，只有字典或由字典、列表组成的列表才继续解析'''
+    if value.endswith('/'):
+        first = value.split('/', 1)[0]
+        if '@=' in first or first.endswith('@S'):
+            return loads(value)
+    return value
+
+
+def peek_type(frame: "bytes|memoryview") -> "str|None":
+    '''
+    不解析整个数据帧，只读取其中的 type 字段
+    '''
+    head = bytes(frame[:PEEK_SIZE])
+    if head.startswith(b'type@='):
+        end = head.find(b'/', 6)
+        if end != -1:
+            return head[6:end].decode('utf-8', errors='ignore')
+    # type 不在开头或者过长，退回到完整查找
+    content = bytes(frame)
+    if content.startswith(b'type@='):
+        start = 6
+    else:
+        start = content.find(b'/type@=')
+        if start == -1:
+            return None
+        start += 7
+    end = content.find(b'/', start)
+    if end == -1:
+        end = len(content)
+    return content[start:end].decode('utf-8', errors='ignore')
+
+
+class FieldSelector:
+    '''
+    只提取STT数据帧中指定的顶层字段，其余字段不做切分和反转义
+
+    由于值中的 '/' 都被转义为 '@S'，'/key@=' 只可能出现在字段边界上，
+    因此可以直接在原始字符串中查找需要的字段。
+    '''
+
+    def __init__(self, fields: "tuple|list|set") -> None:
+        self.fields = tuple(fields)
+        self._needles = tuple(
+            (field, f"/{field}@=", f"{field}@=") for field in self.fields
+        )
+
+    def __call__(self, content: "str|bytes|memoryview") -> dict:
+        if not isinstance(content, str):
+            content = str(content, encoding='utf-8', errors='ignore')
+        data = {}
+        for field, needle, head in self._needles:
+            if content.startswith(head):
+                start = len(head)
+            else:
+                start = content.find(needle)
+                if start == -1:
+                    continue
+                start += len(needle)
+            end = content.find('/', start)
+            if end == -1:
+                end = len(content)
+            data[field] = unescape(content[start:end])
+        return data
+
+
+def encode_frame(content: str, msg_type: int = CLIENT_MSG_TYPE) -> bytes:
+    '''
+    将STT结构字符串封装为一个数据帧
+    '''
+    # 以UTF-8编码格式 编码字符串，字符串转化为字节流
+    content_byte = content.encode('utf-8')
+    # 头部8字节，尾部1字节，与字符串长度相加即数据长度
+    length_byte = int.to_bytes(
+        len(content_byte) + MIN_FRAME_LENGTH, length=4, byteorder='little'
+    )
+    # 消息类型按照小端顺序写入，后两个字节即《协议》中规定的加密字段与保留字段，置0
+    type_byte = int.to_bytes(msg_type, length=2, byteorder='little')
+    return b''.join(
+        (length_byte, length_byte, type_byte, b'\x00\x00', content_byte, b'\x00')
+    )
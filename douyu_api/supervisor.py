@@ -0,0 +1,266 @@
+import logging
+import random
+import threading
+import time
+
+from douyu_api import stream
+from douyu_api.metrics import prometheus_text
+from douyu_api.room import RoomClient
+from douyu_api.stream import StreamClient
+
+logger = logging.getLogger(__name__)
+
+# 房间状态
+ROOM_IDLE = "idle"  # 等待检查是否开播
+ROOM_RECORDING = "recording"
+ROOM_BACKOFF = "backoff"  # 出错后等待重新开始
+ROOM_OFFLINE = "offline"
+ROOM_NOT_EXIST = "not_exist"
+
+
+class RoomState:
+    '''StreamSupervisor 中一个房间的录制状态'''
+
+    __slots__ = (
+        "room_id", "client", "state", "restarts", "failures", "next_start",
+        "started_at", "uptime", "last_exit", "last_error",
+    )
+
+    def __init__(self, room_id: str, client: StreamClient) -> None:
+        self.room_id = room_id
+        self.client = client
+        self.state = ROOM_IDLE
+        self.restarts = 0
+        # 连续失败的次数，决定退避时间
+        self.failures = 0
+        # 计划开始录制的时间(time.monotonic())
+        self.next_start: float = None
+        self.started_at: float = None
+        # 之前各次录制的累计时长
+        self.uptime = 0.0
+        self.last_exit: str = None
+        self.last_error: str = None
+
+    def current_uptime(self) -> float:
+        if self.started_at is None:
+            return self.uptime
+        return self.uptime + time.monotonic() - self.started_at
+
+    def to_dict(self) -> dict:
+        return {
+            "room_id": self.room_id,
+            "state": self.state,
+            "bytes": self.client.download_size,
+            "uptime": self.current_uptime(),
+            "restarts": self.restarts,
+            "failures": self.failures,
+            "last_exit": self.last_exit,
+            "last_error": self.last_error,
+            "metrics": self.client.metrics.snapshot(),
+        }
+
+
+class StreamSupervisor:
+    '''
+    管理多个房间的直播录制
+
+    录制结束或出错时立即收到通知，按带随机抖动的指数退避重新开始；
+    未开播的房间通过 RoomClient 成批检查开播状态，开播后立即开始录制。
+    所有调度都在一个线程中完成，每个正在录制的房间各占用一个下载线程。
+    '''
+
+    def __init__(
+        self,
+        room_ids: "list" = (),
+        storage: str = "./stream",
+        poll_interval: float = 30,
+        poll_concurrency: int = 8,
+        base_backoff: float = 1,
+        max_backoff: float = 300,
+        stable_time: float = 60,
+        room_client: RoomClient = None,
+        **client_kwargs,
+    ) -> None:
+        '''
+        poll_interval: 检查未开播房间的间隔秒数
+        poll_concurrency: 检查开播状态时的并发请求数
+        base_backoff / max_backoff: 出错后重新开始的等待秒数的初始值和上限
+        stable_time: 录制超过该秒数后结束，视为正常结束，退避重新计算
+        client_kwargs: 传给 StreamClient 的其他参数，如 rate、file_interval、stream_url
+        '''
+        self.storage = storage
+        self.poll_interval = poll_interval
+        self.poll_concurrency = poll_concurrency
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.stable_time = stable_time
+        self.room_client = room_client or RoomClient(pool_size=poll_concurrency)
+        self.client_kwargs = client_kwargs
+        self.rooms = {}
+        self._cond = threading.Condition()
+        self._thread: threading.Thread = None
+        self._next_poll = 0.0
+        self.running = False
+        for room_id in room_ids:
+            self.add_room(room_id)
+
+    def add_room(self, room_id: str) -> RoomState:
+        room_id = str(room_id)
+        with self._cond:
+            if room_id in self.rooms:
+                return self.rooms[room_id]
+            client = StreamClient(
+                room_id=room_id,
+                storage=self.storage,
+                on_exit=self._on_exit,
+                **self.client_kwargs,
+            )
+            room = RoomState(room_id, client)
+            # 新加入的房间立即尝试录制，未开播时由开播检查接管
+            room.next_start = time.monotonic()
+            room.state = ROOM_BACKOFF
+            self.rooms[room_id] = room
+            self._cond.notify()
+        return room
+
+    def remove_room(self, room_id: str) -> None:
+        with self._cond:
+            room = self.rooms.pop(str(room_id), None)
+        if room:
+            room.client.stop()
+
+    def backoff(self, failures: int) -> float:
+        '''第 failures 次连续失败后的等待秒数，在一半到全部之间随机，避免同时重连'''
+        delay = min(self.max_backoff, self.base_backoff * 2 ** max(failures - 1, 0))
+        return delay * (0.5 + random.random() / 2)
+
+    def _on_exit(self, client: StreamClient, reason: str, error: Exception) -> None:
+        '''录制结束，在下载线程中调用'''
+        with self._cond:
+            room = self.rooms.get(client.room_id)
+            if room is None or room.client is not client:
+                return
+            now = time.monotonic()
+            lasted = 0.0
+            if room.started_at is not None:
+                lasted = now - room.started_at
+                room.uptime += lasted
+                room.started_at = None
+            room.last_exit = reason
+            room.last_error = f"{type(error).__name__}: {error}" if error else None
+            if reason == stream.EXIT_STOPPED or not self.running:
+                room.state = ROOM_IDLE
+            elif reason == stream.EXIT_NOT_EXIST:
+                room.state = ROOM_NOT_EXIST
+                logger.error(f"房间 {room.room_id} 不存在，停止录制")
+            elif reason == stream.EXIT_OFFLINE:
+                room.state = ROOM_OFFLINE
+                room.failures = 0
+            else:
+                # 视频流中断或出错，立即安排重新开始
+                if lasted >= self.stable_time:
+                    room.failures = 0
+                room.failures += 1
+                delay = self.backoff(room.failures)
+                room.state = ROOM_BACKOFF
+                room.next_start = now + delay
+                logger.warning(
+                    f"房间 {room.room_id} 录制结束({reason})，{delay:.1f} 秒后重新开始"
+                )
+            self._cond.notify()
+
+    def _start_room(self, room: RoomState) -> None:
+        '''开始录制，调用时已持有锁'''
+        if room.client.running:
+            return
+        room.state = ROOM_RECORDING
+        room.next_start = None
+        room.started_at = time.monotonic()
+        if room.last_exit is not None:
+            room.restarts += 1
+        room.client.start()
+
+    def poll(self) -> None:
+        '''成批检查未开播房间的状态，开播的房间立即开始录制'''
+        with self._cond:
+            room_ids = [
+                room.room_id for room in self.rooms.values() if room.state == ROOM_OFFLINE
+            ]
+        if not room_ids:
+            return
+        online = []
+        for result in self.room_client.iter_room_infos(
+            room_ids, concurrency=self.poll_concurrency, with_user=False
+        ):
+            if result.ok:
+                if result.room.show_status == 1 and result.room.video_loop != 1:
+                    online.append(result.room_id)
+            else:
+                # 无法通过房间信息判断时，交给 StreamClient 获取视频流地址来确认
+                online.append(result.room_id)
+        with self._cond:
+            for room_id in online:
+                room = self.rooms.get(room_id)
+                if room and room.state == ROOM_OFFLINE:
+                    logger.info(f"房间 {room_id} 已开播，开始录制")
+                    # 缓存的未开播结果还在 error_ttl 内，不丢弃会立即再次以未开播退出
+                    room.client.invalidate()
+                    self._start_room(room)
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                if not self.running:
+                    return
+                now = time.monotonic()
+                deadline = self._next_poll
+                for room in self.rooms.values():
+                    if room.state == ROOM_BACKOFF:
+                        if room.next_start <= now:
+                            self._start_room(room)
+                        else:
+                            deadline = min(deadline, room.next_start)
+                poll = now >= self._next_poll
+                if poll:
+                    self._next_poll = now + self.poll_interval
+                else:
+                    # 等到下一个计划时间，或被录制结束的通知唤醒
+                    self._cond.wait(deadline - now)
+                    continue
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"检查开播状态报错:{str(type(e))} {str(e)}")
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self.running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        logger.info(f"录制服务已启动，共 {len(self.rooms)} 个房间")
+
+    def stop(self) -> None:
+        with self._cond:
+            self.running = False
+            rooms = list(self.rooms.values())
+            self._cond.notify()
+        for room in rooms:
+            room.client.stop()
+        if self._thread:
+            self._thread.join()
+        logger.info("录制服务已停止")
+
+    def status(self) -> dict:
+        '''每个房间的状态、下载字节数、录制时长和重启次数'''
+        with self._cond:
+            return {room_id: room.to_dict() for room_id, room in self.rooms.items()}
+
+    def prometheus(self) -> str:
+        '''所有房间的吞吐指标，Prometheus 文本格式'''
+        with self._cond:
+            snapshots = {
+                room_id: room.client.metrics.snapshot()
+                for room_id, room in self.rooms.items()
+            }
+        return prometheus_text(snapshots)
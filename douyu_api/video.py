@@ -2,14 +2,17 @@ import hashlib
 import re
 import time
 import datetime
-import execjs
 import logging
-import requests
 from douyu_api.exceptions import RoomNotExistError
 from douyu_api.core import BaseClient
+from douyu_api import sign
+from douyu_api.hls import HlsDownloader, HlsJob, HlsProgress, TokenBucket
+import bisect
+import itertools
 import os
 import threading
-from urllib.parse import parse_qs
+from collections import defaultdict
+from urllib.parse import parse_qs, urlparse
 from requests import Session
 
 logger = logging.getLogger(__name__)
@@ -22,9 +25,20 @@ class VideoClient(BaseClient):
             storage: str = './video',
             session: Session = None,
             proxies: dict = None,
-            timeout: int = 15
+            timeout: int = 15,
+            signer: sign.Signer = None,
+            workers: int = 8,
+            on_progress: "callable" = None,
     ):
+        '''
+        workers: 同时下载的分片数
+        on_progress: 每完成一个分片调用一次，参数为 HlsProgress
+        '''
         super().__init__(proxies=proxies, timeout=timeout, session=session)
+        self.signer = signer or sign.get_default_signer()
+        self.workers = workers
+        self.on_progress = on_progress
+        self.downloader: HlsDownloader = None
         self.storage = storage
         self.video_id = video_id
         self.d_id = '10000000000000000000000000001501'
@@ -44,32 +58,18 @@ class VideoClient(BaseClient):
         获取斗鱼getStreamUrl的参数
         :return: 参数
         """
-        res = requests.get(
-            'https://v.douyu.com/show/' + str(self.video_id), proxies=self.proxies
-        ).text
         try:
-            result = re.search(
-                r'(vdwdae325w_64we[\s\S]*function ub98484234[\s\S]*?)function', res
-            ).group(1)
-        except AttributeError:
+            func_ub9, point_id = self.signer.page(
+                'https://v.douyu.com/show/' + str(self.video_id),
+                lambda url: self.get(url).text,
+                sign.extract_video,
+            )
+        except RoomNotExistError:
             logger.error(f'视频{self.video_id}不存在')
             raise RoomNotExistError(f"视频{self.video_id}不存在")
-        point_id = re.findall(r'point_id":(\d+),', res)[0]
-
-        func_ub9 = re.sub(r'eval.*?;}', 'strc;}', result)
-        func_ub9 = re.sub(r'</script><script>!', '', func_ub9)
-        # print(func_ub9)
-        js = execjs.compile(func_ub9)
-        res = js.call('ub98484234', point_id, self.d_id, self.t_10)
-        v = re.search(r'v=(\d+)', res).group(1)
-        rb = self.md5(point_id + self.d_id + self.t_10 + v)
-        func_sign = re.sub(r'return rt;}\);?', 'return rt;}', res)
-
-        func_sign = re.sub(r'\(function \(', 'function sign(', func_sign)
-        func_sign = re.sub('CryptoJS\.MD5\(cb\)\.toString\(\)', '"' + rb + '"', func_sign)
-
-        js = execjs.compile(func_sign)
-        res = js.call('sign', point_id, self.d_id, self.t_10)
+        self.t_10, res = self.signer.sign(
+            func_ub9, point_id, self.d_id, ub9_args=(point_id, self.d_id, self.t_10)
+        )
         params = res + f'&vid={self.video_id}'
         return params
 
@@ -88,34 +88,65 @@ class VideoClient(BaseClient):
 
         return file_path
 
-    def download(self):
+    @staticmethod
+    def get_video_file_path(save_path, video_id) -> str:
+        '''
+        视频的保存路径，同一个视频的路径固定，中断后再次下载会从断点继续
+        '''
+        file_path = os.path.join(save_path, str(video_id))
+        if not os.path.exists(file_path):
+            os.makedirs(file_path)
+        return os.path.join(file_path, f"{video_id}.ts")
+
+    def get_segment_urls(self) -> "list[str]":
+        '''获取视频所有分片的下载地址'''
         params = self.get_param()
         params = parse_qs(params)
         result = {key: params[key][0] for key in params}
         try:
-            response = requests.post(self.url, data=result, headers=self.headers).json()
+            response = self.post(self.url, data=result, headers=self.headers).json()
         except Exception as e:
             self.running = False
             logger.error(f'视频{self.video_id}获取下载m3u8文件链接报错：{str(e)}')
             raise
         video_m3u8 = response.get('data').get('thumb_video').get('high').get('url')
         try:
-            response = requests.get(video_m3u8, headers=self.headers).text
+            response = self.get(video_m3u8, headers=self.headers).text
         except Exception as e:
             self.running = False
             logger.error(f'视频{self.video_id}获取m3u8文件报错: {str(e)}')
             raise
         video_list = re.findall(r'(transcode.*?)\n', response)
-        file_path = self.get_save_file_path(self.storage, self.video_id)
-        a = 0
-        with open(f'{file_path}.ts', 'ab') as f:
-            for video in video_list:
-                res = re.findall(r'(_\d+-upload-.*?)_', video)[0]
-                full_url = f'https://play-tx-ugcpub.douyucdn2.cn/live/high{res}/{video}'
-                response = requests.get(full_url, headers=self.headers).content
-                f.write(response)
-                a += 1
-                print(f'{a} / {len(video_list)}')
+        urls = []
+        for video in video_list:
+            res = re.findall(r'(_\d+-upload-.*?)_', video)[0]
+            urls.append(f'https://play-tx-ugcpub.douyucdn2.cn/live/high{res}/{video}')
+        return urls
+
+    def download(self):
+        urls = self.get_segment_urls()
+        file_path = self.get_video_file_path(self.storage, self.video_id)
+        self.downloader = HlsDownloader(
+            workers=self.workers,
+            on_progress=self.on_progress,
+            headers=self.headers,
+            proxies=self.proxies,
+            timeout=self.timeout,
+        )
+        try:
+            progress = self.downloader.download(urls, file_path)
+        except Exception as e:
+            self.running = False
+            logger.error(f'视频{self.video_id}下载分片报错: {str(type(e))} {str(e)}')
+            raise
+        logger.info(
+            f'视频{self.video_id}下载完成，共 {progress.done} 个分片，{progress.bytes} 字节'
+        )
+
+    @property
+    def progress(self) -> HlsProgress:
+        '''当前的下载进度，还没有开始下载时为空'''
+        return self.downloader.progress if self.downloader else None
 
     def start(self):
         if self.running:
@@ -132,6 +163,8 @@ class VideoClient(BaseClient):
             if self.running:
                 logger.info(f'视频{self.video_id}正在关闭下载')
                 self.running = False
+                if self.downloader:
+                    self.downloader.stop()
             else:
                 logger.info(f'视频{self.video_id}下载服务已经关闭')
 
@@ -139,9 +172,252 @@ class VideoClient(BaseClient):
             logger.info(f'视频{self.video_id}下载服务不存在')
 
 
+# 下载任务的状态
+TASK_QUEUED = "queued"
+TASK_RESOLVING = "resolving"
+TASK_DOWNLOADING = "downloading"
+TASK_DONE = "done"
+TASK_FAILED = "failed"
+
+
+class VideoTask:
+    '''VideoDownloadManager 中一个视频的下载任务'''
+
+    __slots__ = ("video_id", "deadline", "seq", "state", "job", "host", "active", "error")
+
+    def __init__(self, video_id: str, seq: int, deadline: float = None) -> None:
+        self.video_id = video_id
+        self.deadline = deadline
+        self.seq = seq
+        self.state = TASK_QUEUED
+        self.job: HlsJob = None
+        self.host: str = None
+        # 正在下载的分片数
+        self.active = 0
+        self.error: Exception = None
+
+    @property
+    def priority(self) -> tuple:
+        '''有截止时间的任务按截止时间优先，其余按加入顺序'''
+        return (self.deadline if self.deadline is not None else float("inf"), self.seq)
+
+    def to_dict(self) -> dict:
+        data = {
+            "video_id": self.video_id,
+            "state": self.state,
+            "deadline": self.deadline,
+            "active": self.active,
+            "error": f"{type(self.error).__name__}: {self.error}" if self.error else None,
+        }
+        if self.job:
+            data.update(self.job.progress.to_dict())
+            data["file_path"] = self.job.file_path
+        return data
+
+
+class VideoDownloadManager:
+    '''
+    批量下载视频
+
+    所有视频的分片共用一个线程池和连接池，按优先级调度：
+    有截止时间的视频按截止时间优先，其余按加入顺序。
+    同时限制总并发数、每个域名的并发数和总带宽。
+    '''
+
+    def __init__(
+        self,
+        storage: str = './video',
+        workers: int = 16,
+        per_host: int = 8,
+        bandwidth: float = None,
+        window: int = 32,
+        segment_retries: int = 3,
+        segment_requeues: int = 3,
+        on_complete: "callable" = None,
+        proxies: dict = None,
+        timeout: int = 15,
+        signer: sign.Signer = None,
+    ):
+        '''
+        workers: 总的并发下载数，即工作线程数
+        per_host: 每个域名同时进行的下载数
+        bandwidth: 总带宽上限，字节/秒，为空时不限速
+        window: 每个视频的下载位置最多领先拼接位置的分片数
+        segment_requeues: 分片重试后仍然失败时重新排队的次数，超过后视频下载失败
+        on_complete: 每个视频下载完成或失败后调用，参数为 VideoTask
+        '''
+        self.storage = storage
+        self.workers = workers
+        self.per_host = per_host
+        self.window = window
+        self.segment_requeues = segment_requeues
+        self.on_complete = on_complete
+        self.signer = signer
+        self.bucket = TokenBucket(bandwidth) if bandwidth else None
+        self.fetcher = HlsDownloader(
+            workers=workers,
+            segment_retries=segment_retries,
+            proxies=proxies,
+            timeout=timeout,
+            throttle=self.bucket.consume if self.bucket else None,
+        )
+        self.tasks = {}
+        # 未结束的任务，按优先级排序
+        self._queue = []
+        self._seq = itertools.count()
+        self._host_active = defaultdict(int)
+        self._cond = threading.Condition()
+        self._threads = []
+        self.running = False
+
+    def add(self, video_id: str, deadline: float = None) -> VideoTask:
+        '''
+        加入一个视频，已经加入的视频不会重复下载
+        deadline: 截止时间(time.time())，越早越优先
+        '''
+        video_id = str(video_id)
+        with self._cond:
+            task = self.tasks.get(video_id)
+            if task and task.state != TASK_FAILED:
+                return task
+            task = VideoTask(video_id, next(self._seq), deadline)
+            self.tasks[video_id] = task
+            bisect.insort(self._queue, (task.priority, task))
+            self._cond.notify()
+        logger.info(f"视频{video_id}加入下载队列")
+        return task
+
+    def _next_work(self):
+        '''按优先级领取一项工作，没有可做的工作时等待，调用时已持有锁'''
+        while self.running:
+            for _, task in self._queue:
+                if task.state == TASK_QUEUED:
+                    task.state = TASK_RESOLVING
+                    return task, None
+                if (
+                    task.state == TASK_DOWNLOADING
+                    and self._host_active[task.host] < self.per_host
+                    and task.job.can_take()
+                ):
+                    # take 只领取分片，拼接在 segment_done 中进行，不持有全局的锁
+                    segments = task.job.take(1)
+                    if task.job.finished:
+                        self._finish(task)
+                        break
+                    if segments:
+                        self._host_active[task.host] += 1
+                        task.active += 1
+                        return task, segments[0]
+            else:
+                self._cond.wait()
+        return None, None
 
+    def _finish(self, task: VideoTask, error: Exception = None) -> None:
+        '''结束任务，调用时已持有锁'''
+        if task.state in (TASK_DONE, TASK_FAILED):
+            return
+        task.error = error
+        task.state = TASK_FAILED if error else TASK_DONE
+        self._queue.remove((task.priority, task))
+        if task.job:
+            task.job.close()
+        if error:
+            logger.error(f"视频{task.video_id}下载失败:{str(type(error))} {str(error)}")
+        else:
+            logger.info(f"视频{task.video_id}下载完成")
+        self._cond.notify_all()
+        if self.on_complete:
+            self.on_complete(task)
 
+    def _resolve(self, task: VideoTask) -> None:
+        client = VideoClient(
+            video_id=task.video_id,
+            storage=self.storage,
+            session=self.fetcher.session,
+            proxies=self.fetcher.proxies,
+            timeout=self.fetcher.timeout,
+            signer=self.signer,
+        )
+        urls = client.get_segment_urls()
+        job = HlsJob(urls, client.get_video_file_path(self.storage, task.video_id), self.window)
+        job.open()
+        with self._cond:
+            task.job = job
+            task.host = urlparse(urls[0]).netloc if urls else ""
+            task.state = TASK_DOWNLOADING
+            if job.finished:
+                self._finish(task)
+            self._cond.notify_all()
 
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                task, segment = self._next_work()
+            if task is None:
+                return
+            if segment is None:
+                try:
+                    self._resolve(task)
+                except Exception as e:
+                    with self._cond:
+                        self._finish(task, e)
+                continue
+            index, url, part_path = segment
+            error = None
+            try:
+                size, md5 = self.fetcher.fetch_segment(url, part_path, task.job.progress)
+                task.job.segment_done(index, size, md5)
+            except Exception as e:
+                error = e
+            with self._cond:
+                self._host_active[task.host] -= 1
+                task.active -= 1
+                if error is not None:
+                    if not self.running:
+                        pass
+                    elif task.job.requeue(index, self.segment_requeues):
+                        # 只重新下载这个分片，不让整个视频失败
+                        logger.warning(
+                            f"视频{task.video_id}分片 {index} 下载失败，重新排队:"
+                            f"{str(type(error))} {str(error)}"
+                        )
+                    else:
+                        self._finish(task, error)
+                elif task.job.finished:
+                    self._finish(task)
+                self._cond.notify_all()
 
+    def start(self) -> None:
+        if self.running:
+            return
+        self.running = True
+        self.fetcher.running = True
+        self._threads = [
+            threading.Thread(target=self._worker, daemon=True) for _ in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"视频下载服务已启动，{self.workers} 个工作线程")
+
+    def join(self, timeout: float = None) -> bool:
+        '''等待所有任务结束，返回是否全部结束'''
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue, timeout)
+
+    def stop(self) -> None:
+        '''停止下载，正在下载的分片保留在临时目录中，再次加入后从断点继续'''
+        with self._cond:
+            self.running = False
+            self.fetcher.stop()
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        for _, task in self._queue:
+            if task.job:
+                task.job.close()
+        logger.info("视频下载服务已停止")
 
+    def status(self) -> dict:
+        with self._cond:
+            return {video_id: task.to_dict() for video_id, task in self.tasks.items()}
 
@@ -9,7 +9,9 @@ here = os.path.abspath(os.path.dirname(__file__))
 # 打包哪些文件夹
 packages = ['douyu_api']
 # 安装依赖包
-requires = ['requests>=2.26.0', 'websocket-client', "pystt", "PyExecJS"]
+requires = ['requests>=2.26.0', 'websocket-client', "PyExecJS"]
+# 可选依赖包
+extras = {"zstd": ["zstandard"]}
 # 测试依赖包
 test_requirements = []
 # 读取about信息
@@ -35,6 +37,7 @@ setup(
     include_package_data=True,
     python_requires=">=3.7.0",
     install_requires=requires,
+    extras_require=extras,
     license=about['__license__'],
     zip_safe=False,
     tests_require=test_requirements,
@@ -0,0 +1,74 @@
+'''
+回放基准测试：通过 client.on_message 处理生成的混合流量，
+记录每秒消息数、单条消息处理耗时的 p99 和 tracemalloc 统计的内存分配
+
+python -m pytest tests/bench_replay.py --benchmark-columns=mean,ops
+'''
+import tracemalloc
+
+import pytest
+
+from benchmarks.bench_replay import generate_frames
+from douyu_api.replay import ReplayClient, ReplayDriver
+from douyu_api.sink import CallableSink
+
+FRAMES = 5000
+
+CASES = {
+    "all": {},
+    "all_raw_time": {"raw_time": True},
+    "chatmsg": {"message_types": {"chatmsg"}},
+    "chatmsg_raw_time": {"message_types": {"chatmsg"}, "raw_time": True},
+}
+
+
+@pytest.fixture(scope="module")
+def frames():
+    return generate_frames(FRAMES)
+
+
+@pytest.fixture
+def sink():
+    sink = CallableSink(lambda batch: None, batch_size=1000, flush_interval=60)
+    yield sink
+    sink.close()
+
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_replay_throughput(benchmark, frames, sink, case):
+    def setup():
+        # 每一轮使用新的客户端，上一轮末尾不完整的数据帧不影响下一轮
+        client = ReplayClient("9999", storage=sink, **CASES[case])
+        return (ReplayDriver(client), frames), {}
+
+    result = benchmark.pedantic(
+        lambda driver, frames: driver.run(frames), setup=setup, rounds=3
+    )
+    benchmark.extra_info["frames_per_second"] = round(result["frames_per_second"])
+    benchmark.extra_info["items_per_second"] = round(result["items"] / result["seconds"])
+    benchmark.extra_info["p99_us"] = round(result["p99"] * 1e6, 2)
+    assert result["frames"] == FRAMES
+    assert result["items"] > 0
+
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_replay_allocations(benchmark, frames, sink, case):
+    driver = ReplayDriver(ReplayClient("9999", storage=sink, **CASES[case]))
+
+    def replay():
+        # tracemalloc 会拖慢处理速度，这里的耗时不代表吞吐
+        tracemalloc.start()
+        try:
+            for _, message in frames:
+                driver.feed(message)
+            sink.flush()
+            return tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    current, peak = benchmark.pedantic(replay, rounds=1)
+    benchmark.extra_info["peak_kib"] = round(peak / 1024)
+    benchmark.extra_info["retained_bytes_per_frame"] = round(current / FRAMES, 1)
+    assert driver.items > 0
+    # 写出后的对象不再被客户端或 storage 持有
+    assert current / FRAMES < 256
@@ -0,0 +1,365 @@
+'''
+测试共用的本地替身服务：弹幕 WebSocket 服务、HTTP 代理
+'''
+import asyncio
+import base64
+import hashlib
+import http.server
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from douyu_api import stt
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def wait_for(predicate, timeout: float = 5, interval: float = 0.01) -> bool:
+    '''等待 predicate 为真，超时返回 False'''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+def flv_tag(tag_type: int, timestamp: int, body: bytes) -> bytes:
+    '''完整的 FLV 标签，包括标签头和 PreviousTagSize'''
+    header = (
+        bytes([tag_type])
+        + len(body).to_bytes(3, "big")
+        + (timestamp & 0xFFFFFF).to_bytes(3, "big")
+        + bytes([timestamp >> 24 & 0xFF])
+        + b"\0\0\0"
+    )
+    return header + body + (11 + len(body)).to_bytes(4, "big")
+
+
+def make_flv(frames: int = 100, gop: int = 25, interval: int = 40, start: int = 0):
+    '''
+    生成 H.264 + AAC 的 FLV 数据，每 gop 帧一个关键帧
+    返回 (数据, [(关键帧时间戳, 在数据中的位置)])
+    '''
+    data = bytearray(b"FLV\x01\x05\x00\x00\x00\x09\x00\x00\x00\x00")
+    data += flv_tag(18, 0, b"\x02\x00\x0aonMetaData\x08" + bytes(20))
+    data += flv_tag(9, 0, b"\x17\x00" + b"SPS/PPS")
+    data += flv_tag(8, 0, b"\xaf\x00" + b"ASC")
+    keyframes = []
+    for i in range(frames):
+        timestamp = start + i * interval
+        keyframe = i % gop == 0
+        if keyframe:
+            keyframes.append((timestamp, len(data)))
+        frame_type = b"\x17\x01" if keyframe else b"\x27\x01"
+        data += flv_tag(9, timestamp, frame_type + bytes(200 + i % 7))
+        data += flv_tag(8, timestamp, b"\xaf\x01" + bytes(50))
+    return bytes(data), keyframes
+
+
+class DanmuServer:
+    '''
+    弹幕服务器的替身，在独立线程的事件循环中运行
+    收到 loginreq 时回复 loginres，记录客户端发送的所有消息
+    '''
+
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.server: asyncio.AbstractServer = None
+        self.port: int = None
+        # (连接序号, 消息字典)
+        self.received = []
+        self.connections = []
+        self.accepted = 0
+        # 回复 loginres 时使用的 userid，为空时原样返回客户端的 uid
+        self.login_userid: str = None
+        # 这些 uid 登录时以 close 帧提示 uid 已被占用
+        self.conflict_uids = set()
+        # 半开的连接序号：不再处理收到的数据，也不回复 pong
+        self.frozen = set()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/"
+
+    def start(self) -> "DanmuServer":
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result(5)
+        return self
+
+    async def _start(self) -> None:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def stop(self) -> None:
+        async def _stop():
+            for writer in list(self.connections):
+                writer.close()
+            self.server.close()
+
+        asyncio.run_coroutine_threadsafe(_stop(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(5)
+
+    def types(self, connection: int = None) -> list:
+        '''收到的消息类型，connection 为空时包含所有连接'''
+        return [
+            message.get("type")
+            for index, message in list(self.received)
+            if connection is None or index == connection
+        ]
+
+    def push(self, message: dict) -> None:
+        '''向所有连接发送一条消息'''
+        frame = stt.encode_frame(stt.dumps(message), stt.SERVER_MSG_TYPE)
+        self.loop.call_soon_threadsafe(self._broadcast, frame)
+
+    def drop(self) -> None:
+        '''断开所有连接，不发送 close 帧'''
+        def _drop():
+            for writer in list(self.connections):
+                writer.transport.abort()
+
+        self.loop.call_soon_threadsafe(_drop)
+
+    def freeze(self) -> None:
+        '''模拟半开的连接：现有连接不断开，但之后收到的数据都不处理'''
+        self.frozen.update(range(self.accepted))
+
+    def _broadcast(self, frame: bytes) -> None:
+        for writer in self.connections:
+            writer.write(self._ws_frame(frame))
+
+    @staticmethod
+    def _ws_frame(payload: bytes, opcode: int = 0x2) -> bytes:
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        return header + payload
+
+    async def _handle(self, reader, writer) -> None:
+        index = self.accepted
+        self.accepted += 1
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            headers = {}
+            for line in request.decode("latin-1").split("\r\n")[1:]:
+                name, sep, value = line.partition(":")
+                if sep:
+                    headers[name.strip().lower()] = value.strip()
+            accept = base64.b64encode(
+                hashlib.sha1((headers["sec-websocket-key"] + WS_GUID).encode()).digest()
+            ).decode()
+            writer.write(
+                (
+                    "HTTP/1.1 101 Switching Protocols\r\n"
+                    "Upgrade: websocket\r\n"
+                    "Connection: Upgrade\r\n"
+                    f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+                ).encode()
+            )
+            self.connections.append(writer)
+            decoder = stt.FrameDecoder()
+            while True:
+                head = await reader.readexactly(2)
+                opcode = head[0] & 0x0F
+                length = head[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack("!H", await reader.readexactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack("!Q", await reader.readexactly(8))[0]
+                mask = await reader.readexactly(4) if head[1] & 0x80 else b"\0\0\0\0"
+                data = await reader.readexactly(length)
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+                if index in self.frozen:
+                    continue
+                if opcode == 0x9:
+                    writer.write(self._ws_frame(payload, 0xA))
+                    continue
+                if opcode == 0x8:
+                    writer.write(self._ws_frame(payload[:2], 0x8))
+                    break
+                # websocket-client 默认以文本帧发送
+                if opcode not in (0x1, 0x2):
+                    continue
+                for content in decoder.feed(payload):
+                    message = stt.loads(bytes(content))
+                    self.received.append((index, message))
+                    if message.get("type") == "loginreq":
+                        uid = message.get("uid")
+                        if uid in self.conflict_uids:
+                            reason = struct.pack("!H", 1000) + f"found {uid}".encode()
+                            writer.write(self._ws_frame(reason, 0x8))
+                            return
+                        reply = {
+                            "type": "loginres",
+                            "userid": self.login_userid or message.get("uid"),
+                        }
+                        writer.write(
+                            self._ws_frame(
+                                stt.encode_frame(stt.dumps(reply), stt.SERVER_MSG_TYPE)
+                            )
+                        )
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if writer in self.connections:
+                self.connections.remove(writer)
+            writer.close()
+
+
+class ConnectProxy:
+    '''只支持 CONNECT 的 HTTP 代理，记录隧道的目标地址'''
+
+    def __init__(self) -> None:
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        self.targets = []
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def start(self) -> "ConnectProxy":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.sock.close()
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._tunnel, args=(client,), daemon=True).start()
+
+    def _tunnel(self, client: socket.socket) -> None:
+        request = b""
+        while not request.endswith(b"\r\n\r\n"):
+            chunk = client.recv(1)
+            if not chunk:
+                client.close()
+                return
+            request += chunk
+        target = request.split(b" ")[1].decode()
+        self.targets.append(target)
+        host, port = target.rsplit(":", 1)
+        upstream = socket.create_connection((host, int(port)))
+        client.sendall(b"HTTP/1.1 200 Connection established\r\n\r\n")
+
+        def pipe(source, destination):
+            try:
+                while True:
+                    data = source.recv(65536)
+                    if not data:
+                        break
+                    destination.sendall(data)
+            except OSError:
+                pass
+            finally:
+                for s in (source, destination):
+                    try:
+                        s.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+        threading.Thread(target=pipe, args=(upstream, client), daemon=True).start()
+        pipe(client, upstream)
+
+
+class HttpFiles:
+    '''
+    提供固定内容的本地 HTTP 服务
+    files 为路径 -> 内容，内容也可以是返回可迭代字节块的函数，用于流式响应；
+    failures 为路径 -> 剩余失败次数，失败时返回 403，不会被连接池的重试掩盖
+    '''
+
+    def __init__(self) -> None:
+        self.files = {}
+        self.failures = {}
+        self.requests = []
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                path = self.path.split("?")[0]
+                server.requests.append(path)
+                if server.failures.get(path, 0) > 0:
+                    server.failures[path] -= 1
+                    self._reply(403, b"error")
+                    return
+                content = server.files.get(path)
+                if content is None:
+                    self._reply(404, b"not found")
+                elif callable(content):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "video/x-flv")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    try:
+                        for chunk in content():
+                            self.wfile.write(chunk)
+                            self.wfile.flush()
+                    except OSError:
+                        pass
+                    self.close_connection = True
+                else:
+                    self._reply(200, content)
+
+            def _reply(self, status: int, body: bytes) -> None:
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.port}{path}"
+
+    def start(self) -> "HttpFiles":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def http_files():
+    server = HttpFiles().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def danmu_server():
+    server = DanmuServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def connect_proxy():
+    proxy = ConnectProxy().start()
+    yield proxy
+    proxy.stop()
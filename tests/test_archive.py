@@ -0,0 +1,124 @@
+import datetime
+import os
+
+import pytest
+
+from douyu_api.archive import (
+    BLOCK_HEADER,
+    INDEX_SUFFIX,
+    ArchiveReader,
+    BarrageArchive,
+    archive_path,
+    read_archive,
+    scan_blocks,
+)
+from douyu_api.model import TZ_UTC_8, Barrage, BarrageGap
+
+# 2024-01-01 23:00:00 北京时间
+BASE_MS = int(datetime.datetime(2024, 1, 1, 23, tzinfo=TZ_UTC_8).timestamp() * 1000)
+
+
+def barrage(i: int, content: str = None) -> Barrage:
+    return Barrage(
+        room_id="9999",
+        user_id=str(1000 + i),
+        nick_name=f"用户{i}",
+        level=str(i % 60),
+        content=content if content is not None else f"弹幕 {i}",
+        cst=BASE_MS + i * 1000,
+    )
+
+
+def fields(item: Barrage) -> tuple:
+    return (item.user_id, item.nick_name, item.level, item.content, item.cst)
+
+
+def open_archive(root, **kwargs) -> BarrageArchive:
+    kwargs.setdefault("compression", "zlib")
+    return BarrageArchive(root=str(root), flush_interval=60, **kwargs)
+
+
+def test_round_trip_with_json_records_and_long_fields(tmp_path):
+    items = [barrage(i) for i in range(50)]
+    # 超过 65535 字节的字段
+    items.append(barrage(50, content="长" * 40000))
+    items.append(BarrageGap(room_id="9999", start=BASE_MS + 60000, end=BASE_MS + 61000))
+    with open_archive(tmp_path, block_size=2048) as archive:
+        archive.put_many(items)
+        archive.flush()
+        assert archive.errors == 0
+    path = archive_path(str(tmp_path), "9999", "20240101")
+    with ArchiveReader(path) as reader:
+        assert len(reader) > 1
+        records = list(reader)
+    assert [fields(item) for item in records[:-1]] == [fields(item) for item in items[:-1]]
+    assert records[-1]["start"] == BASE_MS + 60000
+
+
+def test_torn_tail_is_truncated_and_writing_resumes(tmp_path):
+    path = archive_path(str(tmp_path), "9999", "20240101")
+    with open_archive(tmp_path) as archive:
+        archive.put_many([barrage(i) for i in range(10)])
+        archive.flush()
+        complete = os.path.getsize(path)
+        archive.put_many([barrage(i) for i in range(10, 20)])
+    # 模拟写入第二个块时进程被杀：块只写了一半，索引项也只写了一部分
+    with open(path, "r+b") as fp:
+        fp.truncate(complete + BLOCK_HEADER.size + 5)
+    with open(path + INDEX_SUFFIX, "r+b") as fp:
+        fp.truncate(os.path.getsize(path + INDEX_SUFFIX) - 3)
+
+    # 读取时忽略不完整的部分
+    with ArchiveReader(path) as reader:
+        assert [item.cst for item in reader] == [BASE_MS + i * 1000 for i in range(10)]
+
+    with open_archive(tmp_path) as archive:
+        archive.put_many([barrage(i) for i in range(20, 30)])
+    entries, size = scan_blocks(path)
+    assert size == os.path.getsize(path) and len(entries) == 2
+    assert entries[1][2] == complete
+    with ArchiveReader(path) as reader:
+        expected = [str(1000 + i) for i in list(range(10)) + list(range(20, 30))]
+        assert [item.user_id for item in reader] == expected
+
+
+@pytest.mark.parametrize("start, end", [(0, 100), (10, 20), (35, 36), (99, 200), (-5, 3)])
+def test_range_reads_match_filter(tmp_path, start, end):
+    items = [barrage(i) for i in range(100)]
+    with open_archive(tmp_path, block_size=512) as archive:
+        archive.put_many(items)
+    path = archive_path(str(tmp_path), "9999", "20240101")
+    with ArchiveReader(path) as reader:
+        start_ms, end_ms = BASE_MS + start * 1000, BASE_MS + end * 1000
+        # 只解压与时间范围有交集的块
+        assert len(reader.blocks(start_ms, end_ms)) < len(reader) or (start, end) == (0, 100)
+        result = [item.cst for item in reader.read(start_ms, end_ms)]
+    expected = [item.cst for item in items if start_ms <= item.cst < end_ms]
+    assert result == expected
+
+
+def test_read_archive_across_days(tmp_path):
+    # 23:00 开始每分钟一条，跨过北京时间零点
+    items = [barrage(i) for i in range(0, 7200, 60)]
+    with open_archive(tmp_path) as archive:
+        archive.put_many(items)
+    days = sorted(os.listdir(tmp_path / "9999"))
+    assert days == ["20240101.dyb", "20240101.dyb.idx", "20240102.dyb", "20240102.dyb.idx"]
+    start, end = BASE_MS + 1800 * 1000, BASE_MS + 5400 * 1000
+    result = [item.cst for item in read_archive(str(tmp_path), "9999", start, end)]
+    assert result == [item.cst for item in items if start <= item.cst < end]
+
+
+def test_unencodable_record_does_not_lose_batch(tmp_path):
+    bad = barrage(5)
+    bad.cst = "not a timestamp"
+    items = [barrage(i) for i in range(5)] + [bad] + [barrage(i) for i in range(6, 10)]
+    with open_archive(tmp_path) as archive:
+        archive.put_many(items)
+        archive.flush()
+        assert archive.errors == 0
+    path = archive_path(str(tmp_path), "9999", "20240101")
+    with ArchiveReader(path) as reader:
+        assert [item.user_id for item in reader] == [
+            str(1000 + i) for i in range(10) if i != 5
+        ]
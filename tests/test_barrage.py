@@ -0,0 +1,192 @@
+from queue import Queue
+
+from conftest import wait_for
+from douyu_api import stt
+from douyu_api.barrage import BarrageClient
+from douyu_api.model import Barrage, BarrageGap, Gift, GiftBroadcast, UserEnter
+from douyu_api.replay import ReplayClient
+
+CHATMSG = {
+    "type": "chatmsg", "rid": "9999", "uid": "1001", "nn": "观众/@A", "level": "12",
+    "txt": "666/", "cst": "1634567890123", "bnn": "粉丝牌", "el": [{"eid": "1"}],
+}
+DGB = {
+    "type": "dgb", "rid": "9999", "uid": "1002", "nn": "送礼", "level": "20", "gfid": "824",
+    "gfcnt": "5", "hits": "3", "bnn": "粉丝牌", "bl": "8",
+}
+UENTER = {"type": "uenter", "rid": "9999", "uid": "1003", "nn": "进入", "level": "15", "nl": "2"}
+SPBC = {
+    "type": "spbc", "rid": "9999", "drid": "8888", "sn": "土豪", "dn": "主播", "gn": "火箭",
+    "gc": "2", "gfid": "59",
+}
+
+
+def message(*items: dict) -> bytes:
+    return b"".join(stt.encode_frame(stt.dumps(item), stt.SERVER_MSG_TYPE) for item in items)
+
+
+def test_messages_become_typed_objects():
+    client = ReplayClient("9999")
+    infos = client.msg_to_obj(
+        message(CHATMSG, {"type": "mrkl"}, DGB, UENTER, {"type": "unknown_type"}, SPBC)
+    )
+    assert [type(info) for info in infos] == [Barrage, Gift, UserEnter, GiftBroadcast]
+    barrage, gift, user_enter, broadcast = infos
+    assert (barrage.user_id, barrage.nick_name, barrage.level, barrage.content) == (
+        "1001", "观众/@A", "12", "666/"
+    )
+    assert barrage.cst == 1634567890123 and barrage.send_time is not None
+    assert gift.to_dict() == {
+        "room_id": "9999", "user_id": "1002", "nick_name": "送礼", "level": "20",
+        "gift_id": "824", "gift_count": 5, "hits": 3, "badge_name": "粉丝牌",
+        "badge_level": "8",
+    }
+    assert user_enter.to_dict() == {
+        "room_id": "9999", "user_id": "1003", "nick_name": "进入", "level": "15",
+        "noble_level": "2",
+    }
+    assert broadcast.to_dict() == {
+        "room_id": "9999", "target_room_id": "8888", "sender_name": "土豪",
+        "receiver_name": "主播", "gift_name": "火箭", "gift_count": 2, "gift_id": "59",
+    }
+
+
+def test_unsubscribed_types_are_skipped_before_parsing(monkeypatch):
+    client = ReplayClient("9999", message_types={"dgb"})
+    parsed = []
+    original = client.field_selectors["dgb"]
+    client.field_selectors["dgb"] = lambda content: parsed.append("dgb") or original(content)
+
+    def fail(*args):
+        raise AssertionError("未订阅的消息不应被解析")
+
+    for data_type in ("chatmsg", "uenter", "spbc"):
+        client.handlers[data_type] = fail
+        client.field_selectors[data_type] = fail
+    monkeypatch.setattr(stt, "loads", fail)
+
+    infos = client.msg_to_obj(message(CHATMSG, DGB, UENTER, SPBC, {"type": "unknown_type"}))
+    assert [type(info) for info in infos] == [Gift]
+    assert parsed == ["dgb"]
+
+
+def test_control_messages_ignore_subscription():
+    client = ReplayClient("9999", uid="1", message_types={"chatmsg"})
+    # 模拟断开后重新登录
+    client.running = True
+    client._on_disconnected()
+    infos = client.msg_to_obj(message({"type": "loginres", "userid": "1"}, CHATMSG))
+    assert client.connected
+    assert [type(info) for info in infos] == [BarrageGap, Barrage]
+
+    client.subscribe(None)
+    assert client.message_types is None
+    assert [type(info) for info in client.msg_to_obj(message(UENTER))] == [UserEnter]
+
+
+def test_registered_handler_with_and_without_fields():
+    client = ReplayClient("9999")
+    client.register_handler("custom", lambda data: dict(data), fields=("type", "a"))
+    client.register_handler("nested", lambda data: data["list"])
+    infos = client.msg_to_obj(
+        message(
+            {"type": "custom", "a": "1/2", "b": "ignored"},
+            {"type": "nested", "list": [{"x": "1"}, {"x": "2"}]},
+        )
+    )
+    assert infos == [{"type": "custom", "a": "1/2"}, [{"x": "1"}, {"x": "2"}]]
+
+
+def test_sync_client_changes_uid_on_conflict(danmu_server):
+    danmu_server.conflict_uids.add("123")
+    client = BarrageClient("9999", uid="123", url=danmu_server.url, base_backoff=0.01)
+    client.start()
+    try:
+        assert wait_for(lambda: client.connected)
+    finally:
+        client.stop()
+    assert client.uid != "123"
+    logins = [message for _, message in danmu_server.received if message["type"] == "loginreq"]
+    assert [login["uid"] for login in logins] == ["123", client.uid]
+
+
+def sync_client(danmu_server, storage: Queue) -> "tuple[BarrageClient, list]":
+    '''返回客户端和 keep_alive 被调用的记录，用于检查心跳线程只有一个'''
+    client = BarrageClient(
+        "9999", url=danmu_server.url, storage=storage, base_backoff=0.01,
+        heartbeat_interval=0.05, ping_interval=0.3, ping_timeout=0.2,
+    )
+    heartbeats = []
+    keep_alive = client.keep_alive
+
+    def counted_keep_alive():
+        heartbeats.append(None)
+        keep_alive()
+
+    client.keep_alive = counted_keep_alive
+    return client, heartbeats
+
+
+def assert_reconnected_once(danmu_server, client, storage, heartbeats):
+    assert wait_for(lambda: danmu_server.types().count("loginreq") == 2)
+    assert wait_for(lambda: client.connected)
+    gap = storage.get(timeout=5)
+    assert isinstance(gap, BarrageGap)
+    assert gap.room_id == "9999" and gap.end >= gap.start
+    assert danmu_server.accepted == 2
+    assert len(client.reconnect_latencies) == 1
+    assert client.reconnect_stats()["reconnects"] == 1
+    # 重连后仍由同一个心跳线程在新连接上发送心跳
+    assert wait_for(lambda: danmu_server.types(1).count("mrkl") >= 3)
+    assert len(heartbeats) == 1 and client.heartbeat_server.is_alive()
+
+
+def test_sync_client_reconnects_after_drop(danmu_server):
+    storage = Queue()
+    client, heartbeats = sync_client(danmu_server, storage)
+    client.start()
+    try:
+        assert wait_for(lambda: client.connected)
+        danmu_server.drop()
+        assert_reconnected_once(danmu_server, client, storage, heartbeats)
+    finally:
+        client.stop()
+        client.join(5)
+    assert not client.barrage_server.is_alive()
+
+
+def test_sync_client_reconnects_when_heartbeat_fails(danmu_server):
+    storage = Queue()
+    client, heartbeats = sync_client(danmu_server, storage)
+    client.start()
+    try:
+        assert wait_for(lambda: client.connected)
+        heartbeat = client._heartbeat
+        failures = []
+
+        def broken_heartbeat():
+            # 模拟半开的连接：第一次发送心跳失败
+            if not failures:
+                failures.append(None)
+                raise ConnectionResetError("连接被重置")
+            heartbeat()
+
+        client._heartbeat = broken_heartbeat
+        assert_reconnected_once(danmu_server, client, storage, heartbeats)
+    finally:
+        client.stop()
+        client.join(5)
+
+
+def test_sync_client_reconnects_half_open_connection(danmu_server):
+    storage = Queue()
+    client, heartbeats = sync_client(danmu_server, storage)
+    client.start()
+    try:
+        assert wait_for(lambda: client.connected)
+        # 连接没有断开，但服务端不再回复 pong
+        danmu_server.freeze()
+        assert_reconnected_once(danmu_server, client, storage, heartbeats)
+    finally:
+        client.stop()
+        client.join(5)
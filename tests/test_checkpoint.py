@@ -0,0 +1,160 @@
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import textwrap
+
+from conftest import wait_for
+from douyu_api.checkpoint import CrawlCheckpoint, IntervalSet
+from douyu_api.exceptions import RoomNotFindError
+from douyu_api.model import Room, RoomResult
+from douyu_api.sink import CallableSink
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 模拟采集进程：每个ID写入 DatabaseSink，提交后才记录到断点
+# 数据库写出故意放慢，采集远快于数据库提交
+CRAWLER = textwrap.dedent(
+    '''
+    import sys, time
+    from douyu_api.checkpoint import CrawlCheckpoint
+    from douyu_api.db import DatabaseSink
+    from douyu_api.model import Room, RoomResult
+    import sqlite3
+
+    db_path, checkpoint_path, stop = sys.argv[1], sys.argv[2], int(sys.argv[3])
+
+    class SlowSink(DatabaseSink):
+        def write_batch(self, batch):
+            time.sleep(0.05)
+            super().write_batch(batch)
+
+    checkpoint = CrawlCheckpoint(checkpoint_path, save_interval=0.02)
+    sink = SlowSink(
+        lambda: sqlite3.connect(db_path), dialect="sqlite", create_tables=True,
+        batch_size=50, flush_interval=1,
+        on_written=checkpoint.committed, on_failed=checkpoint.commit_failed,
+    )
+    for room_id in checkpoint.pending(1, stop):
+        sink.put(RoomResult(room_id, room=Room(room_id=room_id)))
+        time.sleep(0.0005)
+    sink.close()
+    checkpoint.close()
+    '''
+)
+
+
+def run_crawler(db_path, checkpoint_path, stop) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    return subprocess.Popen(
+        [sys.executable, "-c", CRAWLER, str(db_path), str(checkpoint_path), str(stop)],
+        env=env,
+    )
+
+
+def saved_done(checkpoint_path) -> IntervalSet:
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            return IntervalSet(json.load(f)["done"])
+    except (OSError, ValueError):
+        return IntervalSet()
+
+
+def stored_ids(db_path) -> set:
+    db = sqlite3.connect(db_path)
+    try:
+        return {row[0] for row in db.execute("select room_id from douyu_room")}
+    finally:
+        db.close()
+
+
+def test_interval_set_merges_and_splits():
+    ids = IntervalSet()
+    for value in (1, 2, 3, 7, 5, 6, 4):
+        ids.add(value)
+    assert ids.intervals() == [[1, 8]]
+    ids.discard(4)
+    assert ids.intervals() == [[1, 4], [5, 8]]
+    assert ids.next_missing(1) == 4 and ids.next_missing(4) == 4
+    assert len(ids) == 6 and 5 in ids and 4 not in ids
+
+
+def test_pending_skips_done_failed_and_retry(tmp_path):
+    checkpoint = CrawlCheckpoint(str(tmp_path / "checkpoint.json"))
+    for room_id in (2, 3):
+        checkpoint.mark_done(room_id)
+    checkpoint.mark_failed(5)
+    checkpoint.mark_failed(6, transient=True)
+    assert list(checkpoint.pending(1, 8)) == [1, 4, 7]
+    assert list(checkpoint.pending(1, 8, include_retry=True)) == [1, 4, 6, 7]
+    assert checkpoint.retry_ids() == [6]
+
+
+def test_killed_crawl_never_skips_ids(tmp_path):
+    db_path = tmp_path / "rooms.db"
+    checkpoint_path = tmp_path / "checkpoint.json"
+    stop = 3001
+
+    process = run_crawler(db_path, checkpoint_path, stop)
+    try:
+        assert wait_for(lambda: len(saved_done(checkpoint_path)) >= 500, timeout=30)
+    finally:
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+
+    # 断点中记为完成的ID都已经提交到数据库
+    done = saved_done(checkpoint_path)
+    assert 0 < len(done) < stop - 1
+    assert set(done) <= stored_ids(db_path)
+
+    # 从断点恢复后所有ID都被采集
+    process = run_crawler(db_path, checkpoint_path, stop)
+    assert process.wait(60) == 0
+    assert stored_ids(db_path) == set(range(1, stop))
+    assert list(CrawlCheckpoint(str(checkpoint_path)).pending(1, stop)) == []
+
+
+def test_failed_batch_is_retried_without_stopping_the_crawl(tmp_path):
+    checkpoint_path = tmp_path / "checkpoint.json"
+    checkpoint = CrawlCheckpoint(str(checkpoint_path), save_interval=0)
+    batches = []
+
+    def write(batch):
+        batches.append(batch)
+        # 第二批写入失败
+        if len(batches) == 2:
+            raise ConnectionError("数据库连接断开")
+
+    sink = CallableSink(
+        write,
+        batch_size=10,
+        flush_interval=60,
+        on_written=checkpoint.committed,
+        on_failed=checkpoint.commit_failed,
+    )
+    for room_id in range(1, 31):
+        if room_id % 10 == 5:
+            # 房间不存在，没有需要写入的数据，直接记录
+            checkpoint.mark(RoomResult(room_id, error=RoomNotFindError()))
+            continue
+        sink.put(RoomResult(room_id, room=Room(room_id=room_id)))
+        if room_id % 10 == 0:
+            sink.flush()
+    # 部分房间信息写入失败时照样记录待重试
+    sink.put(Room(room_id=99))
+    sink.close()
+    checkpoint.close()
+
+    failed_ids = {item.room_id for item in batches[1]}
+    written_ids = {item.room_id for batch in (batches[0], batches[2]) for item in batch}
+    assert set(checkpoint.done) == written_ids
+    assert set(checkpoint.retry) == failed_ids
+    assert set(checkpoint.failed) == {5, 15, 25}
+    assert 99 not in checkpoint.done and 99 not in checkpoint.retry
+
+    saved = CrawlCheckpoint(str(checkpoint_path))
+    assert saved.retry_ids() == sorted(failed_ids)
+    assert list(saved.pending(1, 31)) == []
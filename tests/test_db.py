@@ -0,0 +1,99 @@
+import itertools
+import sqlite3
+
+import pytest
+
+from douyu_api.db import ROOM_TABLE, USER_TABLE, DatabaseSink
+from douyu_api.exceptions import RoomNotFindError
+from douyu_api.model import Room, RoomResult, User
+from douyu_api.room import RoomClient
+
+_names = itertools.count()
+
+
+@pytest.fixture
+def memory_db():
+    '''
+    共享缓存的内存数据库，写入线程和测试各用一个连接
+    测试持有的连接保证数据库在写入线程关闭连接后依然存在
+    '''
+    uri = f"file:douyu_{next(_names)}?mode=memory&cache=shared"
+    keeper = sqlite3.connect(uri, uri=True)
+    yield lambda: sqlite3.connect(uri, uri=True)
+    keeper.close()
+
+
+def make_sink(connect, **kwargs) -> DatabaseSink:
+    kwargs.setdefault("flush_interval", 0.05)
+    return DatabaseSink(connect, dialect="sqlite", create_tables=True, **kwargs)
+
+
+def rows(connect, table: str) -> list:
+    db = connect()
+    try:
+        key = "room_id" if table == ROOM_TABLE else "user_id"
+        return db.execute(f"select * from {table} order by {key}").fetchall()
+    finally:
+        db.close()
+
+
+def test_upsert_overwrites_existing_rows(memory_db):
+    with make_sink(memory_db) as sink:
+        sink.put(Room(room_id=1, room_name="旧名字", safe_uid="a"))
+        sink.put(User(user_id=10, nick_name="主播", fans_num=1))
+        sink.flush()
+        sink.put(Room(room_id=1, room_name="新名字", safe_uid="a"))
+        sink.put(User(user_id=10, nick_name="主播", fans_num=2))
+        sink.flush()
+    room_rows = rows(memory_db, ROOM_TABLE)
+    assert [(row[0], row[1]) for row in room_rows] == [(1, "新名字")]
+    user_rows = rows(memory_db, USER_TABLE)
+    assert [(row[0], row[8]) for row in user_rows] == [(10, "2")]
+
+
+def test_batch_keeps_last_duplicate_and_commits_once(memory_db):
+    with make_sink(memory_db, batch_size=100, flush_interval=60) as sink:
+        for i in range(50):
+            sink.put(Room(room_id=i % 10, room_name=f"房间{i}"))
+        sink.flush()
+        assert sink.batches == 1
+    room_rows = rows(memory_db, ROOM_TABLE)
+    assert [row[1] for row in room_rows] == [f"房间{40 + i}" for i in range(10)]
+
+
+def test_room_row_kept_when_user_fetch_failed(memory_db):
+    partial = RoomResult(
+        2, room=Room(room_id=2, safe_uid="b"), error=ConnectionError("超时")
+    )
+    with make_sink(memory_db) as sink:
+        sink.put(partial)
+        sink.put(RoomResult(3, error=RoomNotFindError()))
+        sink.flush()
+        assert sink.errors == 0
+    assert [row[0] for row in rows(memory_db, ROOM_TABLE)] == [2]
+    assert rows(memory_db, USER_TABLE) == []
+
+
+def test_retry_user_infos_only_fetches_users(monkeypatch):
+    client = RoomClient()
+    calls = []
+
+    def get_user_info(safe_uid=None, **kwargs):
+        calls.append(safe_uid)
+        if safe_uid == "bad":
+            raise ConnectionError("超时")
+        return User(user_id=1, safe_uid=safe_uid)
+
+    def get_room_info(*args, **kwargs):
+        raise AssertionError("不应重新获取房间信息")
+
+    monkeypatch.setattr(client, "get_user_info", get_user_info)
+    monkeypatch.setattr(client, "get_room_info", get_room_info)
+    results = [
+        RoomResult(1, room=Room(room_id=1, safe_uid="good"), error=ConnectionError()),
+        RoomResult(2, room=Room(room_id=2, safe_uid="bad"), error=ConnectionError()),
+    ]
+    retried = {result.room_id: result for result in client.retry_user_infos(results)}
+    assert sorted(calls) == ["bad", "good"]
+    assert retried[1].ok and retried[1].user.safe_uid == "good"
+    assert not retried[2].ok and retried[2].user is None
@@ -0,0 +1,151 @@
+import os
+import random
+
+import pytest
+
+from conftest import make_flv
+from douyu_api.flv import (
+    FLV_HEADER,
+    FLV_SIGNATURE,
+    FlvParser,
+    FlvSegmentWriter,
+    KeyframeIndex,
+    build_keyframe_index,
+    index_path,
+)
+from douyu_api.stream import StreamClient
+
+
+def random_chunks(data: bytes, seed: int, max_size: int = 4096):
+    '''把数据切成随机长度的片段，包括只有 1 个字节的片段'''
+    rng = random.Random(seed)
+    pos = 0
+    while pos < len(data):
+        size = rng.choice((1, 2, 11, 15, rng.randint(1, max_size)))
+        yield data[pos : pos + size]
+        pos += size
+
+
+def write_file(tmp_path, data: bytes) -> str:
+    path = str(tmp_path / "video.flv")
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_parser_returns_same_tags_for_any_split(seed):
+    data, keyframes = make_flv(frames=60, gop=12)
+    parser = FlvParser()
+    tags = []
+    position = 0
+    for chunk in random_chunks(data, seed):
+        for tag in parser.feed(chunk):
+            # 返回的 memoryview 只在下一次 feed 之前有效
+            keyframe = tag.keyframe and not tag.sequence_header
+            tags.append((tag.tag_type, tag.timestamp, keyframe, position, bytes(tag.data)))
+            position += len(tag.data)
+    assert b"".join(tag[-1] for tag in tags) == data
+    assert tags[0][0] == FLV_HEADER
+    assert [(t, p) for _, t, keyframe, p, _ in tags if keyframe] == keyframes
+
+
+@pytest.mark.parametrize("chunk_size", (1, 7, 100, 4096, 1 << 20))
+def test_build_keyframe_index_offsets(tmp_path, chunk_size):
+    data, keyframes = make_flv(frames=120, gop=25, start=0xFFFFFF - 2000)
+    index = build_keyframe_index(write_file(tmp_path, data), chunk_size=chunk_size)
+    assert list(zip(index.times, index.positions)) == keyframes
+    # 时间戳超过 24 位时使用扩展字节
+    assert index.times[-1] > 0xFFFFFF
+    assert index.first_timestamp == 0xFFFFFF - 2000
+    assert index.duration == pytest.approx(119 * 0.04)
+
+
+def test_writer_index_matches_scan_after_many_writes(tmp_path):
+    data, keyframes = make_flv(frames=150, gop=30)
+    path = str(tmp_path / "segment.flv")
+    segments = []
+    writer = FlvSegmentWriter(lambda: path, on_close=segments.append)
+    # 同一个分段中多次追加写入，位置从分段开头累计
+    for chunk in random_chunks(data, seed=3, max_size=997):
+        writer.write(chunk)
+    writer.close()
+    index = segments[0].keyframes
+    assert list(zip(index.times, index.positions)) == keyframes
+    assert KeyframeIndex.load(path).positions == index.positions
+    assert build_keyframe_index(path).times == index.times
+
+
+def test_rotated_segment_offsets_start_after_preamble(tmp_path):
+    data, keyframes = make_flv(frames=90, gop=30)
+    paths = iter(str(tmp_path / f"{i}.flv") for i in range(10))
+    segments = []
+    writer = FlvSegmentWriter(lambda: next(paths), size=1, on_close=segments.append)
+    writer.write(data[: keyframes[1][1]])
+    writer.write(data[keyframes[1][1] :])
+    writer.close()
+    preamble = writer.parser.preamble()
+    for segment in segments:
+        if not segment.keyframes:
+            continue
+        # 分段开头重新写入的文件头和 sequence header 之后就是关键帧
+        assert segment.keyframes.positions == [len(preamble)]
+        assert build_keyframe_index(segment.file_path).positions == [len(preamble)]
+    times = [t for segment in segments for t in segment.keyframes.times]
+    assert times == [t for t, _ in keyframes]
+
+
+def test_keyframe_index_round_trip_and_seek():
+    data, keyframes = make_flv(frames=100, gop=25, start=5000)
+    index = KeyframeIndex()
+    parser = FlvParser()
+    position = 0
+    for tag in parser.feed(data):
+        if tag.tag_type != FLV_HEADER:
+            index.add_tag(tag, position)
+        position += len(tag.data)
+    loaded = KeyframeIndex.from_dict(index.to_dict())
+    assert loaded.times == index.times and loaded.positions == index.positions
+    assert loaded.duration == index.duration
+    assert index.seek(0) == keyframes[0][1]
+    assert index.seek(6.5) == keyframes[1][1]
+    assert index.seek(100) == keyframes[-1][1]
+
+
+def test_rotation_within_one_second_creates_separate_files(tmp_path):
+    data, keyframes = make_flv(frames=100, gop=10)
+    segments = []
+    writer = FlvSegmentWriter(
+        lambda: StreamClient.get_save_file_path(None, str(tmp_path), 9999),
+        size=1000,
+        on_close=segments.append,
+    )
+    writer.write(data)
+    writer.close()
+
+    # 每个关键帧都分段，远快于文件名的秒级精度
+    paths = [segment.file_path for segment in segments]
+    assert len(paths) == len(keyframes)
+    assert len(set(paths)) == len(paths)
+    for path in paths:
+        with open(path, "rb") as f:
+            content = f.read()
+        assert content.startswith(FLV_SIGNATURE)
+        assert content.count(FLV_SIGNATURE) == 1
+        # 每个分段都有自己的索引，且与重新扫描文件的结果一致
+        index = KeyframeIndex.load(path)
+        assert len(index) == 1
+        assert index.positions == build_keyframe_index(path).positions
+
+
+def test_existing_file_is_never_appended(tmp_path):
+    path = str(tmp_path / "same.flv")
+    with open(path, "wb") as f:
+        f.write(b"old")
+    paths = iter([path, str(tmp_path / "new.flv")])
+    writer = FlvSegmentWriter(lambda: next(paths))
+    writer.write(make_flv(frames=10)[0])
+    writer.close()
+    with open(path, "rb") as f:
+        assert f.read() == b"old"
+    assert os.path.exists(index_path(str(tmp_path / "new.flv")))
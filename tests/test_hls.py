@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import threading
+
+import pytest
+
+from douyu_api import hls
+from douyu_api.hls import HlsDownloader, HlsJob, HlsManifest
+from douyu_api.video import TASK_DONE, TASK_FAILED, VideoClient, VideoDownloadManager
+
+URLS = [f"http://127.0.0.1/{i}.ts" for i in range(4)]
+
+
+def resumed_job(tmp_path, parts: dict) -> HlsJob:
+    '''parts: 序号 -> (记录的内容, 临时文件中的实际内容)'''
+    file_path = str(tmp_path / "video.ts")
+    manifest = HlsManifest.open(f"{file_path}.manifest.json", URLS)
+    os.makedirs(f"{file_path}.parts")
+    for index, (recorded, actual) in parts.items():
+        manifest.mark_done(index, len(recorded), hashlib.md5(recorded).hexdigest())
+        with open(os.path.join(f"{file_path}.parts", f"{index}.ts"), "wb") as f:
+            f.write(actual)
+    manifest.close()
+    job = HlsJob(URLS, file_path)
+    job.open()
+    return job
+
+
+def test_is_done_checks_md5(tmp_path):
+    part_path = str(tmp_path / "0.ts")
+    manifest = HlsManifest(str(tmp_path / "manifest.json"), "hash", 1)
+    manifest.mark_done(0, 4, hashlib.md5(b"good").hexdigest())
+    with open(part_path, "wb") as f:
+        f.write(b"good")
+    assert manifest.is_done(0, part_path)
+    # 大小相同、内容不同
+    with open(part_path, "wb") as f:
+        f.write(b"evil")
+    assert not manifest.is_done(0, part_path)
+
+
+def saved_manifest(file_path: str) -> dict:
+    with open(file_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_manifest_coalesces_saves_and_prunes_assembled(tmp_path):
+    file_path = str(tmp_path / "manifest.json")
+    urls = [f"http://127.0.0.1/{i}.ts" for i in range(10)]
+    manifest = HlsManifest.open(file_path, urls, save_every=4, save_interval=60)
+    manifest.save()
+    for index in range(6):
+        manifest.mark_done(index, 10, "md5")
+    # 第 4 个分片完成时保存，之后的两个还没有写入文件
+    assert sorted(saved_manifest(file_path)["segments"]) == ["0", "1", "2", "3"]
+
+    for index in range(3):
+        manifest.mark_assembled(index)
+    # 已拼接的分片不再记录
+    assert sorted(manifest.segments) == [3, 4, 5]
+    manifest.close()
+    data = saved_manifest(file_path)
+    assert (data["assembled"], data["assembled_size"]) == (3, 30)
+    assert sorted(data["segments"]) == ["3", "4", "5"]
+
+    resumed = HlsManifest.open(file_path, urls)
+    assert resumed.resumed and sorted(resumed.segments) == [3, 4, 5]
+
+
+def test_download_saves_manifest_once_per_assembly(tmp_path, segments, monkeypatch):
+    urls = VideoClient.get_segment_urls(None)
+    saves = []
+    save = HlsManifest.save
+
+    def counted_save(manifest):
+        saves.append(manifest.assembled)
+        save(manifest)
+
+    monkeypatch.setattr(HlsManifest, "save", counted_save)
+    file_path = str(tmp_path / "video.ts")
+    HlsDownloader(workers=4, window=4).download(urls, file_path)
+    with open(file_path, "rb") as f:
+        assert f.read() == b"".join(segments)
+    # 原来每个分片下载和拼接各保存一次
+    assert len(saves) <= len(urls) + 2, saves
+    data = saved_manifest(f"{file_path}.manifest.json")
+    assert data["complete"] and data["segments"] == {}
+
+
+def test_resume_redownloads_corrupted_parts(tmp_path):
+    job = resumed_job(
+        tmp_path,
+        {1: (b"segment-1", b"segment-1"), 2: (b"segment-2", b"segmXnt-2")},
+    )
+    try:
+        taken = [index for index, _, _ in job.take()]
+        # 0 和 3 没有下载过，2 的临时文件损坏，1 可以直接使用
+        assert taken == [0, 2, 3]
+        assert not os.path.exists(os.path.join(job.parts_dir, "2.ts"))
+        assert list(job.ready) == [1]
+    finally:
+        job.close()
+
+
+@pytest.fixture
+def segments(http_files, monkeypatch):
+    '''本地 HTTP 服务上的 12 个分片，VideoClient 直接返回这些地址'''
+    contents = [bytes([i]) * (1000 + i) for i in range(12)]
+    urls = []
+    for i, content in enumerate(contents):
+        http_files.files[f"/seg/{i}.ts"] = content
+        urls.append(http_files.url(f"/seg/{i}.ts"))
+    monkeypatch.setattr(VideoClient, "get_segment_urls", lambda self: urls)
+    return contents
+
+
+def run_manager(tmp_path, **kwargs) -> VideoDownloadManager:
+    manager = VideoDownloadManager(
+        storage=str(tmp_path), workers=4, per_host=4, window=4, segment_retries=0, **kwargs
+    )
+    manager.start()
+    manager.add("v1")
+    assert manager.join(20)
+    manager.stop()
+    return manager
+
+
+def test_manager_requeues_failed_segment(tmp_path, http_files, segments):
+    http_files.failures["/seg/3.ts"] = 2
+    manager = run_manager(tmp_path, segment_requeues=3)
+    task = manager.tasks["v1"]
+    assert task.state == TASK_DONE, task.error
+    assert task.job.progress.retries == 2
+    with open(task.job.file_path, "rb") as f:
+        assert f.read() == b"".join(segments)
+
+
+def test_manager_fails_after_requeue_limit(tmp_path, http_files, segments):
+    http_files.failures["/seg/5.ts"] = 10
+    manager = run_manager(tmp_path, segment_requeues=2)
+    task = manager.tasks["v1"]
+    assert task.state == TASK_FAILED
+    assert http_files.requests.count("/seg/5.ts") == 3
+
+
+def test_assembly_runs_outside_manager_lock(tmp_path, segments, monkeypatch):
+    manager = None
+    lock_free = []
+    append_file = hls.append_file
+
+    def checked_append(output, part_path):
+        # 在另一个线程中尝试获取全局的锁
+        def try_lock():
+            acquired = manager._cond.acquire(timeout=2)
+            if acquired:
+                manager._cond.release()
+            lock_free.append(acquired)
+
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        append_file(output, part_path)
+
+    monkeypatch.setattr(hls, "append_file", checked_append)
+    manager = VideoDownloadManager(storage=str(tmp_path), workers=4, window=4)
+    manager.start()
+    manager.add("v1")
+    assert manager.join(30)
+    manager.stop()
+    assert manager.tasks["v1"].state == TASK_DONE
+    assert len(lock_free) == len(segments) and all(lock_free)
+
+
+def test_download_fails_instead_of_spinning_on_lost_segment(tmp_path, segments, monkeypatch):
+    urls = VideoClient.get_segment_urls(None)
+    take = HlsJob.take
+
+    def lossy_take(job, limit=None):
+        # 分片 2 被领取后丢失，既不在下载中也不会重新排队
+        return [segment for segment in take(job, limit) if segment[0] != 2]
+
+    monkeypatch.setattr(HlsJob, "take", lossy_take)
+    downloader = HlsDownloader(workers=2, window=4, timeout=1)
+    with pytest.raises(RuntimeError, match="没有可下载的分片"):
+        downloader.download(urls, str(tmp_path / "video.ts"))
+
+
+def test_wait_for_work_wakes_when_assembly_moves_window(tmp_path):
+    job = HlsJob(URLS, str(tmp_path / "video.ts"), window=2)
+    job.open()
+    try:
+        assert [index for index, _, _ in job.take()] == [0, 1]
+        assert not job.wait_for_work(0)
+        # 模拟另一个线程正在拼接
+        with job._lock:
+            job._assembling = True
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(job.wait_for_work(5)))
+        waiter.start()
+        with job._lock:
+            job.next_write = 1
+            job._idle.notify_all()
+        waiter.join(5)
+        assert results == [True]
+    finally:
+        with job._lock:
+            job._assembling = False
+        job.close()
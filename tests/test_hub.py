@@ -0,0 +1,108 @@
+import asyncio
+
+from douyu_api.hub import AsyncBarrageClient, BarrageHub
+from douyu_api.model import Barrage, BarrageGap
+
+
+async def until(predicate, timeout: float = 5) -> bool:
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(0.01)
+    return predicate()
+
+
+def test_login_join_and_receive(danmu_server):
+    async def main():
+        storage = asyncio.Queue()
+        client = AsyncBarrageClient("9999", uid="123", storage=storage, url=danmu_server.url)
+        client.start()
+        assert await until(lambda: "joingroup" in danmu_server.types())
+        danmu_server.push(
+            {"type": "chatmsg", "rid": "9999", "uid": "1", "nn": "用户", "txt": "你好", "cst": "1000"}
+        )
+        barrage = await asyncio.wait_for(storage.get(), 5)
+        await client.stop()
+        return barrage, client
+
+    barrage, client = asyncio.run(main())
+    assert danmu_server.types()[:2] == ["loginreq", "joingroup"]
+    login = danmu_server.received[0][1]
+    assert login["room_id"] == "9999" and login["uid"] == "123"
+    assert isinstance(barrage, Barrage)
+    assert barrage.content == "你好" and barrage.cst == 1000
+    assert client.connected is False
+
+
+def test_hub_sends_heartbeats(danmu_server):
+    async def main():
+        hub = BarrageHub(url=danmu_server.url, heartbeat_interval=0.2, tick=0.05)
+        hub.add_room("1")
+        hub.add_room("2")
+        hub.start()
+        # 登录时一次，之后每 0.2 秒一次
+        assert await until(lambda: danmu_server.types().count("mrkl") >= 6, timeout=3)
+        await hub.stop()
+
+    asyncio.run(main())
+    heartbeats = {index for index, message in danmu_server.received if message["type"] == "mrkl"}
+    assert heartbeats == {0, 1}
+
+
+def test_reconnect_after_drop_emits_gap(danmu_server):
+    async def main():
+        storage = asyncio.Queue()
+        client = AsyncBarrageClient(
+            "9999", storage=storage, url=danmu_server.url, reconnect_interval=0.05
+        )
+        client.start()
+        assert await until(lambda: client.connected)
+        danmu_server.drop()
+        assert await until(lambda: danmu_server.types().count("loginreq") == 2)
+        assert await until(lambda: client.connected)
+        gap = await asyncio.wait_for(storage.get(), 5)
+        await client.stop()
+        return gap, client
+
+    gap, client = asyncio.run(main())
+    assert danmu_server.accepted == 2
+    assert isinstance(gap, BarrageGap)
+    assert gap.room_id == "9999" and gap.end >= gap.start
+    assert client.reconnect_stats()["reconnects"] == 1
+
+
+def test_connect_through_http_proxy(danmu_server, connect_proxy):
+    async def main():
+        client = AsyncBarrageClient(
+            "9999",
+            url=danmu_server.url,
+            proxy_type="http",
+            http_proxy_host="127.0.0.1",
+            http_proxy_port=connect_proxy.port,
+        )
+        client.start()
+        assert await until(lambda: client.connected)
+        await client.stop()
+
+    asyncio.run(main())
+    assert connect_proxy.targets == [f"127.0.0.1:{danmu_server.port}"]
+    assert "joingroup" in danmu_server.types()
+
+
+def test_uid_conflict_changes_uid(danmu_server):
+    danmu_server.conflict_uids.add("123")
+
+    async def main():
+        client = AsyncBarrageClient("9999", uid="123", url=danmu_server.url, reconnect_interval=0.05)
+        client.start()
+        assert await until(lambda: client.connected)
+        await client.stop()
+        return client
+
+    client = asyncio.run(main())
+    assert client.uid != "123"
+    logins = [message for _, message in danmu_server.received if message["type"] == "loginreq"]
+    assert [login["uid"] for login in logins] == ["123", client.uid]
+    assert danmu_server.accepted == 2
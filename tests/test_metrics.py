@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+from douyu_api import metrics
+from douyu_api.metrics import StreamMetrics, prometheus_text
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def fake_clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(metrics, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def test_stalled_while_waiting_and_after_silence(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    stream_metrics = StreamMetrics(stall_timeout=5)
+    assert not stream_metrics.stalled
+    stream_metrics.request_started()
+    clock.now += 6
+    # 超过 stall_timeout 还没有收到首字节
+    assert stream_metrics.stalled
+    stream_metrics.add(100)
+    assert not stream_metrics.stalled
+    assert stream_metrics.ttfb == 6
+    clock.now += 6
+    assert stream_metrics.stalled
+    stream_metrics.add(100)
+    assert stream_metrics.stalls == 1
+
+
+def test_not_stalled_after_stream_stopped(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    stream_metrics = StreamMetrics(stall_timeout=5)
+    stream_metrics.request_started()
+    stream_metrics.add(100)
+    stream_metrics.stopped()
+    clock.now += 60
+    assert not stream_metrics.stalled
+    assert 'douyu_stream_stalled{room="1"} 0.0' in prometheus_text(
+        {"1": stream_metrics.snapshot()}
+    )
+    # 重新开始后的第一块数据不计为卡顿恢复
+    stream_metrics.request_started()
+    clock.now += 1
+    stream_metrics.add(100)
+    assert stream_metrics.stalls == 0
+    assert stream_metrics.bytes == 200
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+from douyu_api.model import Barrage, BarrageBatch
+
+BASE_MS = 1634567890123
+
+
+def barrage(user_id, nick_name, level, content, seconds, room_id="9999") -> Barrage:
+    return Barrage(
+        room_id=room_id,
+        user_id=user_id,
+        nick_name=nick_name,
+        level=level,
+        content=content,
+        cst=BASE_MS + seconds * 1000,
+    )
+
+
+def barrages() -> list:
+    return [
+        barrage("1001", "观众", "12", "666", 0),
+        barrage("1002", "", "0", "", 1),
+        # 缺少的字段取出时仍为 None
+        barrage(None, None, None, None, 2),
+        barrage("1004", "表情😀/@", "150", "多字节文本" * 20, 3, room_id=None),
+        barrage("1005", "x", "", "空等级", 4),
+    ]
+
+
+def expected(barrage: Barrage) -> dict:
+    info = barrage.to_dict()
+    # 数值字段的空字符串按 None 保存
+    if info["level"] == "":
+        info["level"] = None
+    return info
+
+
+def test_batch_round_trip_keeps_none():
+    items = barrages()
+    batch = BarrageBatch(items)
+    assert len(batch) == len(items)
+    assert [item.to_dict() for item in batch] == [expected(item) for item in items]
+    assert batch[-3].level is None and batch[-3].content is None
+    assert batch[1].level == "0" and batch[1].content == ""
+
+
+def test_batch_to_dicts_and_json_lines():
+    items = barrages()
+    batch = BarrageBatch(items)
+    assert batch.to_dicts() == [expected(item) for item in items]
+    raw = batch.to_dicts(raw_time=True)
+    assert [info["send_time"] for info in raw] == [item.cst for item in items]
+
+    lines = batch.to_json_lines().splitlines()
+    expected_lines = [json.loads(item.to_json()) for item in items]
+    expected_lines[-1]["level"] = None
+    assert [json.loads(line) for line in lines] == expected_lines
+
+
+def test_append_chatmsg_matches_parse_chatmsg():
+    chatmsgs = [
+        {"rid": "9999", "uid": "1001", "nn": "观众", "level": "7", "txt": "你好", "cst": str(BASE_MS)},
+        {"rid": "9999", "cst": str(BASE_MS)},
+    ]
+    batch = BarrageBatch()
+    for chatmsg in chatmsgs:
+        batch.append_chatmsg(chatmsg)
+    assert [item.to_dict() for item in batch] == [
+        Barrage.parse_chatmsg(chatmsg).to_dict() for chatmsg in chatmsgs
+    ]
+
+
+@pytest.mark.parametrize(
+    "cutoff, dropped",
+    [(0, 0), (BASE_MS + 2000, 2), (BASE_MS + 2500, 3), (BASE_MS + 9000, 5)],
+)
+def test_drop_before(cutoff, dropped):
+    items = barrages()
+    batch = BarrageBatch(items)
+    assert batch.drop_before(cutoff) == dropped
+    assert batch.to_dicts() == [expected(item) for item in items[dropped:]]
+
+    # 删除后继续追加，文本偏移保持正确
+    extra = barrage("2000", "新", None, "追加", 10)
+    batch.append_barrage(extra)
+    assert batch[-1].to_dict() == extra.to_dict()
+    assert len(batch) == len(items) - dropped + 1
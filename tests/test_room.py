@@ -0,0 +1,72 @@
+import pytest
+import requests
+
+from douyu_api.exceptions import NotOpenError, RoomNotFindError, UnknownError, is_transient
+from douyu_api.model import RoomResult
+from douyu_api.room import RoomClient
+
+
+def http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    response.url = "https://www.douyu.com/betard/1"
+    return requests.HTTPError(f"{status}", response=response)
+
+
+@pytest.mark.parametrize(
+    "error, transient",
+    [
+        (requests.ConnectionError("连接被重置"), True),
+        (requests.Timeout("读取超时"), True),
+        (ConnectionResetError(), True),
+        (TimeoutError(), True),
+        (http_error(503), True),
+        (http_error(429), True),
+        (http_error(404), False),
+        (http_error(403), False),
+        (RoomNotFindError(), False),
+        (NotOpenError(), False),
+        (UnknownError(), False),
+        # 解析出错重试也不会成功
+        (AttributeError("'NoneType' object has no attribute 'get'"), False),
+        (KeyError("room"), False),
+        (ValueError(), False),
+        (TypeError(), False),
+    ],
+)
+def test_is_transient(error, transient):
+    assert is_transient(error) is transient
+    assert RoomResult(1, error=error).transient is transient
+
+
+def fake_response(status: int, body: bytes = b"{}") -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.url = "https://yuba.douyu.com/"
+    return response
+
+
+def test_user_info_forwards_request_kwargs(monkeypatch):
+    client = RoomClient()
+    calls = []
+
+    def get(url, **kwargs):
+        calls.append((url, kwargs))
+        return fake_response(200, b'{"data": {"uid": 1, "safe_uid": "abc"}}')
+
+    monkeypatch.setattr(client, "get", get)
+    user = client.get_user_info(safe_uid="abc", timeout=3)
+    assert user.safe_uid == "abc"
+    assert calls == [("https://yuba.douyu.com/wbapi/web/user/detail/abc", {"timeout": 3})]
+
+
+@pytest.mark.parametrize(
+    "method, kwargs", [("get_room_info", {"room_id": 1}), ("get_user_info", {"safe_uid": "abc"})]
+)
+def test_server_errors_raise_transient_http_error(monkeypatch, method, kwargs):
+    client = RoomClient()
+    monkeypatch.setattr(client, "get", lambda url, **_: fake_response(502, b"<html>"))
+    with pytest.raises(requests.HTTPError) as info:
+        getattr(client, method)(**kwargs)
+    assert is_transient(info.value)
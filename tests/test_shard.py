@@ -0,0 +1,116 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from conftest import wait_for
+from douyu_api.shard import SHARD_REMOVED, HashRing, ShardCoordinator
+
+
+def test_hash_ring_only_moves_keys_of_removed_node():
+    ring = HashRing(range(5))
+    keys = [str(room_id) for room_id in range(10000)]
+    before = {key: ring.get(key) for key in keys}
+    counts = [list(before.values()).count(node) for node in range(5)]
+    # 虚拟节点让各节点分到的键大致均匀
+    assert min(counts) > 10000 / 5 * 0.6
+
+    ring.remove(2)
+    after = {key: ring.get(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert sorted(moved) == sorted(key for key in keys if before[key] == 2)
+    assert 2 not in after.values()
+
+    # 重新加入后恢复原来的分配
+    ring.add(2)
+    assert {key: ring.get(key) for key in keys} == before
+
+
+def test_hash_ring_add_only_moves_keys_to_new_node():
+    ring = HashRing(range(4))
+    keys = [str(room_id) for room_id in range(10000)]
+    before = {key: ring.get(key) for key in keys}
+    ring.add(4)
+    after = {key: ring.get(key) for key in keys}
+    moved = {key: node for key, node in after.items() if node != before[key]}
+    assert set(moved.values()) == {4}
+    assert len(moved) < 10000 / 5 * 1.5
+
+
+def test_late_stats_reply_is_discarded():
+    coordinator = ShardCoordinator(workers=1, stats_timeout=0.1)
+    shard = coordinator.shards[0]
+    shard.conn, worker_conn = coordinator.context.Pipe()
+
+    def worker():
+        # 第一次请求的回复晚于超时时间
+        for delay in (0.3, 0):
+            _, seq = worker_conn.recv()
+            time.sleep(delay)
+            worker_conn.send(("stats", seq, {"seq": seq}))
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        assert coordinator.collect_stats() == {0: None}
+        coordinator.stats_timeout = 2
+        assert coordinator.collect_stats() == {0: {"seq": 2}}
+        thread.join(5)
+        assert not shard.conn.poll()
+    finally:
+        shard.conn.close()
+        worker_conn.close()
+
+
+@pytest.fixture
+def coordinator(danmu_server):
+    coordinator = ShardCoordinator(
+        workers=2,
+        check_interval=0.05,
+        stats_interval=60,
+        max_restarts=1,
+        url=danmu_server.url,
+    )
+    yield coordinator
+    coordinator.stop(timeout=10)
+
+
+def shard_rooms(coordinator) -> dict:
+    '''各分片工作进程报告的房间数'''
+    return {
+        shard_id: stats and stats["rooms"]
+        for shard_id, stats in coordinator.collect_stats().items()
+    }
+
+
+def expected_rooms(coordinator) -> dict:
+    status = coordinator.status()
+    return {
+        shard_id: info["rooms"]
+        for shard_id, info in status.items()
+        if info["state"] != SHARD_REMOVED
+    }
+
+
+def test_dead_worker_is_restarted_then_removed(coordinator):
+    for room_id in range(40):
+        coordinator.add_room(room_id)
+    coordinator.start()
+    assert wait_for(lambda: shard_rooms(coordinator) == expected_rooms(coordinator), 30)
+    assert all(count > 0 for count in expected_rooms(coordinator).values())
+
+    # 第一次退出：重启并恢复原来的房间
+    shard = coordinator.shards[0]
+    pid = shard.process.pid
+    os.kill(pid, signal.SIGKILL)
+    assert wait_for(lambda: shard.restarts == 1, 10)
+    assert shard.process.pid != pid
+    assert wait_for(lambda: shard_rooms(coordinator) == expected_rooms(coordinator), 30)
+
+    # 再次退出超过 max_restarts：分片被移除，房间全部交给其余分片
+    os.kill(shard.process.pid, signal.SIGKILL)
+    assert wait_for(lambda: shard.state == SHARD_REMOVED, 10)
+    assert set(coordinator.assignment.values()) == {1}
+    assert wait_for(lambda: shard_rooms(coordinator) == {1: 40}, 30)
@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+
+import pytest
+
+from douyu_api.sign import (
+    NodeRuntime,
+    Signer,
+    SignTemplate,
+    decode_ub9,
+    extract_pc,
+    match_sign_source,
+    native_sign,
+)
+
+requires_node = pytest.mark.skipif(not NodeRuntime.available(), reason="没有安装 node")
+
+# 页面片段、sign 函数的版本号 v 以及各组 (key_id, did, tt) 的签名结果
+# 签名结果由 node 直接执行 ub98484234 生成的 sign 函数得到，MD5 使用 node 的 crypto
+with open(
+    os.path.join(os.path.dirname(__file__), "fixtures", "sign_templates.json"),
+    encoding="utf-8",
+) as f:
+    FIXTURES = json.load(f)
+
+CASES = [
+    pytest.param(fixture, case, id=f"{fixture['name']}-{case['key_id']}")
+    for fixture in FIXTURES
+    for case in fixture["signs"]
+]
+
+# 用 node 的 crypto 实现 CryptoJS.MD5，原样执行 sign 函数
+CRYPTOJS_SHIM = '''
+var crypto = require("crypto");
+var CryptoJS = {MD5: function (s) { return {toString: function () {
+    return crypto.createHash("md5").update(s, "utf8").digest("hex"); }}; }};
+function __run(source, a, b, c) { return eval(source)(a, b, c); }
+'''
+
+
+@requires_node
+def test_node_runtime_kills_and_restarts_on_timeout():
+    runtime = NodeRuntime(timeout=0.5)
+    try:
+        context = runtime.compile(
+            "function add(a, b) { return a + b; }\n"
+            "function hang() { while (true) {} }"
+        )
+        assert context.call("add", 1, 2) == 3
+        first = runtime._process
+        with pytest.raises(TimeoutError):
+            context.call("hang")
+        assert first.poll() is not None
+        # 新进程中重新编译，之后的调用不受影响
+        assert context.call("add", 2, 3) == 5
+        assert runtime._process is not first
+    finally:
+        runtime.close()
+
+
+@requires_node
+def test_node_runtime_restarts_after_exit():
+    runtime = NodeRuntime()
+    try:
+        context = runtime.compile("function add(a, b) { return a + b; }")
+        runtime._process.kill()
+        runtime._process.wait()
+        assert context.call("add", 1, 1) == 2
+    finally:
+        runtime.close()
+
+
+@pytest.mark.parametrize("fixture, case", CASES)
+def test_native_sign_matches_recorded(fixture, case):
+    result = native_sign(fixture["v"], case["key_id"], case["did"], case["tt"])
+    assert (result == case["sign"]) is fixture["native"]
+
+
+@requires_node
+@pytest.mark.parametrize("fixture, case", CASES)
+def test_native_sign_matches_execjs(fixture, case):
+    '''不经过本模块的改写，用 execjs 执行页面中的 JS 与 native_sign 比对'''
+    execjs = pytest.importorskip("execjs")
+    args = (case["key_id"], case["did"], case["tt"])
+    source = execjs.compile(extract_pc(fixture["html"])).call("ub98484234", *args)
+    expected = execjs.compile(CRYPTOJS_SHIM).call("__run", source, *args)
+    assert expected == case["sign"]
+    assert (native_sign(fixture["v"], *args) == expected) is fixture["native"]
+
+
+@requires_node
+@pytest.mark.parametrize("fixture", FIXTURES, ids=[f["name"] for f in FIXTURES])
+def test_signer_template_matches_recorded(fixture):
+    runtime = NodeRuntime()
+    try:
+        signer = Signer(runtime=runtime, cache_dir=None)
+        first = fixture["signs"][0]
+        template = signer.template(
+            extract_pc(fixture["html"]), first["key_id"], first["did"], first["tt"]
+        )
+        assert template.v == fixture["v"]
+        assert template.native is fixture["native"]
+        for case in fixture["signs"]:
+            args = (case["key_id"], case["did"], case["tt"])
+            assert template.js_sign(runtime, *args) == case["sign"]
+            assert signer._sign(template, *args) == case["sign"]
+    finally:
+        runtime.close()
+
+
+class NoRuntime:
+    def compile(self, source):
+        raise AssertionError("已知模板不应执行 JS")
+
+
+NATIVE_FIXTURES = [fixture for fixture in FIXTURES if fixture["native"]]
+
+
+@pytest.mark.parametrize("fixture", NATIVE_FIXTURES, ids=[f["name"] for f in NATIVE_FIXTURES])
+def test_known_template_is_recognized_without_js(tmp_path, fixture):
+    func_ub9 = extract_pc(fixture["html"])
+    signer = Signer(runtime=NoRuntime(), cache_dir=str(tmp_path))
+    template = signer.template(func_ub9)
+    assert template.native and template.v == fixture["v"]
+    for case in fixture["signs"]:
+        args = (case["key_id"], case["did"], case["tt"])
+        assert signer._sign(template, *args) == case["sign"]
+
+    # 重启后从缓存目录读取，不再识别
+    restarted = Signer(runtime=NoRuntime(), cache_dir=str(tmp_path))
+    cached = restarted.template(func_ub9)
+    assert cached.to_dict() == template.to_dict()
+    assert restarted.stats()["template_misses"] == 1
+
+
+def test_unknown_template_is_not_recognized():
+    fixture = next(fixture for fixture in FIXTURES if not fixture["native"])
+    source = decode_ub9(extract_pc(fixture["html"]))
+    assert source is not None
+    assert match_sign_source(source) is None
+
+
+SIGN_SOURCE = (
+    '(function (a,b,c){var cb=a+b+c+"123";var rb=CryptoJS.MD5(cb).toString();%s'
+    'var rt="v=123"+"&did="+b+"&tt="+c+"&sign="+rb;return rt;})'
+)
+
+
+@pytest.mark.parametrize(
+    "statement, v",
+    [
+        ("", "123"),
+        ("var re=[];for(var i=0;i<rb.length;i++){re.push(rb.charCodeAt(i));}", "123"),
+        # rb 已经算出，之后再改 cb 不影响签名
+        ('cb="";', "123"),
+        # 改动了参与签名的变量
+        ('for(var i=0;i<2;i++){rb+="0";}', None),
+        ("rb=rb.toUpperCase();", None),
+        ('b="0";', None),
+        ("eval(cb);", None),
+    ],
+)
+def test_match_sign_source(statement, v):
+    assert match_sign_source(SIGN_SOURCE % statement) == v
+
+
+def test_signer_metrics_are_counted_under_lock():
+    signer = Signer(runtime=object())
+    template = SignTemplate("", FIXTURES[0]["v"], native=True)
+
+    def sign_many():
+        for i in range(2000):
+            signer._sign(template, "1", "did", str(i))
+
+    threads = [threading.Thread(target=sign_many) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert signer.stats()["native_signs"] == 16000
@@ -0,0 +1,65 @@
+import asyncio
+import threading
+import time
+
+from douyu_api.hub import AsyncBarrageClient
+from douyu_api.model import Barrage
+from douyu_api.sink import OVERFLOW_BLOCK, CallableSink
+
+
+def slow_sink(**kwargs):
+    release = threading.Event()
+    batches = []
+
+    def consume(batch):
+        release.wait(5)
+        batches.append(batch)
+
+    return CallableSink(consume, **kwargs), release, batches
+
+
+def test_put_many_nowait_drops_instead_of_blocking():
+    sink, release, batches = slow_sink(batch_size=1, capacity=2, overflow=OVERFLOW_BLOCK)
+    try:
+        start = time.monotonic()
+        sink.put_many_nowait(list(range(10)))
+        assert time.monotonic() - start < 0.5
+        assert sink.dropped > 0
+    finally:
+        release.set()
+        sink.close()
+    assert sum(len(batch) for batch in batches) + sink.dropped == 10
+
+
+def test_async_client_store_does_not_block_event_loop():
+    sink, release, _ = slow_sink(batch_size=1, capacity=1, overflow=OVERFLOW_BLOCK)
+    client = AsyncBarrageClient("9999", storage=sink)
+    barrages = [Barrage(room_id="9999", content=str(i), cst=i) for i in range(20)]
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        task = asyncio.ensure_future(ticker())
+        await asyncio.sleep(0.01)
+        start = time.monotonic()
+        for barrage in barrages:
+            client._store([barrage])
+        elapsed = time.monotonic() - start
+        await asyncio.sleep(0.05)
+        task.cancel()
+        return elapsed, ticks
+
+    try:
+        elapsed, ticks = asyncio.run(main())
+    finally:
+        release.set()
+        sink.close()
+    assert elapsed < 0.5
+    assert ticks > 5
+    assert sink.dropped > 0
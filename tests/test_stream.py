@@ -0,0 +1,139 @@
+from types import SimpleNamespace
+
+import pytest
+
+from douyu_api import stream
+from douyu_api.stream import StreamClient
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeTimer:
+    '''记录刷新定时器，由测试手动触发'''
+
+    timers = []
+
+    def __init__(self, interval: float, function: "callable") -> None:
+        self.interval = interval
+        self.function = function
+        self.daemon = False
+        self.started = False
+        self.cancelled = False
+        FakeTimer.timers.append(self)
+
+    def start(self) -> None:
+        self.started = True
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def fire(self) -> None:
+        assert self.started and not self.cancelled
+        self.function()
+
+
+class FakeResolve:
+    '''按顺序返回预设的结果，记录调用次数'''
+
+    def __init__(self, *results) -> None:
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self) -> "tuple[int, str]":
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(stream, "time", SimpleNamespace(monotonic=clock, time=clock))
+    FakeTimer.timers = []
+    monkeypatch.setattr(stream.threading, "Timer", FakeTimer)
+    return clock
+
+
+def make_client(*results, key_ttl: int = 300, error_ttl: int = 30):
+    client = StreamClient("9999", key_ttl=key_ttl, error_ttl=error_ttl)
+    client._resolve = FakeResolve(*results)
+    client.running = True
+    return client
+
+
+def test_key_is_reused_across_rollovers_until_ttl(clock):
+    client = make_client((0, "key1"), (0, "key2"), (0, "key3"))
+    # 每次分段和重连都会调用 resolve，有效期内不再请求
+    for _ in range(5):
+        assert client.resolve() == (0, "key1")
+        clock.now += 50
+    assert client._resolve.calls == 1
+
+    clock.now += 60
+    assert client.resolve() == (0, "key2")
+    assert client._resolve.calls == 2
+
+    # 视频流中断后丢弃缓存，下次重新获取
+    client.invalidate()
+    assert client.resolve() == (0, "key3")
+    assert client.resolve(force=False) == (0, "key3")
+    assert client._resolve.calls == 3
+
+
+def test_key_is_refreshed_in_background_before_expiry(clock):
+    client = make_client((0, "key1"), (0, "key2"), RuntimeError("签名失败"))
+    assert client.resolve() == (0, "key1")
+    timer = FakeTimer.timers[-1]
+    assert timer.interval == pytest.approx(300 * 0.8)
+
+    clock.now += 240
+    timer.fire()
+    assert client._resolve.calls == 2
+    # 刷新后的地址从刷新时起重新计算有效期
+    clock.now += 250
+    assert client.resolve() == (0, "key2")
+    assert client._resolve.calls == 2
+
+    # 刷新失败时继续使用旧的地址，不再安排刷新
+    next_timer = FakeTimer.timers[-1]
+    assert next_timer is not timer and next_timer.interval == pytest.approx(240)
+    next_timer.fire()
+    assert client._resolve.calls == 3
+    assert client.resolve() == (0, "key2")
+    assert FakeTimer.timers[-1] is next_timer
+
+
+def test_refresh_stops_with_client(clock):
+    client = make_client((0, "key1"))
+    client.resolve()
+    client.stream_server = SimpleNamespace()
+    client.stop()
+    timer = FakeTimer.timers[-1]
+    assert timer.cancelled
+    # 已经触发的定时器在停止后不再请求
+    timer.function()
+    assert client._resolve.calls == 1
+
+
+@pytest.mark.parametrize("error", [102, 104])
+def test_not_exist_and_offline_are_cached_briefly(clock, error):
+    client = make_client((error, ""), (0, "key1"))
+    assert client.resolve() == (error, "")
+    # 错误结果不安排后台刷新
+    assert FakeTimer.timers == []
+    clock.now += 29
+    assert client.resolve() == (error, "")
+    assert client._resolve.calls == 1
+
+    clock.now += 2
+    assert client.resolve() == (0, "key1")
+    assert client._resolve.calls == 2
+    assert len(FakeTimer.timers) == 1
@@ -0,0 +1,196 @@
+import random
+
+import pytest
+
+from douyu_api import stt
+from douyu_api.barrage import BarrageClient
+from douyu_api.model import Barrage
+
+
+def frame(content: str, msg_type: int = stt.SERVER_MSG_TYPE) -> bytes:
+    return stt.encode_frame(content, msg_type)
+
+
+def contents(frames) -> list:
+    return [bytes(view).decode("utf-8") for view in frames]
+
+
+MESSAGES = [f"type@=chatmsg/txt@=弹幕{i}{'长' * (i * 37 % 300)}/" for i in range(50)]
+STREAM = b"".join(frame(message) for message in MESSAGES)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_decoder_reassembles_arbitrary_chunks(seed):
+    rng = random.Random(seed)
+    decoder = stt.FrameDecoder()
+    result = []
+    pos = 0
+    while pos < len(STREAM):
+        size = rng.choice([1, 2, 11, 12, 13, rng.randint(1, 2000)])
+        # 每次 feed 返回的帧只在下一次调用前有效
+        result += contents(decoder.feed(STREAM[pos : pos + size]))
+        pos += size
+    assert result == MESSAGES
+    assert len(decoder) == 0 and decoder.errors == 0
+
+
+def test_decoder_accepts_client_frames():
+    decoder = stt.FrameDecoder()
+    data = frame("type@=loginreq/", stt.CLIENT_MSG_TYPE) + frame("type@=mrkl/")
+    assert contents(decoder.feed(data)) == ["type@=loginreq/", "type@=mrkl/"]
+
+
+def mismatched_lengths() -> bytes:
+    data = bytearray(frame("type@=bad/"))
+    data[4] += 1
+    return bytes(data)
+
+
+def bad_type() -> bytes:
+    data = bytearray(frame("type@=bad/"))
+    data[8:10] = (700).to_bytes(2, "little")
+    return bytes(data)
+
+
+def too_short() -> bytes:
+    return (4).to_bytes(4, "little") * 2 + (690).to_bytes(2, "little") + b"\0\0"
+
+
+def too_long() -> bytes:
+    return frame("type@=bad/" + "x" * 200)
+
+
+@pytest.mark.parametrize("corrupt", [mismatched_lengths, bad_type, too_short, too_long])
+def test_decoder_keeps_frames_around_bad_header(corrupt):
+    decoder = stt.FrameDecoder(max_frame_size=100)
+    data = frame("type@=first/") + corrupt() + frame("type@=second/")
+    # 错误之前和之后的数据帧都不会丢失
+    assert contents(decoder.feed(data)) == ["type@=first/", "type@=second/"]
+    assert decoder.errors >= 1
+    assert len(decoder) == 0
+
+
+@pytest.mark.parametrize("split", [1, 5, 12, 20])
+def test_decoder_resyncs_across_feeds(split):
+    decoder = stt.FrameDecoder()
+    data = frame("type@=first/") + b"garbage!" * 3 + frame("type@=second/")
+    head = len(frame("type@=first/")) + split
+    result = contents(decoder.feed(data[:head]))
+    result += contents(decoder.feed(data[head:]))
+    result += contents(decoder.feed(frame("type@=third/")))
+    assert result == ["type@=first/", "type@=second/", "type@=third/"]
+    assert decoder.errors >= 1
+
+
+def test_decoder_keeps_partial_frame_until_complete():
+    decoder = stt.FrameDecoder()
+    data = frame("type@=chatmsg/txt@=hello/")
+    assert decoder.feed(data[:-3]) == []
+    assert len(decoder) == len(data) - 3
+    assert contents(decoder.feed(data[-3:])) == ["type@=chatmsg/txt@=hello/"]
+    decoder.feed(data[:5])
+    decoder.reset()
+    assert len(decoder) == 0
+    assert contents(decoder.feed(data)) == ["type@=chatmsg/txt@=hello/"]
+
+
+@pytest.mark.parametrize(
+    "value", ["", "plain", "a@b", "a/b", "@S", "@A", "@AS", "@@//", "/@S@A/x", "@=", "弹幕@A/"]
+)
+def test_escape_round_trip(value):
+    escaped = stt.escape(value)
+    assert "/" not in escaped
+    assert stt.unescape(escaped) == value
+
+
+def test_dumps_loads_round_trip():
+    message = {
+        "type": "chatmsg",
+        "txt": "主播/666 @所有人 @S@A 结尾x",
+        "nn": "a@=b/c",
+        "el": [{"eid": "1", "etp": "@A/"}, {"eid": "2", "etp": "x"}],
+        "ext": {"medal": {"id": "9/9", "lv": "3"}, "list": [{"a": "@b"}, {"c": "/"}]},
+        "tail": "以斜杠结尾/",
+    }
+    content = stt.dumps(message)
+    assert content.count("/") == len(message)
+    assert stt.loads(content) == message
+    assert stt.loads(content.encode("utf-8")) == message
+    assert stt.loads(memoryview(content.encode("utf-8"))) == message
+
+
+def test_dumps_known_wire_format():
+    assert stt.dumps({"type": "loginreq", "dfl": "sn@=105/ss@=1"}) == (
+        "type@=loginreq/dfl@=sn@A=105@Sss@A=1/"
+    )
+    assert stt.loads("type@=mrkl/") == {"type": "mrkl"}
+    assert stt.loads("a/b@Sc/") == ["a", "b/c"]
+    # 嵌套的普通字符串列表与以 '/' 结尾的文本无法区分，按文本处理
+    assert stt.loads(stt.dumps({"k": ["a", "b"]})) == {"k": "a/b/"}
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        ("type@=chatmsg/rid@=1/", "chatmsg"),
+        ("rid@=1/type@=uenter/nn@=a/", "uenter"),
+        ("txt@=" + "x" * 200 + "/type@=dgb/", "dgb"),
+        ("type@=" + "t" * 100 + "/", "t" * 100),
+        ("txt@=@Stype@A=fake/type@=spbc/", "spbc"),
+        ("rid@=1/", None),
+    ],
+)
+def test_peek_type(content, expected):
+    assert stt.peek_type(content.encode("utf-8")) == expected
+    view = memoryview(frame(content))[stt.HEADER_SIZE : -1]
+    assert stt.peek_type(view) == expected
+
+
+def test_field_selector_matches_full_parse():
+    message = {
+        "type": "chatmsg", "rid": "9999", "ct": "14", "uid": "100001",
+        "nn": "昵称/@S", "txt": "内容 @A/nn@=伪造", "level": "23", "cst": "1634567890123",
+        "el": [{"eid": "1", "sc": "1"}], "snn": "txt", "ulevel": "99",
+    }
+    content = stt.dumps(message).encode("utf-8")
+    selector = stt.FieldSelector(("type", "nn", "txt", "level", "cst", "missing"))
+    assert selector(content) == {
+        "type": "chatmsg", "nn": "昵称/@S", "txt": "内容 @A/nn@=伪造", "level": "23",
+        "cst": "1634567890123",
+    }
+
+
+class RecordingDict(dict):
+    '''记录被读取过的键'''
+
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+        self.read = set()
+
+    def get(self, key, default=None):
+        self.read.add(key)
+        return super().get(key, default)
+
+    def __getitem__(self, key):
+        self.read.add(key)
+        return super().__getitem__(key)
+
+
+def test_chatmsg_fields_are_exactly_what_parsing_reads():
+    message = {
+        "type": "chatmsg", "rid": "9999", "ct": "14", "uid": "100001", "nn": "测试/@用户",
+        "txt": "主播666 @S@A/", "cid": "e3a3", "ic": "avatar_v3/2021", "level": "23",
+        "sahf": "0", "nl": "3", "cst": "1634567890123", "bnn": "粉丝牌", "bl": "12",
+        "el": [{"eid": "1"}],
+    }
+    content = stt.dumps(message).encode("utf-8")
+    selected = stt.FieldSelector(Barrage.CHATMSG_FIELDS)(content)
+    assert set(selected) == set(Barrage.CHATMSG_FIELDS)
+
+    # 消息分发和 Barrage.parse_chatmsg 读取的字段正好是提取的字段
+    data = RecordingDict(selected)
+    barrage = BarrageClient("9999").parse_msg(data)
+    assert data.read == set(Barrage.CHATMSG_FIELDS)
+    full = BarrageClient("9999").parse_msg(stt.loads(content))
+    assert barrage.to_dict() == full.to_dict()
+    assert barrage.content == "主播666 @S@A/" and barrage.nick_name == "测试/@用户"
@@ -0,0 +1,116 @@
+import os
+import time
+
+import pytest
+
+from conftest import make_flv, wait_for
+from douyu_api import stream
+from douyu_api.model import Room, RoomResult
+from douyu_api.supervisor import (
+    ROOM_BACKOFF,
+    ROOM_OFFLINE,
+    ROOM_RECORDING,
+    StreamSupervisor,
+)
+
+
+class FakeRoomClient:
+    '''开播检查的替身，返回 live 中的开播状态'''
+
+    def __init__(self) -> None:
+        self.live = set()
+
+    def iter_room_infos(self, room_ids, **kwargs):
+        for room_id in room_ids:
+            show_status = 1 if room_id in self.live else 2
+            yield RoomResult(room_id, Room(room_id, show_status=show_status, video_loop=0))
+
+
+def flv_stream(seconds: float, chunks: int = 20):
+    '''按时间均匀输出的 FLV 数据'''
+    data, _ = make_flv(frames=200, gop=25)
+    size = len(data) // chunks + 1
+
+    def generate():
+        for pos in range(0, len(data), size):
+            yield data[pos : pos + size]
+            time.sleep(seconds / chunks)
+
+    return generate
+
+
+@pytest.fixture
+def supervisor(tmp_path, http_files):
+    room_client = FakeRoomClient()
+    supervisor = StreamSupervisor(
+        storage=str(tmp_path),
+        poll_interval=0.1,
+        base_backoff=0.1,
+        max_backoff=0.2,
+        room_client=room_client,
+        stream_url=http_files.url("/live/{key}.flv"),
+        chunk_size=1024,
+    )
+    supervisor.fake_rooms = room_client
+    yield supervisor
+    supervisor.stop()
+
+
+def script_resolve(client, live: list):
+    '''client 获取视频流地址时，live 为空返回未开播，否则返回 key abc'''
+    calls = []
+
+    def resolve():
+        calls.append(time.monotonic())
+        return (0, "abc") if live else (104, "")
+
+    client._resolve = resolve
+    return calls
+
+
+def flv_files(tmp_path) -> list:
+    return [
+        os.path.join(root, name)
+        for root, _, names in os.walk(tmp_path)
+        for name in names
+        if name.endswith(".flv")
+    ]
+
+
+def test_room_going_live_is_recorded_despite_cached_offline(tmp_path, http_files, supervisor):
+    http_files.files["/live/abc.flv"] = flv_stream(seconds=5)
+    room = supervisor.add_room("100")
+    live = []
+    calls = script_resolve(room.client, live)
+    supervisor.start()
+    assert wait_for(lambda: room.state == ROOM_OFFLINE)
+
+    # error_ttl 为 30 秒，开播后必须丢弃缓存的未开播结果
+    live.append(True)
+    supervisor.fake_rooms.live.add("100")
+    assert wait_for(lambda: room.client.download_size > 0, timeout=5), room.to_dict()
+    assert room.state == ROOM_RECORDING
+    assert room.client.exit_reason is None
+    assert len(calls) == 2
+    assert flv_files(tmp_path)
+
+
+def test_ended_stream_restarts_with_backoff(tmp_path, http_files, supervisor):
+    http_files.files["/live/abc.flv"] = flv_stream(seconds=0.3)
+    room = supervisor.add_room("200")
+    script_resolve(room.client, [True])
+    supervisor.start()
+    assert wait_for(lambda: http_files.requests.count("/live/abc.flv") >= 3, timeout=10)
+    assert room.restarts >= 2
+    assert room.last_exit == stream.EXIT_ENDED
+    assert room.state in (ROOM_BACKOFF, ROOM_RECORDING)
+    supervisor.stop()
+    room.client.stream_server.join(5)
+    # 录制结束后不再报告卡顿
+    assert not room.client.metrics.stalled and not room.client.metrics.running
+    # 每次重新开始都写入新的分段文件，文件都以 FLV 文件头开始
+    paths = flv_files(tmp_path)
+    assert len(paths) >= 3
+    for path in flv_files(tmp_path):
+        with open(path, "rb") as f:
+            assert f.read(3) == b"FLV"
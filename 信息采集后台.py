@@ -1,6 +1,17 @@
+import os
 import pymysql
+from douyu_api.checkpoint import CrawlCheckpoint
+from douyu_api.db import DatabaseSink
 from douyu_api.room import RoomClient
 
+# 同时进行中的请求数
+CONCURRENCY = 16
+# 采集的房间号范围
+START_ID = 1
+STOP_ID = 100000000
+# 只有主播信息获取失败时，单独重试主播信息的次数
+USER_RETRIES = 2
+
 
 def abc():
     password = "2q5p77c9"
@@ -13,52 +24,73 @@ def abc():
     return proxy
 
 
-def parse_data(room_id):
-    proxies = abc()
-    room = RoomClient(proxies=proxies)
-    room_info = room.get_room_info(room_id=room_id)
-    safe_id = room_info.safe_uid
-    user_info = room.get_user_info(safe_uid=safe_id)
-    sql = "insert into douyu_room(room_id, room_name, owner_uid, nick_name, owner_name, safe_uid, show_id, room_url, " \
-          "show_status, video_loop, game_tag_id, game_short_name, game_tag_name, game_tag_introduce) " \
-          "values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-    cursor.execute(sql, (
-        room_info.room_id, room_info.room_name, room_info.owner_uid, room_info.nick_name, room_info.nick_name,
-        room_info.safe_uid, room_info.show_id, room_info.room_url, room_info.show_status, room_info.video_loop,
-        room_info.game_tag_id, room_info.game_short_name, room_info.game_tag_name, room_info.game_tag_introduce
-    ))
-    db.commit()
-    sql = "insert into douyu_user(user_id, nick_name, avatar, gender, group_id, group_name, " \
-          "level, fu_num, fans_num, safe_uid, is_anchor) " \
-          "values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-    cursor.execute(sql, (
-        user_info.user_id, user_info.nick_name, user_info.avatar, user_info.gender, user_info.group_id,
-        user_info.group_name, user_info.level, user_info.fu_num, user_info.fans_num, user_info.safe_uid,
-        user_info.is_anchor
-    ))
-    db.commit()
-    print(room_info.to_dict())
-    print(user_info.to_dict())
-
-
-if __name__ == '__main__':
-
-    db = pymysql.connect(
+def connect_db():
+    return pymysql.connect(
         host="test1231111.f3322.net",
         user="zrq",
         port=53306,
         password="ZMoU#XOuQ5nU",
         database="we_media"
     )
-    cursor = db.cursor()
-    with open('finish', 'r', encoding='utf-8') as f:
-        start = int(f.read().strip())
-    for i in range(start, 100000000):
-        with open('finish', 'w', encoding='utf-8') as f:
-            f.write(str(i + 1))
-        print(i)
-        try:
-            parse_data(i)
-        except Exception as e:
-            print(e)
-            pass
+
+
+def parse_data(room_ids, sink, checkpoint):
+    room = RoomClient(proxies=abc(), pool_size=CONCURRENCY)
+    # 房间信息已获取、只有主播信息失败的结果
+    user_failed = []
+    for result in room.iter_room_infos(room_ids, concurrency=CONCURRENCY):
+        if result.ok:
+            # 写入在后台线程中成批提交，不阻塞采集；提交后由 checkpoint.committed 记录断点
+            sink.put(result)
+            print(result.room.to_dict())
+            print(result.user.to_dict() if result.user else None)
+        elif result.room is not None:
+            # 主播信息失败时房间信息照样写入，重试结束后再记录断点
+            sink.put(result.room)
+            print(result.room.to_dict())
+            user_failed.append(result)
+        else:
+            print(result.room_id, result.error_type, result.error)
+            # 没有需要写入的数据，直接记录
+            checkpoint.mark(result)
+
+    # 只重新获取主播信息，不再重复请求房间信息
+    for _ in range(USER_RETRIES):
+        if not user_failed:
+            break
+        results, user_failed = user_failed, []
+        for result in room.retry_user_infos(results, concurrency=CONCURRENCY):
+            if result.ok:
+                sink.put(result)
+                print(result.user.to_dict())
+            else:
+                user_failed.append(result)
+    for result in user_failed:
+        print(result.room_id, result.error_type, result.error)
+        # 房间信息提交后按主播信息的错误记录
+        sink.put(result)
+
+
+if __name__ == '__main__':
+
+    checkpoint = CrawlCheckpoint('checkpoint.json', save_interval=10)
+    # 数据提交后才记录断点，写入失败的房间记为待重试，不会中断采集
+    sink = DatabaseSink(
+        connect_db,
+        dialect="mysql",
+        batch_size=500,
+        flush_interval=5,
+        on_written=checkpoint.committed,
+        on_failed=checkpoint.commit_failed,
+    )
+    if not os.path.exists('checkpoint.json') and os.path.exists('finish'):
+        # 兼容旧的 finish 文件，之前的ID视为已完成
+        with open('finish', 'r', encoding='utf-8') as f:
+            checkpoint.done.add_range(START_ID, int(f.read().strip()))
+    try:
+        # 先重试上次的临时错误，再继续扫描
+        parse_data(checkpoint.retry_ids(), sink, checkpoint)
+        parse_data(checkpoint.pending(START_ID, STOP_ID), sink, checkpoint)
+    finally:
+        sink.close()
+        checkpoint.close()
@@ -1,10 +1,11 @@
+import functools
 import logging
 import time
 import requests
 from concurrent_log_handler import ConcurrentRotatingFileHandler
 from logging import handlers
-from douyu_api.stream import StreamClient
-from douyu_api.room import RoomClient
+from douyu_api.shard import KIND_STREAM, ShardCoordinator
+from douyu_api.supervisor import StreamSupervisor
 
 # TASKS = {"312212": None, "911": None, "3125893": None, "290935": None}
 TASKS = {
@@ -13,6 +14,8 @@ TASKS = {
     # "9597209": None,
     # "4521568": None
 }
+# 录制进程数，房间较多时分到多个进程，为 1 时在当前进程中录制
+SHARDS = 1
 
 
 def init_logger(
@@ -76,22 +79,46 @@ def init_logger(
     return logger
 
 
-def main():
-    while True:
-        for room_id in TASKS:
-            if not TASKS.get(room_id):
-                stream_client = StreamClient(room_id=room_id)
-                TASKS[room_id] = stream_client
-                stream_client.start()
-            else:
-                stream_client = TASKS[room_id]
+def main_sharded():
+    # 房间按一致性哈希分到多个进程，每个进程各自运行一个 StreamSupervisor
+    coordinator = ShardCoordinator(
+        workers=SHARDS,
+        kind=KIND_STREAM,
+        initializer=functools.partial(
+            init_logger,
+            "视频下载",
+            logger_level=logging.DEBUG,
+            log_file=True,
+            multiprocess=True,
+            loggers=["douyu_api"],
+        ),
+        poll_interval=30,
+    )
+    for room_id in TASKS:
+        coordinator.add_room(room_id)
+    coordinator.start()
+    try:
+        while True:
+            time.sleep(60)
+            for shard_id, status in coordinator.status().items():
+                logger.info(f"分片 {shard_id}:{status}")
+    finally:
+        coordinator.stop()
 
-            if stream_client.running:
-                logger.info("视频正在下载")
-            else:
-                stream_client.start()
 
-        time.sleep(60)
+def main():
+    if SHARDS > 1:
+        return main_sharded()
+    # 断流或出错时立即按退避重新开始，未开播的房间每 30 秒成批检查一次
+    supervisor = StreamSupervisor(TASKS, poll_interval=30)
+    supervisor.start()
+    try:
+        while True:
+            time.sleep(60)
+            for room_id, status in supervisor.status().items():
+                logger.info(f"房间 {room_id}:{status}")
+    finally:
+        supervisor.stop()
 
 
 if __name__ == '__main__':
@@ -1,14 +1,18 @@
 import logging
 from logging import handlers
-from douyu_api.video import VideoClient
+from douyu_api.video import VideoDownloadManager
 from concurrent_log_handler import ConcurrentRotatingFileHandler
 import time
-TASKS = {
-    "85": None,
-    # "7672892": None,
-    # "9597209": None,
-    # "4521568": None
-}
+TASKS = [
+    "85",
+    # "7672892",
+    # "9597209",
+    # "4521568",
+]
+# 总的并发下载数、每个域名的并发数和带宽上限(字节/秒，None 为不限速)
+WORKERS = 16
+PER_HOST = 8
+BANDWIDTH = None
 
 
 def init_logger(
@@ -73,20 +77,19 @@ def init_logger(
 
 
 def main():
-    while True:
-        for video_id in TASKS:
-            if not TASKS.get(video_id):
-                video_client = VideoClient(video_id=video_id)
-                TASKS[video_id] = video_client
-                video_client.start()
-            else:
-                video_client = TASKS[video_id]
-
-            if video_client.running:
-                logger.info("视频正在下载")
-            else:
-                video_client.start()
-        time.sleep(60)
+    manager = VideoDownloadManager(
+        workers=WORKERS, per_host=PER_HOST, bandwidth=BANDWIDTH
+    )
+    for video_id in TASKS:
+        manager.add(video_id)
+    manager.start()
+    try:
+        # 所有视频下载结束前定期输出进度
+        while not manager.join(timeout=60):
+            for video_id, status in manager.status().items():
+                logger.info(f"视频{video_id}:{status}")
+    finally:
+        manager.stop()
 
 
 if __name__ == '__main__':